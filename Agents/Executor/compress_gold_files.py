@@ -0,0 +1,62 @@
+import os
+import sys
+import json
+import argparse
+
+from test_farm_compression import is_compressed, compress_file
+
+# Compresses gold files referenced by test.testfarm descriptions in a tests
+# repository and rewrites the descriptions to point at the compressed files.
+#
+# usage: python compress_gold_files.py <tests repository dir> [--compression zst|gz] [--min-size-kb N] [--keep-originals]
+
+def compress_test_gold_files(test_description_file: str, compression: str, min_size_bytes: int, keep_originals: bool) -> int:
+    with open(test_description_file, 'r') as f:
+        data = json.load(f)
+
+    test_dir = os.path.dirname(test_description_file)
+    compressed_count = 0
+
+    for diff in data.get("diffs", []):
+        gold = diff["gold"]
+        gold_file = os.path.join(test_dir, gold)
+
+        if is_compressed(gold) or not os.path.exists(gold_file):
+            continue
+
+        if os.path.getsize(gold_file) < min_size_bytes:
+            continue
+
+        compress_file(gold_file, compression, remove_original=not keep_originals)
+        diff["gold"] = f"{gold}.{compression}"
+        compressed_count += 1
+
+        print(f"Compressed {gold_file}")
+
+    if compressed_count > 0:
+        with open(test_description_file, 'w') as f:
+            json.dump(data, f, indent=4)
+
+    return compressed_count
+
+def main():
+    parser = argparse.ArgumentParser(description="Compress gold files of all tests in a TestFarm tests repository.")
+    parser.add_argument("repository_dir")
+    parser.add_argument("--compression", choices=["zst", "gz"], default="zst")
+    parser.add_argument("--min-size-kb", type=int, default=64)
+    parser.add_argument("--keep-originals", action="store_true")
+    args = parser.parse_args()
+
+    total = 0
+    for root, dirs, files in os.walk(args.repository_dir):
+        if ".git" in dirs:
+            dirs.remove(".git")
+
+        if "test.testfarm" in files:
+            total += compress_test_gold_files(os.path.join(root, "test.testfarm"), args.compression, args.min_size_kb * 1024, args.keep_originals)
+
+    print(f"Compressed {total} gold file(s).")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -8,6 +8,8 @@ import psutil
 import os
 import time
 import logging
+import json
+import math
 
 from test_farm_service_config import Config
 
@@ -67,6 +69,7 @@ __all__ = [
     'complete_benchmark',
     'upload_diff',
     'upload_benchmark_results',
+    'upload_benchmark_profile',
     'upload_output'
 ]
 
@@ -271,15 +274,20 @@ class BenchmarkRun:
     overall_creation_timestamp: datetime
     overall_status: str
 
+    # A/B mode: the run compares its artifacts against these baseline artifacts on the same host
+    baseline_artifacts: list = None
+
     @staticmethod
     def from_dict(config: Config, data: dict) -> 'BenchmarkRun':
-        artifacts_ids = data['Artifacts'] if 'Artifacts' in data and data['Artifacts'] else []
+        def resolve_artifacts(key: str) -> list:
+            artifacts_ids = data[key] if key in data and data[key] else []
 
-        artifacts = []
-        for artifact_id in artifacts_ids:
-            artifact = get_artifact(config, artifact_id)
-            if artifact:
-                artifacts.append(artifact)
+            artifacts = []
+            for artifact_id in artifacts_ids:
+                artifact = get_artifact(config, artifact_id)
+                if artifact:
+                    artifacts.append(artifact)
+            return artifacts
 
         return BenchmarkRun(
             id=data['Id'],
@@ -287,9 +295,10 @@ class BenchmarkRun:
             suite_name=data['SuiteName'],
             name=data['Name'],
             grid_name=data['GridName'],
-            artifacts=artifacts,
+            artifacts=resolve_artifacts('Artifacts'),
             overall_creation_timestamp=datetime.fromisoformat(data['OverallCreationTimestamp'].replace('Z', '+00:00')),
-            overall_status=data['OverallStatus']
+            overall_status=data['OverallStatus'],
+            baseline_artifacts=resolve_artifacts('BaselineArtifacts')
         )
 
 @dataclass
@@ -441,6 +450,10 @@ class BenchmarkResult:
     execution_end_timestamp: Optional[datetime]
     results: Optional[str]
 
+    # sharded benchmarks: this result covers shard shard_index of shard_count, run by one host
+    shard_index: int = 0
+    shard_count: int = 1
+
     @staticmethod
     def from_dict(config: Config, data: dict) -> 'BenchmarkResult':
         return BenchmarkResult(
@@ -456,6 +469,9 @@ class BenchmarkResult:
             # optional fields
             execution_end_timestamp=datetime.fromisoformat(data['ExecutionEndTimestamp'].replace('Z', '+00:00')) if data['ExecutionEndTimestamp'] else None,
             results=data['Results'] if data['Results'] else None,
+
+            shard_index=data.get('ShardIndex') or 0,
+            shard_count=data.get('ShardCount') or 1
         )
 
 def get_artifact(config: Config, artifact_id: int) -> Optional[Artifact]:
@@ -558,13 +574,16 @@ def update_host_status(status: str, host: Host, config: Config):
     if not response.ok:
         raise RuntimeError(f"Failed to update host status with status code: {response.status_code} and message: {response.reason}")
 
-def complete_test(test_result: TestResult, status: str, config: Config):
+def complete_test(test_result: TestResult, status: str, config: Config, resource_usage: Optional[dict] = None):
     url = urljoin(config.test_farm_api.base_url, "complete-test")
     
     payload = {
         "TestResultId": test_result.id, 
         "Status": status
     }
+
+    if resource_usage:
+        payload["ResourceUsage"] = resource_usage
     
     response = RetryingHttpClient.request(
         requests.post,
@@ -576,12 +595,15 @@ def complete_test(test_result: TestResult, status: str, config: Config):
     if not response.ok:
         raise RuntimeError(f"Failed to complete test result with status code: {response.status_code} and message: {response.reason}")
     
-def complete_benchmark(benchmark_result: BenchmarkResult, config: Config):
+def complete_benchmark(benchmark_result: BenchmarkResult, config: Config, resource_usage: Optional[dict] = None):
     url = urljoin(config.test_farm_api.base_url, "complete-benchmark")
     
     payload = {
         "BenchmarkResultId": benchmark_result.id
     }
+
+    if resource_usage:
+        payload["ResourceUsage"] = resource_usage
     
     response = RetryingHttpClient.request(
         requests.post,
@@ -593,12 +615,25 @@ def complete_benchmark(benchmark_result: BenchmarkResult, config: Config):
     if not response.ok:
         raise RuntimeError(f"Failed to complete benchmark result with status code: {response.status_code} and message: {response.reason}")
 
-def upload_benchmark_results(benchmark_result: BenchmarkResult, config: Config, report_file_path: Optional[str] = None):
+def _strict_json_value(value):
+    # NaN and infinities (e.g. the t statistic of identical pairs) are not valid JSON, send them as null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _strict_json_value(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_strict_json_value(item) for item in value]
+    return value
+
+def upload_benchmark_results(benchmark_result: BenchmarkResult, config: Config, report_file_path: Optional[str] = None, analysis: Optional[dict] = None):
     url = urljoin(config.test_farm_api.base_url, "upload-benchmark-results")
     
     form_data = {
         'BenchmarkResultId': str(benchmark_result.id)
     }
+
+    if analysis:
+        form_data['Analysis'] = json.dumps(_strict_json_value(analysis), allow_nan=False)
     
     files = {}
     
@@ -623,6 +658,29 @@ def upload_benchmark_results(benchmark_result: BenchmarkResult, config: Config,
     if not response.ok:
         raise RuntimeError(f"Failed to upload benchmark results with status code: {response.status_code} and message: {response.reason}")
 
+def upload_benchmark_profile(benchmark_result: BenchmarkResult, config: Config, profile_file_path: str):
+    url = urljoin(config.test_farm_api.base_url, "upload-benchmark-profile")
+
+    form_data = {
+        'BenchmarkResultId': str(benchmark_result.id)
+    }
+
+    with open(profile_file_path, 'rb') as profile_file:
+        files = {
+            'profile': (os.path.basename(profile_file_path), profile_file, 'application/octet-stream')
+        }
+
+        response = RetryingHttpClient.request(
+            requests.post,
+            url,
+            data=form_data,
+            files=files,
+            timeout=config.test_farm_api.timeout
+        )
+
+    if not response.ok:
+        raise RuntimeError(f"Failed to upload benchmark profile with status code: {response.status_code} and message: {response.reason}")
+
 def upload_diff(test_result: TestResult, name: str, status: str, config: Config, report_file_path: Optional[str] = None):
     url = urljoin(config.test_farm_api.base_url, "upload-diff")
     
@@ -0,0 +1,267 @@
+import os
+import time
+import socket
+import platform
+import subprocess
+from typing import List, Optional
+
+import psutil
+
+try:
+    import win32job
+except ImportError:
+    win32job = None
+
+try:
+    import winreg
+except ImportError:
+    winreg = None
+
+from test_farm_tests import BenchmarkEnvironment
+from test_farm_resource_usage import ResourceUsage
+
+__all__ = [
+    'BenchmarkEnvironmentManager',
+    'pin_process_tree',
+    'environment_fingerprint'
+]
+
+# Other processes above either limit are listed in the fingerprint as heavy
+_HEAVY_PROCESS_CPU_PERCENT = 5.0
+_HEAVY_PROCESS_RSS_BYTES = 1024 * 1024 * 1024
+_HEAVY_PROCESS_LIMIT = 10
+
+def pin_process_tree(job, pid: int, cores: List[int]):
+    """Restrict a started command and its children to the given logical CPUs."""
+    if job is not None and win32job is not None:
+        # A job affinity limit applies to every process in the job, including children started later
+        info = win32job.QueryInformationJobObject(job, win32job.JobObjectExtendedLimitInformation)
+        info['BasicLimitInformation']['LimitFlags'] |= win32job.JOB_OBJECT_LIMIT_AFFINITY
+        info['BasicLimitInformation']['Affinity'] = sum(1 << core for core in cores)
+        win32job.SetInformationJobObject(job, win32job.JobObjectExtendedLimitInformation, info)
+        return
+
+    # Elsewhere children inherit the affinity of their parent; pin those already started as well
+    process = psutil.Process(pid)
+    for member in [process] + process.children(recursive=True):
+        try:
+            member.cpu_affinity(cores)
+        except psutil.NoSuchProcess:
+            pass
+
+def environment_fingerprint() -> dict:
+    """Description of the host and its current state, to tell apart results measured in different conditions."""
+    memory = psutil.virtual_memory()
+    frequency = psutil.cpu_freq()
+
+    return {
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'cpu_model': _cpu_model(),
+        'cpu_count_logical': psutil.cpu_count(),
+        'cpu_count_physical': psutil.cpu_count(logical=False),
+        'cpu_frequency_mhz': {'current': frequency.current, 'min': frequency.min, 'max': frequency.max} if frequency else None,
+        'power_policy': _power_policy(),
+        'cpu_percent': psutil.cpu_percent(interval=0.5),
+        'load_average': list(psutil.getloadavg()),
+        'memory_total_bytes': memory.total,
+        'memory_available_bytes': memory.available,
+        'boot_time': psutil.boot_time(),
+        'heavy_processes': _heavy_processes()
+    }
+
+class BenchmarkEnvironmentManager:
+    ############################################################################
+    # Controls the conditions benchmark iterations run in. Before an iteration
+    # it waits until the system is quiet; around it, it measures how much CPU
+    # was used by anything other than the benchmark, so that noisy iterations
+    # can be rerun. Without a config it only records fingerprints.
+    ############################################################################
+    _POLL_INTERVAL = 0.5
+
+    def __init__(self, config: Optional[BenchmarkEnvironment]):
+        self.config = config
+        self.fingerprint_start = environment_fingerprint()
+        self.iterations = []
+        self.reruns = 0
+
+        self._quiescence = None
+        self._cpu_times_start = None
+        self._iteration_start = None
+        self._cpu_times_end = None
+        self._iteration_end = None
+        self._exit_usage = None
+
+    @property
+    def cores(self) -> Optional[List[int]]:
+        return self.config.cores if self.config else None
+
+    def wait_for_quiescence(self):
+        """Block until system CPU and disk I/O stay below the limits for quiet_seconds, or until the timeout."""
+        if self.config is None:
+            self._quiescence = None
+            return
+
+        started = time.monotonic()
+        quiet_since = None
+        psutil.cpu_percent(interval=None)
+        last_disk_bytes, last_time = _disk_bytes(), started
+
+        while True:
+            time.sleep(self._POLL_INTERVAL)
+
+            now = time.monotonic()
+            cpu_percent = psutil.cpu_percent(interval=None)
+            disk_bytes = _disk_bytes()
+            disk_rate = (disk_bytes - last_disk_bytes) / (now - last_time) if now > last_time else 0.0
+            last_disk_bytes, last_time = disk_bytes, now
+
+            if cpu_percent <= self.config.max_cpu_percent and disk_rate <= self.config.max_disk_bytes_per_second:
+                quiet_since = quiet_since if quiet_since is not None else now - self._POLL_INTERVAL
+            else:
+                quiet_since = None
+
+            quiet = quiet_since is not None and now - quiet_since >= self.config.quiet_seconds
+            if quiet or now - started >= self.config.quiescence_timeout:
+                break
+
+        self._quiescence = {
+            'quiet': quiet,
+            'waited_seconds': now - started,
+            'cpu_percent': cpu_percent,
+            'disk_bytes_per_second': disk_rate
+        }
+
+    def begin_iteration(self):
+        self._cpu_times_start = self._busy_cpu_seconds()
+        self._iteration_start = time.perf_counter()
+        self._cpu_times_end = None
+        self._iteration_end = None
+        self._exit_usage = None
+
+    def stop_iteration(self, usage: Optional[ResourceUsage] = None):
+        """Close the measured window as soon as the benchmark command exits, before any clean-up or post-processing.
+
+        The usage sampled at the same moment is what the benchmark itself consumed within the window.
+        """
+        self._cpu_times_end = self._busy_cpu_seconds()
+        self._iteration_end = time.perf_counter()
+        self._exit_usage = usage
+
+    def end_iteration(self, usage: Optional[ResourceUsage]) -> bool:
+        """Record the finished iteration and return whether it was too noisy to keep."""
+        if self._iteration_end is None:
+            self.stop_iteration()
+
+        # Final usage also covers children lingering after the exit, outside the window
+        if self._exit_usage is not None:
+            usage = self._exit_usage
+
+        wall_time = self._iteration_end - self._iteration_start
+        background_percent = None
+
+        # Busy time of the watched CPUs minus the CPU time of the benchmark tree itself
+        if usage is not None and usage.cpu_user_seconds is not None and wall_time > 0:
+            own_seconds = usage.cpu_user_seconds + (usage.cpu_system_seconds or 0.0)
+            capacity = wall_time * (len(self.cores) if self.cores else psutil.cpu_count())
+            background_seconds = max(0.0, self._cpu_times_end - self._cpu_times_start - own_seconds)
+            background_percent = background_seconds / capacity * 100
+
+        limit = self.config.max_background_cpu_percent if self.config else None
+        noisy = limit is not None and background_percent is not None and background_percent > limit
+
+        self.iterations.append({
+            'quiescence': self._quiescence,
+            'wall_time_seconds': wall_time,
+            'background_cpu_percent': background_percent,
+            'noisy': noisy
+        })
+        return noisy
+
+    def can_rerun(self, attempt: int) -> bool:
+        return self.config is not None and attempt < self.config.max_reruns
+
+    def summary(self) -> dict:
+        return {
+            'cores': self.cores,
+            'fingerprint_start': self.fingerprint_start,
+            'fingerprint_end': environment_fingerprint(),
+            'reruns': self.reruns,
+            'iterations': self.iterations
+        }
+
+    def _busy_cpu_seconds(self) -> float:
+        if self.cores:
+            per_cpu = psutil.cpu_times(percpu=True)
+            return sum(_busy_seconds(per_cpu[core]) for core in self.cores if core < len(per_cpu))
+        return _busy_seconds(psutil.cpu_times())
+
+def _busy_seconds(times) -> float:
+    # guest time is already part of user time on Linux; idle and iowait are not busy
+    fields = ('user', 'nice', 'system', 'irq', 'softirq', 'steal', 'interrupt', 'dpc')
+    return sum(getattr(times, name, 0.0) for name in fields)
+
+def _disk_bytes() -> int:
+    counters = psutil.disk_io_counters()
+    return counters.read_bytes + counters.write_bytes if counters else 0
+
+def _cpu_model() -> str:
+    if winreg is not None:
+        try:
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"HARDWARE\DESCRIPTION\System\CentralProcessor\0") as key:
+                return winreg.QueryValueEx(key, "ProcessorNameString")[0].strip()
+        except OSError:
+            pass
+
+    try:
+        with open("/proc/cpuinfo", 'r') as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+
+    return platform.processor()
+
+def _power_policy() -> Optional[str]:
+    # CPU frequency governor on Linux, active power scheme on Windows
+    try:
+        with open("/sys/devices/system/cpu/cpu0/cpufreq/scaling_governor", 'r') as f:
+            return f.read().strip()
+    except OSError:
+        pass
+
+    if os.name == 'nt':
+        try:
+            output = subprocess.run(["powercfg", "/getactivescheme"], capture_output=True, text=True, timeout=10).stdout
+            return output[output.index("(") + 1:output.rindex(")")] if "(" in output else output.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            pass
+
+    return None
+
+def _heavy_processes() -> list:
+    own_pid = os.getpid()
+    processes = []
+    for process in psutil.process_iter(['pid', 'name', 'memory_info']):
+        try:
+            process.cpu_percent(interval=None)
+            processes.append(process)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+
+    time.sleep(0.5)
+
+    heavy = []
+    for process in processes:
+        try:
+            cpu_percent = process.cpu_percent(interval=None)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+
+        rss = process.info['memory_info'].rss if process.info['memory_info'] else 0
+        if process.pid != own_pid and (cpu_percent >= _HEAVY_PROCESS_CPU_PERCENT or rss >= _HEAVY_PROCESS_RSS_BYTES):
+            heavy.append({'pid': process.pid, 'name': process.info['name'], 'cpu_percent': cpu_percent, 'rss_bytes': rss})
+
+    heavy.sort(key=lambda process: (process['cpu_percent'], process['rss_bytes']), reverse=True)
+    return heavy[:_HEAVY_PROCESS_LIMIT]
@@ -0,0 +1,69 @@
+import os
+import gzip
+import shutil
+from typing import BinaryIO, Optional
+
+import pyzstd
+
+__all__ = [
+    'COMPRESSED_EXTENSIONS',
+    'is_compressed',
+    'strip_compression_extension',
+    'open_decompressed',
+    'decompressed_size',
+    'compress_file'
+]
+
+COMPRESSED_EXTENSIONS = ('.gz', '.zst')
+
+_COPY_BUFFER_SIZE = 1024 * 1024
+
+def is_compressed(file_path: str) -> bool:
+    return file_path.lower().endswith(COMPRESSED_EXTENSIONS)
+
+def strip_compression_extension(file_path: str) -> str:
+    """Return the path without its .gz/.zst extension (e.g. "out.txt.zst" -> "out.txt")."""
+    return os.path.splitext(file_path)[0] if is_compressed(file_path) else file_path
+
+def open_decompressed(file_path: str) -> BinaryIO:
+    """Open a file for binary reading, transparently decompressing .gz and .zst files as a stream."""
+    extension = os.path.splitext(file_path)[1].lower()
+
+    if extension == '.gz':
+        return gzip.open(file_path, 'rb')
+    if extension == '.zst':
+        return pyzstd.ZstdFile(file_path, 'rb')
+    return open(file_path, 'rb')
+
+def decompressed_size(file_path: str, max_bytes: Optional[int] = None) -> Optional[int]:
+    """Size of the decompressed content, counted while streaming; None as soon as it exceeds max_bytes."""
+    size = 0
+    with open_decompressed(file_path) as source:
+        for chunk in iter(lambda: source.read(_COPY_BUFFER_SIZE), b''):
+            size += len(chunk)
+            if max_bytes is not None and size > max_bytes:
+                return None
+    return size
+
+def compress_file(file_path: str, compression: str = 'zst', level: int = 19, remove_original: bool = False) -> str:
+    """Compress a file next to the original (adding .gz or .zst) and return the compressed file path."""
+    if compression not in ('gz', 'zst'):
+        raise ValueError(f"Unsupported compression: {compression}. Use \"gz\" or \"zst\".")
+
+    output_path = f"{file_path}.{compression}"
+    temp_path = f"{output_path}.tmp"
+
+    with open(file_path, 'rb') as source:
+        if compression == 'gz':
+            with gzip.open(temp_path, 'wb', compresslevel=min(level, 9)) as target:
+                shutil.copyfileobj(source, target, _COPY_BUFFER_SIZE)
+        else:
+            with pyzstd.ZstdFile(temp_path, 'wb', level_or_option=level) as target:
+                shutil.copyfileobj(source, target, _COPY_BUFFER_SIZE)
+
+    os.replace(temp_path, output_path)
+
+    if remove_original:
+        os.remove(file_path)
+
+    return output_path
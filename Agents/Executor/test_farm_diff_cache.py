@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from test_farm_file_compare import hash_file
+
+__all__ = [
+    'CachedDiff',
+    'DiffCache'
+]
+
+@dataclass
+class CachedDiff:
+    key: str
+    status: str
+    report_file: Optional[str]  # None for results without a report (e.g. "passed")
+
+class DiffCache:
+    ############################################################################
+    # Local cache of diff results keyed by the content of both compared files,
+    # the encoding and the diff options. Entries are evicted in least recently
+    # used order once the cache grows beyond its disk quota.
+    ############################################################################
+    _MAX_MEMOIZED_HASHES = 4096
+
+    def __init__(self, cache_dir: str, max_size_bytes: int):
+        self._cache_dir = cache_dir
+        self._max_size_bytes = max_size_bytes
+        self._file_hashes = OrderedDict()
+
+        os.makedirs(self._cache_dir, exist_ok=True)
+
+    def hash_file(self, file_path: str) -> str:
+        """Content hash of the file, memoized by path, size and modification time."""
+        stat = os.stat(file_path)
+        memo_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+
+        if memo_key in self._file_hashes:
+            self._file_hashes.move_to_end(memo_key)
+            return self._file_hashes[memo_key]
+
+        file_hash = hash_file(file_path)
+
+        self._file_hashes[memo_key] = file_hash
+        if len(self._file_hashes) > DiffCache._MAX_MEMOIZED_HASHES:
+            self._file_hashes.popitem(last=False)
+
+        return file_hash
+
+    @staticmethod
+    def make_key(gold_hash: str, new_hash: str, encoding: str, options: dict) -> str:
+        key_source = json.dumps([gold_hash, new_hash, encoding, options], sort_keys=True, default=str)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedDiff]:
+        entry_file = self._entry_path(key)
+        if not os.path.exists(entry_file):
+            return None
+
+        try:
+            with open(entry_file, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Dropping unreadable diff cache entry {key}: {e}")
+            self._remove_entry(key)
+            return None
+
+        report_file = self._report_path(key) if entry.get('has_report') else None
+        if report_file and not os.path.exists(report_file):
+            self._remove_entry(key)
+            return None
+
+        # Touch the entry so that eviction treats it as recently used
+        now = time.time()
+        os.utime(entry_file, (now, now))
+
+        return CachedDiff(key, entry['status'], report_file)
+
+    def put(self, key: str, status: str, report_file: Optional[str] = None):
+        has_report = bool(report_file) and os.path.exists(report_file) and os.path.getsize(report_file) > 0
+
+        try:
+            if has_report:
+                temp_report = self._report_path(key) + '.tmp'
+                shutil.copyfile(report_file, temp_report)
+                os.replace(temp_report, self._report_path(key))
+
+            # The entry file is written last, so a half-written report is never served
+            temp_entry = self._entry_path(key) + '.tmp'
+            with open(temp_entry, 'w', encoding='utf-8') as f:
+                json.dump({'status': status, 'has_report': has_report, 'created': time.time()}, f)
+            os.replace(temp_entry, self._entry_path(key))
+        except OSError as e:
+            logging.warning(f"Failed to store diff cache entry {key}: {e}")
+            return
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in its quota."""
+        entries = {}
+        total_size = 0
+
+        for file_name in os.listdir(self._cache_dir):
+            key, extension = os.path.splitext(file_name)
+            try:
+                stat = os.stat(os.path.join(self._cache_dir, file_name))
+            except OSError:
+                continue
+
+            entry = entries.setdefault(key, {'size': 0, 'last_used': 0})
+            entry['size'] += stat.st_size
+            if extension == '.json':
+                entry['last_used'] = stat.st_mtime
+            total_size += stat.st_size
+
+        if total_size <= self._max_size_bytes:
+            return
+
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['last_used']):
+            if total_size <= self._max_size_bytes:
+                break
+            self._remove_entry(key)
+            total_size -= entry['size']
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, f"{key}.json")
+
+    def _report_path(self, key: str) -> str:
+        return os.path.join(self._cache_dir, f"{key}.html")
+
+    def _remove_entry(self, key: str):
+        for path in (self._entry_path(key), self._report_path(key)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
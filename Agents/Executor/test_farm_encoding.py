@@ -0,0 +1,78 @@
+import os
+import codecs
+from collections import OrderedDict
+from typing import Optional
+
+from chardet.universaldetector import UniversalDetector
+
+from test_farm_compression import open_decompressed
+
+__all__ = [
+    'AUTO_ENCODING',
+    'EncodingDetector'
+]
+
+AUTO_ENCODING = "auto"
+
+# UTF-32 marks must be checked before UTF-16 ones, as BOM_UTF32_LE starts with BOM_UTF16_LE
+_BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+class EncodingDetector:
+    ############################################################################
+    # Detects text file encodings from a bounded sample: byte order marks
+    # first, then chardet fed incrementally until it is confident or the
+    # sample limit is reached. Results for files identified by a revision
+    # (e.g. gold files at a given tests repository commit) are cached.
+    ############################################################################
+    _DEFAULT_ENCODING = 'utf-8'
+    _MAX_CACHED_RESULTS = 4096
+
+    def __init__(self, sample_limit: int = 4 * 1024 * 1024, chunk_size: int = 64 * 1024):
+        self._sample_limit = sample_limit
+        self._chunk_size = chunk_size
+        self._cache = OrderedDict()
+
+    def detect(self, file_path: str, revision: Optional[str] = None) -> str:
+        cache_key = (os.path.abspath(file_path), revision) if revision else None
+
+        if cache_key and cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+            return self._cache[cache_key]
+
+        encoding = self._detect_uncached(file_path)
+
+        if cache_key:
+            self._cache[cache_key] = encoding
+            if len(self._cache) > EncodingDetector._MAX_CACHED_RESULTS:
+                self._cache.popitem(last=False)
+
+        return encoding
+
+    def _detect_uncached(self, file_path: str) -> str:
+        with open_decompressed(file_path) as f:
+            head = f.read(4)
+            for bom, encoding in _BOMS:
+                if head.startswith(bom):
+                    return encoding
+
+            detector = UniversalDetector()
+            detector.feed(head)
+            sampled = len(head)
+
+            while not detector.done and sampled < self._sample_limit:
+                chunk = f.read(min(self._chunk_size, self._sample_limit - sampled))
+                if not chunk:
+                    break
+                detector.feed(chunk)
+                sampled += len(chunk)
+
+            detector.close()
+
+        encoding = detector.result.get('encoding')
+        return encoding if encoding else EncodingDetector._DEFAULT_ENCODING  # Default to UTF-8 if unknown
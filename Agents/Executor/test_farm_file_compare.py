@@ -0,0 +1,146 @@
+import os
+import mmap
+import hashlib
+from dataclasses import dataclass
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from test_farm_compression import is_compressed, open_decompressed
+
+__all__ = [
+    'FileComparison',
+    'compare_files',
+    'hash_file'
+]
+
+_CHUNK_SIZE = 8 * 1024 * 1024        # bytes hashed per task
+_LOCATE_BLOCK_SIZE = 64 * 1024       # granularity used to pin down the first mismatching byte
+_MAX_WORKERS = min(8, os.cpu_count() or 1)
+
+@dataclass
+class FileComparison:
+    identical: bool
+    gold_size: Optional[int]  # decompressed size; None if a compressed stream was not read to the end
+    new_size: Optional[int]
+    first_mismatch_offset: Optional[int] = None  # None when files are identical
+
+def _chunk_digest(view: memoryview) -> bytes:
+    # hashlib releases the GIL for large buffers, so chunks are hashed truly in parallel
+    return hashlib.blake2b(view, digest_size=16).digest()
+
+def _locate_first_mismatch(gold_data, new_data, start: int, end: int) -> int:
+    """Return the offset of the first differing byte in [start, end), or end if the range is equal."""
+    block_start = start
+    while block_start < end:
+        block_end = min(block_start + _LOCATE_BLOCK_SIZE, end)
+        if gold_data[block_start:block_end] != new_data[block_start:block_end]:
+            low, high = block_start, block_end
+            while high - low > 1:
+                middle = (low + high) // 2
+                if gold_data[low:middle] == new_data[low:middle]:
+                    low = middle
+                else:
+                    high = middle
+            return low
+        block_start = block_end
+    return end
+
+def _compare_mapped(gold_map: mmap.mmap, new_map: mmap.mmap, length: int, chunk_size: int, max_workers: int) -> Optional[int]:
+    """Compare the first `length` bytes of both maps, returning the first mismatch offset or None."""
+    gold_view = memoryview(gold_map)
+    new_view = memoryview(new_map)
+    try:
+        offsets = list(range(0, length, chunk_size))
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Hash one batch of chunks at a time so that a mismatch early in the file stops the scan
+            for batch_start in range(0, len(offsets), max_workers):
+                batch = offsets[batch_start:batch_start + max_workers]
+
+                futures = []
+                for offset in batch:
+                    end = min(offset + chunk_size, length)
+                    futures.append((
+                        offset,
+                        end,
+                        executor.submit(_chunk_digest, gold_view[offset:end]),
+                        executor.submit(_chunk_digest, new_view[offset:end])
+                    ))
+
+                for offset, end, gold_future, new_future in futures:
+                    if gold_future.result() != new_future.result():
+                        for _, _, pending_gold, pending_new in futures:
+                            pending_gold.cancel()
+                            pending_new.cancel()
+                        return _locate_first_mismatch(gold_map, new_map, offset, end)
+
+        return None
+    finally:
+        gold_view.release()
+        new_view.release()
+
+def _read_chunk(stream, size: int) -> bytes:
+    # Decompressing readers may return short reads before the end of the stream
+    chunk = stream.read(size)
+    while chunk and len(chunk) < size:
+        more = stream.read(size - len(chunk))
+        if not more:
+            break
+        chunk += more
+    return chunk
+
+def _compare_streams(gold_file: str, new_file: str, chunk_size: int) -> FileComparison:
+    """Compare decompressed contents chunk by chunk, for files that cannot be memory-mapped directly."""
+    position = 0
+
+    with open_decompressed(gold_file) as gold_stream, open_decompressed(new_file) as new_stream:
+        while True:
+            gold_chunk = _read_chunk(gold_stream, chunk_size)
+            new_chunk = _read_chunk(new_stream, chunk_size)
+
+            if gold_chunk != new_chunk:
+                common_length = min(len(gold_chunk), len(new_chunk))
+                return FileComparison(False, None, None, position + _locate_first_mismatch(gold_chunk, new_chunk, 0, common_length))
+
+            if not gold_chunk:
+                return FileComparison(True, position, position)
+
+            position += len(gold_chunk)
+
+def compare_files(gold_file: str, new_file: str, chunk_size: int = _CHUNK_SIZE, max_workers: int = _MAX_WORKERS) -> FileComparison:
+    """Byte-compare two files using memory-mapped chunks hashed in parallel, stopping at the first mismatch."""
+    if is_compressed(gold_file) or is_compressed(new_file):
+        return _compare_streams(gold_file, new_file, chunk_size)
+
+    gold_size = os.path.getsize(gold_file)
+    new_size = os.path.getsize(new_file)
+    common_size = min(gold_size, new_size)
+
+    if common_size == 0:
+        if gold_size == new_size:
+            return FileComparison(True, gold_size, new_size)
+        return FileComparison(False, gold_size, new_size, 0)
+
+    with open(gold_file, 'rb') as gold_f, open(new_file, 'rb') as new_f:
+        with mmap.mmap(gold_f.fileno(), 0, access=mmap.ACCESS_READ) as gold_map, \
+             mmap.mmap(new_f.fileno(), 0, access=mmap.ACCESS_READ) as new_map:
+            first_mismatch = _compare_mapped(gold_map, new_map, common_size, chunk_size, max_workers)
+
+    if first_mismatch is None and gold_size == new_size:
+        return FileComparison(True, gold_size, new_size)
+
+    # Either a byte differs or one file is a prefix of the other
+    return FileComparison(False, gold_size, new_size, first_mismatch if first_mismatch is not None else common_size)
+
+def hash_file(file_path: str, chunk_size: int = _CHUNK_SIZE) -> str:
+    """Return a hex digest of the (decompressed) file content, read in large chunks."""
+    hasher = hashlib.blake2b(digest_size=32)
+    with open_decompressed(file_path) as f:
+        buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        while True:
+            read = f.readinto(buffer)
+            if not read:
+                break
+            hasher.update(view[:read])
+    return hasher.hexdigest()
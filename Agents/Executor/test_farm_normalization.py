@@ -0,0 +1,194 @@
+import io
+import os
+import re
+import difflib
+import shutil
+import logging
+import subprocess
+from typing import Iterator, List, Optional, Tuple
+
+from test_farm_tests import NormalizationRule
+from test_farm_compression import open_decompressed, strip_compression_extension
+
+__all__ = [
+    'NORMALIZED_ENCODING',
+    'Normalizer'
+]
+
+# Normalized copies are always written in UTF-8, whatever the source encoding
+NORMALIZED_ENCODING = 'utf-8'
+
+_HUNK_HEADER = re.compile(r'^@@ -\d+(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+_NUMBER_PATTERN = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?')
+
+class Normalizer:
+    ############################################################################
+    # Applies the normalization rules of a diff pair to both compared files
+    # line by line, so that volatile content (timestamps, GUIDs, temp paths,
+    # machine names, float noise) does not show up as differences. Rules are
+    # compiled once and files are streamed, so memory use does not depend on
+    # file size; numeric tolerance only holds one diff hunk at a time.
+    ############################################################################
+    def __init__(self, rules: List[NormalizationRule]):
+        self._replacements = []
+        self._tolerances = []
+        ignore_patterns = []
+
+        for rule in rules:
+            if rule.type == "replace":
+                if not rule.pattern:
+                    raise ValueError("Normalization rule \"replace\" requires a pattern.")
+                self._replacements.append((re.compile(rule.pattern), rule.replacement))
+            elif rule.type == "ignore_line":
+                if not rule.pattern:
+                    raise ValueError("Normalization rule \"ignore_line\" requires a pattern.")
+                ignore_patterns.append(f"(?:{rule.pattern})")
+            elif rule.type == "numeric_tolerance":
+                if rule.tolerance < 0:
+                    raise ValueError("Normalization rule \"numeric_tolerance\" requires a non-negative tolerance.")
+                line_filter = re.compile(rule.pattern) if rule.pattern else None
+                self._tolerances.append((line_filter, rule.tolerance, rule.relative))
+            else:
+                raise ValueError(f"Unknown normalization rule type: {rule.type}")
+
+        # All ignore patterns are merged, so each line is searched only once
+        self._ignore = re.compile("|".join(ignore_patterns)) if ignore_patterns else None
+
+    def normalize_line(self, line: str) -> Optional[str]:
+        """Return the normalized line, or None if the line is ignored."""
+        if self._ignore and self._ignore.search(line):
+            return None
+
+        for pattern, replacement in self._replacements:
+            line = pattern.sub(replacement, line)
+
+        return line
+
+    def normalize_files(self, gold_file: str, new_file: str, encoding: str, output_dir: str) -> Tuple[str, str]:
+        """Write normalized copies of both files to output_dir and return their paths."""
+        os.makedirs(output_dir, exist_ok=True)
+
+        gold_output = os.path.join(output_dir, f"gold_{os.path.basename(strip_compression_extension(gold_file))}")
+        new_output = os.path.join(output_dir, f"new_{os.path.basename(strip_compression_extension(new_file))}")
+
+        with io.TextIOWrapper(open_decompressed(gold_file), encoding=encoding, errors='replace') as gold_in, \
+             io.TextIOWrapper(open_decompressed(new_file), encoding=encoding, errors='replace') as new_in, \
+             open(gold_output, 'w', encoding=NORMALIZED_ENCODING) as gold_out, \
+             open(new_output, 'w', encoding=NORMALIZED_ENCODING) as new_out:
+
+            gold_out.writelines(self._normalized_lines(gold_in))
+            new_out.writelines(self._normalized_lines(new_in))
+
+        if self._tolerances:
+            raw_new_output = f"{new_output}.raw"
+            os.replace(new_output, raw_new_output)
+            self.apply_tolerance(gold_output, raw_new_output, new_output)
+            os.remove(raw_new_output)
+
+        return gold_output, new_output
+
+    def apply_tolerance(self, gold_file: str, new_file: str, output_file: str):
+        """Copy new_file to output_file, replacing lines within tolerance of the gold lines they are paired with.
+
+        Lines are only paired inside the hunks of a zero-context git diff, aligned there on the lines with
+        their numbers blanked out, so inserted or deleted lines never shift the pairing. The diff is streamed
+        hunk by hunk alongside the new file, so memory use is bounded by the largest hunk.
+        """
+        try:
+            process = subprocess.Popen(
+                ['git', 'diff', '--no-index', '--no-color', '--text', '--unified=0', '--', gold_file, new_file],
+                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+            )
+        except OSError:
+            logging.warning("git not available, numeric tolerance rules are not applied")
+            shutil.copyfile(new_file, output_file)
+            return
+
+        # Lines end at "\n" only, as in git; other line endings stay part of the line
+        with process, \
+             io.TextIOWrapper(process.stdout, encoding=NORMALIZED_ENCODING, errors='replace', newline='\n') as diff_lines, \
+             open(new_file, 'r', encoding=NORMALIZED_ENCODING, newline='\n') as new_in, \
+             open(output_file, 'w', encoding=NORMALIZED_ENCODING, newline='') as new_out:
+            copied = 0
+            for new_start, gold_lines, new_lines in _zero_context_hunks(diff_lines):
+                if not new_lines or not gold_lines:
+                    continue
+
+                replacements = {}
+                matcher = difflib.SequenceMatcher(None, [_skeleton(line) for line in gold_lines], [_skeleton(line) for line in new_lines], autojunk=False)
+                for gold_index, new_index, size in matcher.get_matching_blocks():
+                    for offset in range(size):
+                        gold_line = gold_lines[gold_index + offset]
+                        if self._within_tolerance(gold_line, new_lines[new_index + offset]):
+                            replacements[new_index + offset] = gold_line
+
+                while copied < new_start - 1:
+                    new_out.write(new_in.readline())
+                    copied += 1
+
+                for index in range(len(new_lines)):
+                    original = new_in.readline()
+                    copied += 1
+                    if index in replacements:
+                        original = replacements[index] + original[len(original.rstrip('\r\n')):]
+                    new_out.write(original)
+
+            shutil.copyfileobj(new_in, new_out)
+
+    def _normalized_lines(self, lines: Iterator[str]) -> Iterator[str]:
+        for line in lines:
+            normalized = self.normalize_line(line)
+            if normalized is not None:
+                yield normalized
+
+    def _within_tolerance(self, gold_line: str, new_line: str) -> bool:
+        if not self._tolerances:
+            return False
+
+        # The non-numeric skeleton of both lines must be identical
+        gold_parts = _NUMBER_PATTERN.split(gold_line)
+        new_parts = _NUMBER_PATTERN.split(new_line)
+        if gold_parts != new_parts:
+            return False
+
+        gold_numbers = _NUMBER_PATTERN.findall(gold_line)
+        new_numbers = _NUMBER_PATTERN.findall(new_line)
+
+        for line_filter, tolerance, relative in self._tolerances:
+            if line_filter and not line_filter.search(gold_line):
+                continue
+
+            if all(self._numbers_close(float(gold), float(new), tolerance, relative) for gold, new in zip(gold_numbers, new_numbers)):
+                return True
+
+        return False
+
+    @staticmethod
+    def _numbers_close(gold: float, new: float, tolerance: float, relative: bool) -> bool:
+        allowed = abs(gold) * tolerance if relative else tolerance
+        return abs(gold - new) <= allowed
+
+
+
+def _zero_context_hunks(diff_lines: Iterator[str]) -> Iterator[Tuple[int, List[str], List[str]]]:
+    """(first new line number, removed gold lines, added new lines) of each hunk of a --unified=0 diff."""
+    hunk = None
+    for line in diff_lines:
+        header = _HUNK_HEADER.match(line)
+        if header:
+            if hunk:
+                yield hunk
+            hunk = (int(header.group(1)), [], [])
+        elif hunk is not None and line.startswith('-'):
+            hunk[1].append(line[1:].rstrip('\r\n'))
+        elif hunk is not None and line.startswith('+'):
+            hunk[2].append(line[1:].rstrip('\r\n'))
+
+    if hunk:
+        yield hunk
+
+
+def _skeleton(line: str) -> str:
+    # The non-numeric parts of a line; lines differing only in numbers have the same skeleton
+    return _NUMBER_PATTERN.sub('\0', line)
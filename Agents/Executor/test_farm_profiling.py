@@ -0,0 +1,381 @@
+import os
+import re
+import sys
+import shlex
+import shutil
+import pstats
+import hashlib
+import logging
+import subprocess
+from html import escape
+from typing import Dict, Iterable, List, Optional
+
+from test_farm_tests import ProfileCapture
+
+__all__ = [
+    'BenchmarkProfiler',
+    'collapse_perf_script',
+    'collapse_pstats',
+    'read_collapsed',
+    'write_collapsed',
+    'top_frames',
+    'render_flame_graph'
+]
+
+_RAW_EXTENSIONS = {'perf': "perf.data", 'py-spy': "py-spy.txt", 'cprofile': "pstats"}
+_SHELL_OPERATORS = {'|', '||', '&', '&&', ';', '<', '>', '>>', '2>', '2>&1'}
+_PYTHON_EXECUTABLE = re.compile(r"^(python(\d+(\.\d+)*)?w?|py)(\.exe)?$", re.IGNORECASE)
+_PYTHON_OPTIONS_WITH_ARGUMENT = {'-W', '-X', '--check-hash-based-pycs'}
+
+# Call paths of cProfile data carrying less time than this are dropped when collapsing, in seconds
+_PSTATS_MIN_SECONDS = 1e-6
+_PSTATS_MAX_DEPTH = 256
+
+class BenchmarkProfiler:
+    ############################################################################
+    # Runs the benchmark command of selected iterations under a sampling
+    # profiler: perf on Linux, py-spy or cProfile for Python commands. The
+    # profiler output is turned into collapsed stacks ("root;...;leaf count"
+    # lines, the input of most flame graph tools) and a flame graph SVG.
+    # Commands of other iterations are left untouched.
+    ############################################################################
+
+    def __init__(self, config: ProfileCapture, output_dir: str):
+        self.config = config
+        self.output_dir = output_dir
+        self.profiles = []
+        self.failures = []
+
+        self._pending = None
+
+    def selects(self, iteration: int) -> bool:
+        """Whether the measured iteration (or A/B pair), counted from 1, is profiled."""
+        return iteration in self.config.iterations
+
+    def resolve_tool(self, command: str) -> Optional[str]:
+        python = _is_python_command(command)
+        perf = sys.platform.startswith("linux") and shutil.which("perf") is not None
+        py_spy = python and shutil.which("py-spy") is not None
+
+        if self.config.tool == "auto":
+            # Python-aware profilers show Python functions, perf would mostly show the interpreter loop
+            if py_spy:
+                return "py-spy"
+            if python:
+                return "cprofile"
+            return "perf" if perf else None
+
+        available = {'perf': perf, 'py-spy': py_spy, 'cprofile': python}
+        return self.config.tool if available[self.config.tool] else None
+
+    def wrap(self, command: str, label: str) -> str:
+        """The command running under the profiler, or the command itself when no profiler fits it."""
+        self._pending = None
+
+        tool = self.resolve_tool(command)
+        if tool is None:
+            logging.warning(f"Profiler \"{self.config.tool}\" is not available for command \"{command}\", {label} runs without profiling")
+            return command
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        raw_file = os.path.join(self.output_dir, f"{label}.{_RAW_EXTENSIONS[tool]}")
+        if os.path.exists(raw_file):
+            os.remove(raw_file)  # left by an attempt that was rerun
+
+        if tool == "perf":
+            # Through a shell so commands with pipes or redirections work; perf follows child processes
+            wrapped = f"perf record -F {self.config.frequency} -g -o {shlex.quote(raw_file)} -- sh -c {shlex.quote(command)}"
+        elif tool == "py-spy":
+            wrapped = f"py-spy record --format raw --rate {self.config.frequency} --subprocesses --output {_quote(raw_file)} -- {command}"
+        else:
+            tokens = _split(command)
+            position = _script_position(tokens)
+            output = _quote(raw_file) if os.name == 'nt' else raw_file  # shlex.join quotes it elsewhere
+            wrapped = _join(tokens[:position] + ["-m", "cProfile", "-o", output] + tokens[position:])
+
+        self._pending = (tool, label, raw_file)
+        logging.info(f"Profiling {label} with {tool}")
+        return wrapped
+
+    @property
+    def wrapping(self) -> bool:
+        """Whether the last wrapped command actually runs under a profiler."""
+        return self._pending is not None
+
+    def abandon(self, reason: str):
+        """Forget the last wrapped command, e.g. because it failed under the profiler."""
+        if self._pending is None:
+            return
+
+        tool, label, raw_file = self._pending
+        self._pending = None
+        self.failures.append({'label': label, 'tool': tool, 'reason': reason})
+
+        if os.path.exists(raw_file):
+            os.remove(raw_file)
+
+    def finish(self) -> Optional[dict]:
+        """Convert the output of the last wrapped command; profiling problems never fail the benchmark."""
+        if self._pending is None:
+            return None
+
+        tool, label, raw_file = self._pending
+        self._pending = None
+
+        if not os.path.exists(raw_file):
+            logging.warning(f"Profiler {tool} wrote no output for {label}")
+            return None
+
+        try:
+            if tool == "perf":
+                stacks = _perf_file_stacks(raw_file)
+            elif tool == "py-spy":
+                stacks = read_collapsed(raw_file)
+            else:
+                stacks = collapse_pstats(pstats.Stats(raw_file).stats)
+
+            collapsed_file = os.path.join(self.output_dir, f"{label}.collapsed.txt")
+            write_collapsed(stacks, collapsed_file)
+
+            unit = "microseconds" if tool == "cprofile" else "samples"
+            flame_graph_file = os.path.join(self.output_dir, f"{label}.svg")
+            render_flame_graph(stacks, flame_graph_file, f"{label} ({tool})", unit)
+        except Exception as e:
+            logging.error(f"Failed to process {tool} profile of {label}: {e}")
+            return None
+
+        profile = {
+            'label': label,
+            'tool': tool,
+            'unit': unit,
+            'total': sum(stacks.values()),
+            'raw_file': raw_file,
+            'collapsed_file': collapsed_file,
+            'flame_graph_file': flame_graph_file,
+            'top_frames': top_frames(stacks)
+        }
+
+        # A rerun attempt of the same iteration replaces the previous profile
+        self.profiles = [existing for existing in self.profiles if existing['label'] != label] + [profile]
+        return profile
+
+    def summary(self) -> dict:
+        return {
+            'tool': self.config.tool,
+            'iterations': self.config.iterations,
+            'frequency': self.config.frequency,
+            'profiles': [dict(profile, collapsed_file=os.path.basename(profile['collapsed_file']),
+                              flame_graph_file=os.path.basename(profile['flame_graph_file']),
+                              raw_file=os.path.basename(profile['raw_file']))
+                         for profile in self.profiles],
+            'failures': self.failures
+        }
+
+def collapse_perf_script(lines: Iterable[str]) -> Dict[str, int]:
+    """Collapsed stacks of `perf script` output: one sample per block of a header line and frame lines."""
+    stacks = {}
+    comm = None
+    frames = []
+
+    def flush():
+        if comm is not None:
+            stack = ";".join([comm] + frames[::-1])
+            stacks[stack] = stacks.get(stack, 0) + 1
+
+    for line in lines:
+        line = line.rstrip("\n")
+        if not line.strip():
+            flush()
+            comm, frames = None, []
+        elif not line[0].isspace():
+            flush()
+            header = re.match(r"^(\S.*?)\s+\d+(/\d+)?\s", line)
+            comm, frames = _frame_name(header.group(1) if header else line.split()[0]), []
+        elif comm is not None:
+            frame = re.match(r"^\s*[0-9a-fA-F]+\s+(.+?)(\s+\((.*)\))?$", line)
+            if frame:
+                symbol = re.sub(r"\+0x[0-9a-fA-F]+$", "", frame.group(1))
+                if symbol == "[unknown]" and frame.group(3):
+                    symbol = f"[{os.path.basename(frame.group(3))}]"
+                frames.append(_frame_name(symbol))
+
+    flush()
+    return stacks
+
+def collapse_pstats(stats: dict) -> Dict[str, int]:
+    """Collapsed stacks of cProfile data, weighted in microseconds.
+
+    cProfile only records caller/callee pairs, so time of a function reached through several paths is
+    split over them in proportion to the time each caller spent in it.
+    """
+    callees = {}
+    for function, (_, _, _, _, callers) in stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((function, caller_stats[3]))
+
+    roots = [function for function, (_, _, _, _, callers) in stats.items() if not set(callers) - {function}]
+    stacks = {}
+
+    # Iterative walk with the seconds flowing into each function along the current path
+    pending = [((root,), stats[root][3]) for root in roots]
+    while pending:
+        path, seconds = pending.pop()
+        function = path[-1]
+        cumulative = stats[function][3]
+        share = seconds / cumulative if cumulative > 0 else 0.0
+
+        own = stats[function][2] * share
+        if own >= _PSTATS_MIN_SECONDS:
+            stack = ";".join(_pstats_frame_name(frame) for frame in path)
+            stacks[stack] = stacks.get(stack, 0) + round(own * 1e6)
+
+        if len(path) >= _PSTATS_MAX_DEPTH:
+            continue
+
+        for callee, edge_seconds in callees.get(function, []):
+            callee_seconds = edge_seconds * share
+            if callee not in path and callee_seconds >= _PSTATS_MIN_SECONDS:
+                pending.append((path + (callee,), callee_seconds))
+
+    return {stack: weight for stack, weight in stacks.items() if weight > 0}
+
+def read_collapsed(file_path: str) -> Dict[str, int]:
+    stacks = {}
+    with open(file_path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            if stack and count.isdigit():
+                stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+def write_collapsed(stacks: Dict[str, int], file_path: str):
+    with open(file_path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(f"{stack} {count}\n")
+
+def top_frames(stacks: Dict[str, int], limit: int = 20) -> List[dict]:
+    """Frames with the highest self weight, i.e. where the samples landed."""
+    total = sum(stacks.values())
+    self_weights = {}
+    for stack, count in stacks.items():
+        leaf = stack.rsplit(";", 1)[-1]
+        self_weights[leaf] = self_weights.get(leaf, 0) + count
+
+    ranked = sorted(self_weights.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{'frame': frame, 'self': weight, 'share': weight / total if total else 0.0} for frame, weight in ranked]
+
+def render_flame_graph(stacks: Dict[str, int], output_file: str, title: str = "Flame Graph", unit: str = "samples", width: int = 1200):
+    """Write a standalone SVG flame graph, callers at the bottom; hover a frame for its weight."""
+    frame_height, padding, title_height = 16, 10, 30
+
+    root = {'value': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for frame in stack.split(";"):
+            node = node['children'].setdefault(frame, {'value': 0, 'children': {}})
+            node['value'] += count
+
+    total = root['value'] or 1
+    scale = (width - 2 * padding) / total
+
+    # (name, value, depth, x) of every frame wide enough to see
+    rectangles = []
+    pending = [("all", root, 0, padding)]
+    while pending:
+        name, node, depth, x = pending.pop()
+        if node['value'] * scale < 0.1:
+            continue
+        rectangles.append((name, node['value'], depth, x))
+
+        child_x = x
+        for child_name, child in sorted(node['children'].items()):
+            pending.append((child_name, child, depth + 1, child_x))
+            child_x += child['value'] * scale
+
+    depth_count = max(depth for _, _, depth, _ in rectangles) + 1
+    height = title_height + depth_count * frame_height + 2 * padding
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" '
+        f'font-family="Verdana, sans-serif" font-size="12">',
+        f'<rect width="100%" height="100%" fill="#f8f8f8"/>',
+        f'<text x="{width / 2}" y="{padding + 14}" text-anchor="middle" font-size="16">{escape(title)}</text>'
+    ]
+
+    for name, value, depth, x in rectangles:
+        rect_width = value * scale
+        y = height - padding - (depth + 1) * frame_height
+        label = _fit_label(name, rect_width)
+
+        parts.append(
+            f'<g><title>{escape(name)} ({value:,} {unit}, {value / total:.2%})</title>'
+            f'<rect x="{x:.2f}" y="{y}" width="{rect_width:.2f}" height="{frame_height - 1}" rx="2" fill="{_frame_color(name)}"/>'
+            + (f'<text x="{x + 3:.2f}" y="{y + 11}">{escape(label)}</text>' if label else '')
+            + '</g>'
+        )
+
+    parts.append('</svg>')
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(parts))
+
+def _perf_file_stacks(raw_file: str) -> Dict[str, int]:
+    with subprocess.Popen(["perf", "script", "-i", raw_file], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                          text=True, errors='replace') as process:
+        stacks = collapse_perf_script(process.stdout)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"perf script exited with code {process.returncode}")
+    return stacks
+
+def _is_python_command(command: str) -> bool:
+    try:
+        tokens = _split(command)
+    except ValueError:
+        return False
+
+    if not tokens or any(token in _SHELL_OPERATORS for token in tokens):
+        return False
+
+    executable = os.path.basename(tokens[0].strip('"'))
+    position = _script_position(tokens)
+    return bool(_PYTHON_EXECUTABLE.match(executable)) and position < len(tokens) and tokens[position] != "-c"
+
+def _script_position(tokens: List[str]) -> int:
+    # cProfile goes after the interpreter's own options, in front of the script or -m module
+    position = 1
+    while position < len(tokens) and tokens[position].startswith("-") and tokens[position] not in ("-m", "-c", "-"):
+        position += 2 if tokens[position] in _PYTHON_OPTIONS_WITH_ARGUMENT else 1
+    return position
+
+def _split(command: str) -> List[str]:
+    # Windows commands keep their quotes, so joining the tokens again gives back the same command
+    return shlex.split(command, posix=os.name != 'nt')
+
+def _join(tokens: List[str]) -> str:
+    return " ".join(tokens) if os.name == 'nt' else shlex.join(tokens)
+
+def _quote(path: str) -> str:
+    return f'"{path}"' if os.name == 'nt' else shlex.quote(path)
+
+def _frame_name(name: str) -> str:
+    # Semicolons separate frames and the last space the count in collapsed stacks
+    return name.replace(";", ":").replace("\n", " ")
+
+def _pstats_frame_name(function: tuple) -> str:
+    filename, line, name = function
+    if filename == "~":
+        return _frame_name(name)  # built-in, e.g. <built-in method time.sleep>
+    return _frame_name(f"{name} ({os.path.basename(filename)}:{line})")
+
+def _fit_label(name: str, rect_width: float) -> str:
+    characters = int((rect_width - 6) / 7)
+    if characters < 3:
+        return ""
+    return name if len(name) <= characters else name[:characters - 2] + ".."
+
+def _frame_color(name: str) -> str:
+    # Stable warm colors, so the same function has the same color in every flame graph
+    digest = hashlib.md5(name.encode('utf-8')).digest()
+    return f"rgb({205 + digest[0] % 50},{digest[1] % 230},{digest[2] % 55})"
@@ -0,0 +1,340 @@
+import os
+import gzip
+import json
+import math
+import base64
+import statistics
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from testfarm_columnar_utils import is_columnar_results, decode_columnar_results
+
+from test_farm_statistics import SignificanceTest
+from test_farm_tests import RegressionDetection
+
+__all__ = [
+    'HistoryRun',
+    'history_run_from_results',
+    'load_history_directory',
+    'load_history_export',
+    'load_history',
+    'append_history_run',
+    'mann_whitney_u_test',
+    'bootstrap_relative_difference',
+    'detect_change_point',
+    'detect_regressions'
+]
+
+# Upper bound of the number of values in one permutation chunk of the change-point test
+_PERMUTATION_CHUNK_VALUES = 4_000_000
+
+@dataclass
+class HistoryRun:
+    run_id: int
+    timestamp: str  # ISO 8601 in UTC, runs are ordered by it
+    metrics: Dict[str, List[float]]  # dotted metrics_summary path -> value of every measured iteration
+
+    def to_dict(self) -> dict:
+        return {"run_id": self.run_id, "timestamp": self.timestamp, "metrics": self.metrics}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'HistoryRun':
+        return HistoryRun(run_id=data['run_id'], timestamp=data['timestamp'], metrics=data['metrics'])
+
+def history_run_from_results(results: dict, run_id: int, timestamp: datetime) -> HistoryRun:
+    """Numeric metrics_summary values of every measured iteration of a benchmark results file."""
+    metrics = {}
+
+    for entry in results.get("iterations", []):
+        # In A/B runs only the candidate build belongs to the benchmark's history
+        if entry.get("variant") == "A":
+            continue
+        # Profiler overhead makes profiled iterations incomparable with the others
+        if entry.get("profiled"):
+            continue
+
+        for path, value in _numeric_leaves(entry.get("metrics_summary", {})):
+            metrics.setdefault(path, []).append(value)
+
+    return HistoryRun(run_id, timestamp.isoformat(), metrics)
+
+def load_history_directory(history_dir: str, benchmark_id: int, limit: Optional[int] = None) -> List[HistoryRun]:
+    """Runs recorded by append_history_run, oldest first."""
+    path = _history_file(history_dir, benchmark_id)
+    if not os.path.exists(path):
+        return []
+
+    runs = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                runs.append(HistoryRun.from_dict(json.loads(line)))
+            except (ValueError, KeyError):
+                continue  # a line cut short by a crash while appending
+
+    return _latest_runs(runs, limit)
+
+def load_history_export(export_file: str, benchmark_id: int, limit: Optional[int] = None) -> List[HistoryRun]:
+    """Runs of one benchmark from a JSON export of the API's BenchmarkResults table, oldest first."""
+    with open(export_file, 'r', encoding='utf-8') as f:
+        rows = json.load(f)
+
+    runs = []
+    for row in rows:
+        if row.get('BenchmarkId') != benchmark_id or not row.get('Results') or not row.get('ExecutionEndTimestamp'):
+            continue
+
+        timestamp = datetime.fromisoformat(row['ExecutionEndTimestamp'].replace('Z', '+00:00'))
+        runs.append(history_run_from_results(_decode_results(row['Results']), row['Id'], timestamp))
+
+    return _latest_runs(runs, limit)
+
+def load_history(history_dir: Optional[str], export_file: Optional[str], benchmark_id: int, limit: Optional[int] = None) -> List[HistoryRun]:
+    """Runs from the export file and the local store combined; the local store wins for runs found in both."""
+    runs = {}
+
+    if export_file and os.path.exists(export_file):
+        runs.update((run.run_id, run) for run in load_history_export(export_file, benchmark_id))
+    if history_dir:
+        runs.update((run.run_id, run) for run in load_history_directory(history_dir, benchmark_id))
+
+    return _latest_runs(list(runs.values()), limit)
+
+def append_history_run(history_dir: str, benchmark_id: int, run: HistoryRun):
+    os.makedirs(history_dir, exist_ok=True)
+
+    with open(_history_file(history_dir, benchmark_id), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run.to_dict(), separators=(',', ':')) + "\n")
+
+def mann_whitney_u_test(baseline: Sequence[float], candidate: Sequence[float]) -> SignificanceTest:
+    """Two-sided Mann-Whitney U test (normal approximation with tie correction); the statistic is the candidate's U."""
+    baseline = np.asarray(baseline, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    n1, n2 = len(baseline), len(candidate)
+    if n1 == 0 or n2 == 0:
+        raise ValueError("Mann-Whitney U test needs at least one value in both samples.")
+
+    ranks, tie_counts = _average_ranks(np.concatenate((baseline, candidate)))
+    u = float(ranks[n1:].sum()) - n2 * (n2 + 1) / 2
+
+    n = n1 + n2
+    mean = n1 * n2 / 2
+    variance = n1 * n2 / 12 * ((n + 1) - float((tie_counts ** 3 - tie_counts).sum()) / (n * (n - 1))) if n > 1 else 0.0
+    if variance <= 0:
+        return SignificanceTest(u, 1.0)
+
+    z = (abs(u - mean) - 0.5) / math.sqrt(variance)
+    return SignificanceTest(u, min(1.0, 2 * (1 - statistics.NormalDist().cdf(max(z, 0.0)))))
+
+def bootstrap_relative_difference(baseline: Sequence[float], candidate: Sequence[float], confidence: float = 0.95,
+                                  samples: int = 2000, seed: int = 0) -> tuple:
+    """Percentile bootstrap interval of (candidate median - baseline median) / baseline median."""
+    baseline = np.asarray(baseline, dtype=float)
+    candidate = np.asarray(candidate, dtype=float)
+    rng = np.random.default_rng(seed)
+
+    # All resamples at once: one row per bootstrap sample
+    baseline_medians = np.median(rng.choice(baseline, size=(samples, len(baseline))), axis=1)
+    candidate_medians = np.median(rng.choice(candidate, size=(samples, len(candidate))), axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        relative = (candidate_medians - baseline_medians) / np.abs(baseline_medians)
+    relative = relative[np.isfinite(relative)]
+    if len(relative) == 0:
+        return (None, None)
+
+    low, high = np.quantile(relative, [(1 - confidence) / 2, (1 + confidence) / 2])
+    return (float(low), float(high))
+
+def detect_change_point(series: Sequence[float], permutations: int = 1000, min_segment: int = 3, seed: int = 0) -> Optional[dict]:
+    """Most likely single shift in the mean of a series, with a permutation test p-value."""
+    values = np.asarray(series, dtype=float)
+    n = len(values)
+    if n < 2 * min_segment:
+        return None
+
+    observed = _mean_shift_statistics(values[np.newaxis, :], min_segment)[0]
+    split = int(np.argmax(observed))
+    statistic = float(observed[split])
+
+    # Null distribution of the maximum statistic over random orderings of the same values
+    rng = np.random.default_rng(seed)
+    exceeding = 0
+    chunk = max(1, _PERMUTATION_CHUNK_VALUES // n)
+    for start in range(0, permutations, chunk):
+        shuffled = rng.permuted(np.tile(values, (min(chunk, permutations - start), 1)), axis=1)
+        exceeding += int((_mean_shift_statistics(shuffled, min_segment).max(axis=1) >= statistic).sum())
+
+    index = split + 1  # first element of the segment after the shift
+    before_mean = float(values[:index].mean())
+    after_mean = float(values[index:].mean())
+
+    return {
+        "index": index,
+        "before_mean": before_mean,
+        "after_mean": after_mean,
+        "relative_shift": (after_mean - before_mean) / abs(before_mean) if before_mean else None,
+        "statistic": statistic,
+        "p_value": (exceeding + 1) / (permutations + 1)
+    }
+
+def detect_regressions(history: List[HistoryRun], current: HistoryRun, detection: RegressionDetection) -> dict:
+    """Verdict comparing the current run against the benchmark's history for every configured metric."""
+    metric_verdicts = [_metric_verdict(metric, history, current, detection) for metric in detection.metrics]
+    statuses = {verdict["status"] for verdict in metric_verdicts}
+
+    if "regression" in statuses:
+        status = "regression"
+    elif "improvement" in statuses:
+        status = "improvement"
+    elif statuses == {"insufficient_history"}:
+        status = "insufficient_history"
+    else:
+        status = "unchanged"
+
+    return {
+        "status": status,
+        "run_id": current.run_id,
+        "history_runs": len(history),
+        "threshold": detection.threshold,
+        "significance": detection.significance,
+        "metrics": metric_verdicts
+    }
+
+def _metric_verdict(metric: str, history: List[HistoryRun], current: HistoryRun, detection: RegressionDetection) -> dict:
+    lower_is_better = metric not in detection.higher_is_better
+    verdict = {
+        "metric": metric,
+        "better": "lower" if lower_is_better else "higher",
+        "status": "insufficient_history"
+    }
+
+    current_values = np.asarray(current.metrics.get(metric, []), dtype=float)
+    runs = [run for run in history if run.metrics.get(metric)]
+    verdict["history_runs"] = len(runs)
+
+    if len(current_values) == 0:
+        verdict["status"] = "missing"
+        return verdict
+    if len(runs) < detection.min_history_runs:
+        return verdict
+
+    # Per-run medians in one pass over a NaN-padded runs x iterations matrix
+    run_values = _padded_matrix([run.metrics[metric] for run in runs])
+    run_medians = np.nanmedian(run_values, axis=1)
+
+    window = run_values[-detection.baseline_runs:]
+    window_medians = run_medians[-detection.baseline_runs:]
+    baseline_values = window[~np.isnan(window)]
+
+    baseline_median = float(np.median(window_medians))
+    baseline_mad = float(np.median(np.abs(window_medians - baseline_median)))
+    current_median = float(np.median(current_values))
+    relative_change = (current_median - baseline_median) / abs(baseline_median) if baseline_median else None
+
+    # MAD scaled to estimate the standard deviation of normally distributed data
+    robust_sigma = 1.4826 * baseline_mad
+    mann_whitney = mann_whitney_u_test(baseline_values, current_values)
+    ci_low, ci_high = bootstrap_relative_difference(window_medians, current_values, detection.confidence, detection.bootstrap_samples)
+
+    change_point = detect_change_point(np.append(run_medians, current_median), detection.permutations)
+    if change_point is not None:
+        change_point["run_id"] = runs[change_point["index"]].run_id if change_point["index"] < len(runs) else current.run_id
+        change_point["recent"] = change_point["index"] >= len(runs) + 1 - detection.baseline_runs
+        change_point["significant"] = change_point["p_value"] < detection.significance
+
+    verdict.update({
+        "baseline_median": baseline_median,
+        "baseline_mad": baseline_mad,
+        "baseline_runs": len(window_medians),
+        "current_median": current_median,
+        "current_iterations": len(current_values),
+        "relative_change": relative_change,
+        "robust_z": (current_median - baseline_median) / robust_sigma if robust_sigma else None,
+        "mann_whitney_u": mann_whitney.statistic,
+        "mann_whitney_p_value": mann_whitney.p_value,
+        "bootstrap_ci_low": ci_low,
+        "bootstrap_ci_high": ci_high,
+        "change_point": change_point,
+        "status": "unchanged"
+    })
+
+    def worse(relative: Optional[float]) -> bool:
+        return relative is not None and (relative > detection.threshold if lower_is_better else relative < -detection.threshold)
+
+    def better(relative: Optional[float]) -> bool:
+        return relative is not None and (relative < -detection.threshold if lower_is_better else relative > detection.threshold)
+
+    # A shift must be large, significant by rank test and excluded from zero by the bootstrap interval
+    significant = mann_whitney.p_value < detection.significance and ci_low is not None and (ci_low > 0 or ci_high < 0)
+    if significant and worse(relative_change):
+        verdict["status"] = "regression"
+    elif significant and better(relative_change):
+        verdict["status"] = "improvement"
+    elif change_point is not None and change_point["significant"] and change_point["recent"] and change_point["before_mean"]:
+        # A step within the baseline window dilutes the baseline; judge the current run against the level before the step
+        current_shift = (current_median - change_point["before_mean"]) / abs(change_point["before_mean"])
+        if worse(change_point["relative_shift"]) and worse(current_shift):
+            verdict["status"] = "regression"
+        elif better(change_point["relative_shift"]) and better(current_shift):
+            verdict["status"] = "improvement"
+
+    return verdict
+
+def _mean_shift_statistics(rows: np.ndarray, min_segment: int) -> np.ndarray:
+    # For every split t: sqrt(t (n - t) / n) * |mean(x[:t]) - mean(x[t:])|, per row
+    n = rows.shape[1]
+    sums = np.cumsum(rows, axis=1)[:, :-1]
+    totals = sums[:, -1:] + rows[:, -1:]
+    t = np.arange(1, n)
+
+    result = np.sqrt(t * (n - t) / n) * np.abs(sums / t - (totals - sums) / (n - t))
+    result[:, (t < min_segment) | (n - t < min_segment)] = 0
+    return result
+
+def _average_ranks(values: np.ndarray) -> tuple:
+    # 1-based ranks with ties sharing their average rank, and the size of every group of equal values
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    ends = np.cumsum(counts)
+    return ((ends - counts + 1 + ends) / 2)[inverse], counts
+
+def _padded_matrix(rows: List[List[float]]) -> np.ndarray:
+    matrix = np.full((len(rows), max(len(row) for row in rows)), np.nan)
+    for i, row in enumerate(rows):
+        matrix[i, :len(row)] = row
+    return matrix
+
+def _numeric_leaves(data: dict, prefix: str = ""):
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            yield from _numeric_leaves(value, path + ".")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value):
+            yield path, float(value)
+
+def _decode_results(results) -> dict:
+    # The API stores uploaded results gzip-compressed and base64-encoded
+    if isinstance(results, dict):
+        return results
+    try:
+        return json.loads(results)
+    except ValueError:
+        data = gzip.decompress(base64.b64decode(results))
+
+    # Only the summaries are needed, the samples of columnar results stay undecoded arrays
+    if is_columnar_results(data):
+        return decode_columnar_results(data)
+    return json.loads(data.decode('utf-8'))
+
+def _history_file(history_dir: str, benchmark_id: int) -> str:
+    return os.path.join(history_dir, f"benchmark_{benchmark_id}.ndjson")
+
+def _latest_runs(runs: List[HistoryRun], limit: Optional[int]) -> List[HistoryRun]:
+    runs = sorted(runs, key=lambda run: run.timestamp)
+    return runs[-limit:] if limit else runs
@@ -0,0 +1,137 @@
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+try:
+    import win32job
+except ImportError:
+    win32job = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+__all__ = [
+    'ResourceUsage',
+    'StepResourceUsage',
+    'ResourceMeter',
+    'summarize_resource_usage'
+]
+
+# Job object times are reported in 100 ns units
+_FILETIME_UNITS_PER_SECOND = 10_000_000
+
+@dataclass
+class ResourceUsage:
+    source: str  # "job_object" or "rusage"
+    wall_time_seconds: float
+
+    cpu_user_seconds: Optional[float] = None
+    cpu_system_seconds: Optional[float] = None
+    peak_memory_bytes: Optional[int] = None  # peak committed memory of the job on Windows, peak RSS elsewhere
+    io_read_bytes: Optional[int] = None
+    io_write_bytes: Optional[int] = None
+    total_processes: Optional[int] = None
+
+    def to_payload(self) -> dict:
+        return {
+            "Source": self.source,
+            "WallTimeSeconds": self.wall_time_seconds,
+            "CpuUserSeconds": self.cpu_user_seconds,
+            "CpuSystemSeconds": self.cpu_system_seconds,
+            "PeakMemoryBytes": self.peak_memory_bytes,
+            "IoReadBytes": self.io_read_bytes,
+            "IoWriteBytes": self.io_write_bytes,
+            "TotalProcesses": self.total_processes
+        }
+
+@dataclass
+class StepResourceUsage:
+    command: str
+    usage: ResourceUsage
+
+class ResourceMeter:
+    ############################################################################
+    # Measures the resources used by one executed command and all of its
+    # children. On Windows the totals come from the job object accounting,
+    # which covers the whole process tree. Elsewhere they are the getrusage
+    # deltas of reaped children taken around the command.
+    ############################################################################
+    def __init__(self, job=None):
+        self._job = job if win32job is not None else None
+        self._rusage_start = resource.getrusage(resource.RUSAGE_CHILDREN) if self._job is None and resource is not None else None
+        self._started = time.perf_counter()
+
+    def finish(self) -> ResourceUsage:
+        """Collect usage; call after the command has exited, while the job handle is still open."""
+        wall_time = time.perf_counter() - self._started
+
+        if self._job is not None:
+            try:
+                return self._job_usage(wall_time)
+            except Exception:
+                pass  # e.g. the process could not be assigned to the job
+
+        if self._rusage_start is not None:
+            return self._rusage_usage(wall_time)
+
+        return ResourceUsage("wall_time", wall_time)
+
+    def _job_usage(self, wall_time: float) -> ResourceUsage:
+        accounting = win32job.QueryInformationJobObject(self._job, win32job.JobObjectBasicAndIoAccountingInformation)
+        limits = win32job.QueryInformationJobObject(self._job, win32job.JobObjectExtendedLimitInformation)
+
+        basic = accounting['BasicInfo']
+        io = accounting['IoInfo']
+
+        return ResourceUsage(
+            source="job_object",
+            wall_time_seconds=wall_time,
+            cpu_user_seconds=int(basic['TotalUserTime']) / _FILETIME_UNITS_PER_SECOND,
+            cpu_system_seconds=int(basic['TotalKernelTime']) / _FILETIME_UNITS_PER_SECOND,
+            peak_memory_bytes=int(limits['PeakJobMemoryUsed']),
+            io_read_bytes=int(io['ReadTransferCount']),
+            io_write_bytes=int(io['WriteTransferCount']),
+            total_processes=int(basic['TotalProcesses'])
+        )
+
+    def _rusage_usage(self, wall_time: float) -> ResourceUsage:
+        end = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = self._rusage_start
+
+        # ru_maxrss is the largest RSS of any reaped child so far (KB on Linux), not a per-command delta
+        return ResourceUsage(
+            source="rusage",
+            wall_time_seconds=wall_time,
+            cpu_user_seconds=end.ru_utime - start.ru_utime,
+            cpu_system_seconds=end.ru_stime - start.ru_stime,
+            peak_memory_bytes=end.ru_maxrss * 1024,
+            io_read_bytes=(end.ru_inblock - start.ru_inblock) * 512,
+            io_write_bytes=(end.ru_oublock - start.ru_oublock) * 512
+        )
+
+def summarize_resource_usage(steps: List[StepResourceUsage]) -> Optional[dict]:
+    """Per-step usage plus totals (summed, peak memory as maximum) in the form sent to the API."""
+    if not steps:
+        return None
+
+    def total(attribute: str, combine=sum):
+        values = [getattr(step.usage, attribute) for step in steps if getattr(step.usage, attribute) is not None]
+        return combine(values) if values else None
+
+    totals = ResourceUsage(
+        source=steps[0].usage.source,
+        wall_time_seconds=total('wall_time_seconds'),
+        cpu_user_seconds=total('cpu_user_seconds'),
+        cpu_system_seconds=total('cpu_system_seconds'),
+        peak_memory_bytes=total('peak_memory_bytes', max),
+        io_read_bytes=total('io_read_bytes'),
+        io_write_bytes=total('io_write_bytes'),
+        total_processes=total('total_processes')
+    )
+
+    return {
+        "Total": totals.to_payload(),
+        "Steps": [{"Command": step.command, **step.usage.to_payload()} for step in steps]
+    }
@@ -1,12 +1,14 @@
 import json
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 
 __all__ = [
     'Config',
     'GridConfig',
     'TestFarmApiConfig',
-    'LoggingConfig'
+    'LoggingConfig',
+    'DiffCacheConfig',
+    'BenchmarkHistoryConfig'
 ]
 
 @dataclass
@@ -23,11 +25,24 @@ class GridConfig:
 class LoggingConfig:
     log_dir: str
 
+@dataclass
+class DiffCacheConfig:
+    cache_dir: str
+    max_size_mb: int
+
+@dataclass
+class BenchmarkHistoryConfig:
+    history_dir: str
+    export_file: Optional[str] = None  # JSON export of the API's BenchmarkResults table, read-only
+    results_archive_dir: Optional[str] = None  # full-resolution copies of results uploaded downsampled
+
 @dataclass
 class Config:
     test_farm_api: TestFarmApiConfig
     grid: GridConfig
     logging: LoggingConfig
+    diff_cache: Optional[DiffCacheConfig] = None
+    benchmark_history: Optional[BenchmarkHistoryConfig] = None
 
     @staticmethod
     def load_config(config_path: str) -> 'Config':
@@ -48,8 +63,25 @@ class Config:
             log_dir=config_data['Logging']['LogDir']
         )
         
+        diff_cache_config = None
+        if 'DiffCache' in config_data:
+            diff_cache_config = DiffCacheConfig(
+                cache_dir=config_data['DiffCache']['CacheDir'],
+                max_size_mb=config_data['DiffCache'].get('MaxSizeMB', 1024)
+            )
+        
+        benchmark_history_config = None
+        if 'BenchmarkHistory' in config_data:
+            benchmark_history_config = BenchmarkHistoryConfig(
+                history_dir=config_data['BenchmarkHistory']['HistoryDir'],
+                export_file=config_data['BenchmarkHistory'].get('ExportFile'),
+                results_archive_dir=config_data['BenchmarkHistory'].get('ResultsArchiveDir')
+            )
+        
         return Config(
             test_farm_api=api_config,
             grid=grid_config,
-            logging=logging_config
+            logging=logging_config,
+            diff_cache=diff_cache_config,
+            benchmark_history=benchmark_history_config
         )
\ No newline at end of file
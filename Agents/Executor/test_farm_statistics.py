@@ -0,0 +1,219 @@
+import math
+import statistics
+from dataclasses import dataclass
+from typing import Sequence
+
+__all__ = [
+    'ConfidenceInterval',
+    'SignificanceTest',
+    'mean_confidence_interval',
+    'paired_t_test',
+    'wilcoxon_signed_rank_test',
+    'compare_paired',
+    'student_t_cdf',
+    'student_t_ppf'
+]
+
+@dataclass
+class ConfidenceInterval:
+    mean: float
+    low: float
+    high: float
+    confidence: float
+    samples: int
+
+    @property
+    def width(self) -> float:
+        return self.high - self.low
+
+    @property
+    def relative_width(self) -> float:
+        """Interval width as a fraction of the mean (infinite for a zero mean)."""
+        return self.width / abs(self.mean) if self.mean else math.inf
+
+@dataclass
+class SignificanceTest:
+    statistic: float
+    p_value: float  # two-sided
+
+def mean_confidence_interval(values: Sequence[float], confidence: float = 0.95) -> ConfidenceInterval:
+    """Student t confidence interval of the mean of independent samples."""
+    n = len(values)
+    if n < 2:
+        raise ValueError("At least two samples are needed for a confidence interval.")
+    if not 0 < confidence < 1:
+        raise ValueError(f"Confidence must be between 0 and 1, got {confidence}.")
+
+    mean = statistics.fmean(values)
+    half_width = student_t_ppf((1 + confidence) / 2, n - 1) * statistics.stdev(values) / math.sqrt(n)
+
+    return ConfidenceInterval(mean, mean - half_width, mean + half_width, confidence, n)
+
+def paired_t_test(baseline: Sequence[float], candidate: Sequence[float]) -> SignificanceTest:
+    """Two-sided paired t-test of candidate - baseline differences against zero."""
+    differences = _paired_differences(baseline, candidate)
+    n = len(differences)
+    if n < 2:
+        raise ValueError("At least two pairs are needed for a paired t-test.")
+
+    mean = statistics.fmean(differences)
+    stdev = statistics.stdev(differences)
+    if stdev == 0:
+        return SignificanceTest(0.0 if mean == 0 else math.copysign(math.inf, mean), 1.0 if mean == 0 else 0.0)
+
+    t = mean / (stdev / math.sqrt(n))
+    return SignificanceTest(t, 2 * student_t_cdf(-abs(t), n - 1))
+
+def wilcoxon_signed_rank_test(baseline: Sequence[float], candidate: Sequence[float]) -> SignificanceTest:
+    """Two-sided Wilcoxon signed-rank test of candidate - baseline differences; robust to outlier pairs."""
+    differences = [d for d in _paired_differences(baseline, candidate) if d != 0]
+    n = len(differences)
+    if n == 0:
+        return SignificanceTest(0.0, 1.0)
+
+    ranks = _average_ranks([abs(d) for d in differences])
+    w_plus = sum(rank for rank, d in zip(ranks, differences) if d > 0)
+    ties = len(set(ranks)) != n
+
+    # Exact null distribution for small samples without ties, normal approximation otherwise
+    if n <= 30 and not ties:
+        counts = _signed_rank_distribution(n)
+        total = 2 ** n
+        w = int(round(min(w_plus, n * (n + 1) / 2 - w_plus)))
+        return SignificanceTest(w_plus, min(1.0, 2 * sum(counts[:w + 1]) / total))
+
+    mean = n * (n + 1) / 4
+    tie_correction = sum(count ** 3 - count for count in _tie_counts(ranks)) / 48
+    sd = math.sqrt(n * (n + 1) * (2 * n + 1) / 24 - tie_correction)
+    if sd == 0:
+        return SignificanceTest(w_plus, 1.0)
+
+    z = (abs(w_plus - mean) - 0.5) / sd
+    return SignificanceTest(w_plus, min(1.0, 2 * (1 - statistics.NormalDist().cdf(max(z, 0.0)))))
+
+def compare_paired(baseline: Sequence[float], candidate: Sequence[float], confidence: float = 0.95) -> dict:
+    """Paired comparison summary of a candidate build against a baseline build."""
+    differences = _paired_differences(baseline, candidate)
+    baseline_mean = statistics.fmean(baseline)
+
+    interval = mean_confidence_interval(differences, confidence)
+    t_test = paired_t_test(baseline, candidate)
+    wilcoxon = wilcoxon_signed_rank_test(baseline, candidate)
+    significant = t_test.p_value < 1 - confidence and wilcoxon.p_value < 1 - confidence
+
+    return {
+        "pairs": len(differences),
+        "confidence": confidence,
+        "baseline_mean": baseline_mean,
+        "candidate_mean": statistics.fmean(candidate),
+        "mean_difference": interval.mean,
+        "relative_difference": interval.mean / baseline_mean if baseline_mean else None,
+        "difference_ci_low": interval.low,
+        "difference_ci_high": interval.high,
+        "t_statistic": t_test.statistic,
+        "t_test_p_value": t_test.p_value,
+        "wilcoxon_statistic": wilcoxon.statistic,
+        "wilcoxon_p_value": wilcoxon.p_value,
+        "significant": significant,
+        "direction": ("higher" if interval.mean > 0 else "lower") if significant else "none"
+    }
+
+def student_t_cdf(t: float, df: float) -> float:
+    """Cumulative distribution function of Student's t distribution."""
+    x = df / (df + t * t)
+    tail = 0.5 * _regularized_incomplete_beta(df / 2, 0.5, x)
+    return 1 - tail if t > 0 else tail
+
+def student_t_ppf(p: float, df: float) -> float:
+    """Quantile function of Student's t distribution, found by bisection of the CDF."""
+    if not 0 < p < 1:
+        raise ValueError(f"Probability must be between 0 and 1, got {p}.")
+    if p == 0.5:
+        return 0.0
+    if p < 0.5:
+        return -student_t_ppf(1 - p, df)
+
+    low, high = 0.0, 1.0
+    while student_t_cdf(high, df) < p:
+        low, high = high, high * 2
+
+    for _ in range(100):
+        middle = (low + high) / 2
+        if student_t_cdf(middle, df) < p:
+            low = middle
+        else:
+            high = middle
+        if high - low < 1e-12 * max(1.0, high):
+            break
+
+    return (low + high) / 2
+
+def _regularized_incomplete_beta(a: float, b: float, x: float) -> float:
+    if x <= 0:
+        return 0.0
+    if x >= 1:
+        return 1.0
+
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x))
+
+    # The continued fraction converges quickly only below the mean of the distribution
+    if x < (a + 1) / (a + b + 2):
+        return front * _beta_continued_fraction(a, b, x) / a
+    return 1 - front * _beta_continued_fraction(b, a, 1 - x) / b
+
+def _beta_continued_fraction(a: float, b: float, x: float) -> float:
+    # Modified Lentz's method
+    tiny = 1e-300
+    c = 1.0
+    d = 1 - (a + b) * x / (a + 1)
+    d = 1 / (d if abs(d) > tiny else tiny)
+    result = d
+
+    for m in range(1, 300):
+        m2 = 2 * m
+        for numerator in (m * (b - m) * x / ((a + m2 - 1) * (a + m2)),
+                          -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1))):
+            d = 1 + numerator * d
+            d = 1 / (d if abs(d) > tiny else tiny)
+            c = 1 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            result *= d * c
+
+        if abs(d * c - 1) < 1e-15:
+            break
+
+    return result
+
+def _paired_differences(baseline: Sequence[float], candidate: Sequence[float]) -> list:
+    if len(baseline) != len(candidate):
+        raise ValueError(f"Paired samples differ in length: {len(baseline)} vs {len(candidate)}.")
+    return [c - b for b, c in zip(baseline, candidate)]
+
+def _average_ranks(values: Sequence[float]) -> list:
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+
+    return ranks
+
+def _tie_counts(ranks: Sequence[float]) -> list:
+    counts = {}
+    for rank in ranks:
+        counts[rank] = counts.get(rank, 0) + 1
+    return [count for count in counts.values() if count > 1]
+
+def _signed_rank_distribution(n: int) -> list:
+    # counts[w] = number of sign assignments of ranks 1..n whose positive ranks sum to w
+    counts = [1] + [0] * (n * (n + 1) // 2)
+    for rank in range(1, n + 1):
+        for w in range(len(counts) - 1, rank - 1, -1):
+            counts[w] += counts[w - rank]
+    return counts
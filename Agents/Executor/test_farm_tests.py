@@ -6,16 +6,39 @@ import os
 from pathlib import Path
 
 __all__ = [
+    "NormalizationRule",
     "DiffPair",
     "TestCase",
+    "AdaptiveIterations",
+    "RegressionDetection",
+    "BenchmarkEnvironment",
+    "ProfileCapture",
+    "Downsampling",
     "BenchmarkCase"
 ]
 
+@dataclass
+class NormalizationRule:
+    type: str  # "replace", "ignore_line" or "numeric_tolerance"
+
+    pattern: Optional[str] = None  # regex; for "numeric_tolerance" restricts the rule to matching lines
+    replacement: str = ""
+    tolerance: float = 0.0
+    relative: bool = False  # tolerance as a fraction of the gold value instead of an absolute difference
+
 @dataclass
 class DiffPair:
     gold: str
     new: str
-    encoding: str
+    encoding: str = "auto"  # "auto" detects the encoding from the gold file
+
+    normalize: List[NormalizationRule] = None
+
+    def __post_init__(self):
+        # Rules read from test.testfarm come in as plain dicts
+        if self.normalize is None:
+            self.normalize = []
+        self.normalize = [rule if isinstance(rule, NormalizationRule) else NormalizationRule(**rule) for rule in self.normalize]
 
 @dataclass
 class TestCase:
@@ -52,6 +75,112 @@ class TestCase:
             
         return TestCase(**data)
     
+@dataclass
+class AdaptiveIterations:
+    metric: str = "wall_time"  # "wall_time" of the benchmark command, or a dotted path in the last iteration's metrics_summary, e.g. "cpu.total_cpu_time"
+    target_ci_width: float = 0.05  # stop once the confidence interval of the metric mean is this narrow, relative to the mean
+    confidence: float = 0.95
+
+    min_iterations: int = 5
+    max_iterations: Optional[int] = None  # defaults to the benchmark's "iterations"
+    warmup_iterations: int = 0  # run first, excluded from results and from the stopping rule
+
+    def __post_init__(self):
+        if self.min_iterations < 2:
+            raise ValueError("Adaptive iterations require \"min_iterations\" of at least 2.")
+        if self.max_iterations is not None and self.max_iterations < self.min_iterations:
+            raise ValueError("Adaptive iterations \"max_iterations\" must not be lower than \"min_iterations\".")
+        if self.warmup_iterations < 0:
+            raise ValueError("Adaptive iterations \"warmup_iterations\" must not be negative.")
+        if self.target_ci_width <= 0:
+            raise ValueError("Adaptive iterations \"target_ci_width\" must be positive.")
+        if not 0 < self.confidence < 1:
+            raise ValueError("Adaptive iterations \"confidence\" must be between 0 and 1.")
+
+@dataclass
+class RegressionDetection:
+    metrics: List[str] = None  # dotted paths in metrics_summary, e.g. "summary.duration_seconds"
+    higher_is_better: List[str] = None  # metrics where a decrease is the regression, e.g. throughput
+
+    threshold: float = 0.05  # smallest relative change of the median that counts as a regression
+    significance: float = 0.01  # p-value limit of the Mann-Whitney and change-point tests
+    confidence: float = 0.95  # of the bootstrap interval of the relative difference
+
+    baseline_runs: int = 30  # most recent historical runs forming the baseline
+    min_history_runs: int = 5
+    history_runs: int = 1000  # historical runs loaded for change-point detection
+
+    bootstrap_samples: int = 2000
+    permutations: int = 1000
+
+    def __post_init__(self):
+        if self.metrics is None:
+            self.metrics = ["summary.duration_seconds"]
+        if self.higher_is_better is None:
+            self.higher_is_better = []
+
+        if self.threshold < 0:
+            raise ValueError("Regression detection \"threshold\" must not be negative.")
+        if not 0 < self.significance < 1:
+            raise ValueError("Regression detection \"significance\" must be between 0 and 1.")
+        if not 0 < self.confidence < 1:
+            raise ValueError("Regression detection \"confidence\" must be between 0 and 1.")
+        if self.min_history_runs < 1 or self.baseline_runs < self.min_history_runs:
+            raise ValueError("Regression detection \"baseline_runs\" must not be lower than \"min_history_runs\", which must be positive.")
+        if self.history_runs < self.baseline_runs:
+            raise ValueError("Regression detection \"history_runs\" must not be lower than \"baseline_runs\".")
+        if self.bootstrap_samples < 100 or self.permutations < 100:
+            raise ValueError("Regression detection needs at least 100 bootstrap samples and permutations.")
+
+@dataclass
+class BenchmarkEnvironment:
+    cores: Optional[List[int]] = None  # logical CPUs the benchmark command and its children are pinned to
+
+    # Quiescence gate before every iteration: system-wide load must stay below the limits for quiet_seconds
+    max_cpu_percent: float = 10.0
+    max_disk_bytes_per_second: float = 10 * 1024 * 1024
+    quiet_seconds: float = 3.0
+    quiescence_timeout: float = 120.0  # the iteration starts anyway after this, marked as not quiet
+
+    max_background_cpu_percent: Optional[float] = 10.0  # CPU used outside the benchmark during an iteration; None disables rerunning
+    max_reruns: int = 3  # per iteration
+
+    def __post_init__(self):
+        if self.cores is not None and (not self.cores or any(core < 0 for core in self.cores)):
+            raise ValueError("Benchmark environment \"cores\" must list at least one non-negative CPU index.")
+        if self.quiet_seconds < 0 or self.quiescence_timeout < 0:
+            raise ValueError("Benchmark environment \"quiet_seconds\" and \"quiescence_timeout\" must not be negative.")
+        if self.max_reruns < 0:
+            raise ValueError("Benchmark environment \"max_reruns\" must not be negative.")
+
+@dataclass
+class ProfileCapture:
+    tool: str = "auto"  # "perf", "py-spy" or "cprofile"; "auto" picks the best one available for the command
+    iterations: List[int] = None  # measured iterations to profile, counted from 1 (pairs in A/B mode); defaults to [1]
+    frequency: int = 99  # samples per second of perf and py-spy
+
+    def __post_init__(self):
+        if self.iterations is None:
+            self.iterations = [1]
+
+        if self.tool not in ("auto", "perf", "py-spy", "cprofile"):
+            raise ValueError(f"Unknown profiler \"{self.tool}\", expected \"auto\", \"perf\", \"py-spy\" or \"cprofile\".")
+        if not self.iterations or any(iteration < 1 for iteration in self.iterations):
+            raise ValueError("Profile \"iterations\" must list at least one iteration number, counted from 1.")
+        if self.frequency < 1:
+            raise ValueError("Profile \"frequency\" must be positive.")
+
+@dataclass
+class Downsampling:
+    points: int = 1000  # most samples per metric table in the uploaded results
+    method: str = "lttb"  # "lttb" keeps the visual shape, "minmax" the minimum and maximum of equal buckets
+
+    def __post_init__(self):
+        if self.method not in ("lttb", "minmax"):
+            raise ValueError(f"Unknown downsampling method \"{self.method}\", expected \"lttb\" or \"minmax\".")
+        if self.points < 4:
+            raise ValueError("Downsampling \"points\" must be at least 4.")
+
 @dataclass
 class BenchmarkCase:
     name: str
@@ -70,6 +199,14 @@ class BenchmarkCase:
 
     pre_iter_steps: List[str] = None
     post_iter_steps: List[str] = None
+
+    adaptive: Optional[AdaptiveIterations] = None  # statistical stopping rule instead of a fixed iteration count
+    regression: Optional[RegressionDetection] = None  # compare results against the benchmark's history
+    environment: Optional[BenchmarkEnvironment] = None  # CPU pinning, quiescence gating and noisy iteration reruns
+    shards: int = 1  # split the iterations over this many hosts of the grid, for throughput-style benchmarks; read by the API when scheduling
+    profile: Optional[ProfileCapture] = None  # sampling profiler around selected iterations, excluded from the statistics
+    results_format: str = "json"  # format of the finalized and uploaded results: "json", or "columnar" with samples as typed arrays
+    downsample: Optional[Downsampling] = None  # upload metric series reduced to a point budget, the full results stay on the host
     
     
     def __post_init__(self):
@@ -83,6 +220,25 @@ class BenchmarkCase:
             self.pre_iter_steps = []
         if self.post_iter_steps is None:
             self.post_iter_steps = []
+
+        if isinstance(self.adaptive, dict):
+            self.adaptive = AdaptiveIterations(**self.adaptive)
+        if self.adaptive and self.adaptive.max_iterations is None:
+            self.adaptive.max_iterations = max(self.iterations, self.adaptive.min_iterations)
+
+        if isinstance(self.regression, dict):
+            self.regression = RegressionDetection(**self.regression)
+        if isinstance(self.environment, dict):
+            self.environment = BenchmarkEnvironment(**self.environment)
+        if isinstance(self.profile, dict):
+            self.profile = ProfileCapture(**self.profile)
+        if isinstance(self.downsample, dict):
+            self.downsample = Downsampling(**self.downsample)
+
+        if self.shards < 1:
+            raise ValueError("Benchmark \"shards\" must be at least 1.")
+        if self.results_format not in ("json", "columnar"):
+            raise ValueError(f"Unknown benchmark \"results_format\" \"{self.results_format}\", expected \"json\" or \"columnar\".")
     
     @staticmethod
     def from_file(file_path: str) -> "BenchmarkCase":
@@ -1,11 +1,14 @@
+import io
 import os
+import math
+import statistics
 import json
 from git import Repo
 import requests
-from datetime import datetime
-from dataclasses import dataclass
+from datetime import datetime, timezone
+from dataclasses import dataclass, field, asdict, replace
 from enum import Enum
-from typing import Optional, List, Dict, Set
+from typing import Optional, List, Dict, Set, Callable
 from urllib.parse import urljoin
 import time
 import threading
@@ -17,17 +20,28 @@ import logging
 import sys
 import subprocess
 import difflib
-import chardet
-import filecmp
 import sys
 import py7zr
 import shutil
 
 from testfarm_agents_utils import *
 from testfarm_benchmarks_utils import *
-
-from test_farm_tests import TestCase, BenchmarkCase
-from test_farm_api import get_next_job, get_scheduled_test, get_scheduled_benchmark, register_host, unregister_host, update_host_status, complete_test, complete_benchmark, upload_diff, upload_benchmark_results, upload_temp_dir_archive, upload_output, Repository
+from testfarm_shards_utils import shard_iterations
+from testfarm_state_utils import STATE_FILE_ENV_VAR
+from testfarm_columnar_utils import RESULTS_FORMAT_JSON, RESULTS_FORMAT_COLUMNAR, load_results, save_results, results_format, downsample_results
+
+from test_farm_tests import TestCase, BenchmarkCase, AdaptiveIterations, DiffPair
+from test_farm_statistics import ConfidenceInterval, mean_confidence_interval, compare_paired
+from test_farm_regression import load_history, append_history_run, history_run_from_results, detect_regressions
+from test_farm_benchmark_environment import BenchmarkEnvironmentManager, pin_process_tree
+from test_farm_profiling import BenchmarkProfiler
+from test_farm_file_compare import FileComparison, compare_files
+from test_farm_diff_cache import DiffCache
+from test_farm_encoding import AUTO_ENCODING, EncodingDetector
+from test_farm_normalization import NORMALIZED_ENCODING, Normalizer
+from test_farm_compression import is_compressed, open_decompressed, decompressed_size, strip_compression_extension
+from test_farm_resource_usage import ResourceMeter, ResourceUsage, StepResourceUsage, summarize_resource_usage
+from test_farm_api import get_next_job, get_scheduled_test, get_scheduled_benchmark, register_host, unregister_host, update_host_status, complete_test, complete_benchmark, upload_diff, upload_benchmark_results, upload_benchmark_profile, upload_temp_dir_archive, upload_output, Repository
 from test_farm_service_config import Config
 from logging.handlers import RotatingFileHandler
 
@@ -45,12 +59,32 @@ class CommandResult:
     stdout: str
     stderr: str
     leftover_processes: List[int]  # PIDs of child processes that were still running and got terminated
+    resource_usage: Optional[ResourceUsage] = None
+
+@dataclass
+class BenchmarkSession:
+    # Bookkeeping of a benchmark's iterations, applied to the results file after the post-bench steps
+    warmup_entries: int = 0  # leading results file entries written by warm-up iterations
+    entry_variants: List[tuple] = field(default_factory=list)  # (first, end, variant) ranges of results file entries in A/B mode
+    sections: Dict[str, dict] = field(default_factory=dict)  # extra top-level sections of the results file
+    environment: Optional[BenchmarkEnvironmentManager] = None
+    profiler: Optional[BenchmarkProfiler] = None
+    profiled_entries: List[tuple] = field(default_factory=list)  # (first, end) ranges of results file entries of profiled iterations
+    # Results file entries after the last iteration and the last of them, read once per iteration; None when not tracked
+    result_entries: Optional[int] = None
+    last_entry: Optional[dict] = None
 
 class TestFarmWindowsService(win32serviceutil.ServiceFramework):
     _svc_name_ = "TestFarm"
     _svc_display_name_ = "TestFarm Windows Service"
     _svc_description_ = "TestFarm tests and benchmarks executing service."
 
+    # Options affecting the rendered diff report, also part of the diff cache key
+    _DIFF_OPTIONS = {
+        'context_lines': 10,
+        'max_diff_lines': 50000
+    }
+
     def __init__(self, args):
         self._isDebugModeOn = False
         self.setup()
@@ -66,9 +100,13 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
         self._running = False
         self._host = None
         self._config = None
+        self._diff_cache = None
+        self._step_resource_usage = []
+        self._encoding_detector = EncodingDetector()
 
         self.setup_config()
         self.setup_logging() 
+        self.setup_diff_cache()
 
     def create_win32_event(self):
         if not self._isDebugModeOn:
@@ -112,6 +150,19 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
         
         logging.info(f"Logging initialized to: {log_file}")
 
+    def setup_diff_cache(self):
+        assert self._config is not None, "Configuration must be initialized before setting up diff cache."
+
+        if self._config.diff_cache is None:
+            logging.info("Diff cache disabled")
+            return
+
+        try:
+            self._diff_cache = DiffCache(self._config.diff_cache.cache_dir, self._config.diff_cache.max_size_mb * 1024 * 1024)
+            logging.info(f"Diff cache initialized at: {self._config.diff_cache.cache_dir}")
+        except OSError as e:
+            logging.error(f"Failed to initialize diff cache, continuing without it: {e}")
+
     def clone_repository(self, repository: Repository) -> str:
         logging.info(f"Fetching {repository.name} tests repository...")
 
@@ -141,6 +192,13 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
         return local_repository_dir
 
+    def get_repository_revision(self, local_repository_dir: str) -> Optional[str]:
+        try:
+            return Repo(local_repository_dir).head.commit.hexsha
+        except Exception as e:
+            logging.warning(f"Failed to read revision of {local_repository_dir}: {e}")
+            return None
+
     def SvcStop(self):
         self._running = False
         win32event.SetEvent(self._hWaitStop)
@@ -159,7 +217,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
             except Exception as e:
                 logging.error(f"Error during host shutdown: {e}")
 
-    def install_artifacts(self, artifacts):
+    def install_artifacts(self, artifacts, slot: Optional[str] = None):
         if artifacts is None or len(artifacts) == 0:
             logging.info("No artifacts to install.")
             return 0
@@ -176,7 +234,9 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                     script_file.write(artifact.artifact_definition.install_script)
 
                 logging.info(f"Executing install script: {script_path}")
-                exit_code = os.system(f"python {script_path} --build {artifact.build_id} --hostname {self._host.hostname} --timeout 60")
+                # In A/B mode both builds are installed side by side, the install script places each in its slot
+                slot_argument = f" --slot {slot}" if slot else ""
+                exit_code = os.system(f"python {script_path} --build {artifact.build_id} --hostname {self._host.hostname} --timeout 60{slot_argument}")
                 
                 if exit_code != 0:
                     logging.error(f"Install script failed with exit code {exit_code}")
@@ -197,6 +257,17 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
         return overall_exit_code
 
+    def install_benchmark_artifacts(self, benchmark_run) -> int:
+        if not benchmark_run.baseline_artifacts:
+            return self.install_artifacts(benchmark_run.artifacts)
+
+        logging.info("A/B benchmark run: installing baseline artifacts to slot A and candidate artifacts to slot B")
+
+        exit_code = self.install_artifacts(benchmark_run.baseline_artifacts, slot="A")
+        if exit_code != 0:
+            return exit_code
+        return self.install_artifacts(benchmark_run.artifacts, slot="B")
+
     def SvcDoRun(self):
         assert self._config is not None, "Configuration must be initialized before service startup."
 
@@ -228,9 +299,11 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                         continue
 
                     self.cleanup_temp_dir()
+                    self._step_resource_usage = []
 
                     logging.info(f"Received test: {test.test.name} (ID: {test.id})")
                     local_repository_dir = self.clone_repository(test.repository)
+                    repository_revision = self.get_repository_revision(local_repository_dir)
                     
                     test_description_file = f"{local_repository_dir}/{test.test.path}/test.testfarm"
                     logging.info(f"Looking for test description under {test_description_file}...")
@@ -250,7 +323,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                             update_host_status("Failed to install artifacts", self._host, self._config)
                             logging.error(f"Artifact installation failed for test run: {test.test_run.name} (ID: {test.test_run.id})")
 
-                            complete_test(test, "failed", self._config)
+                            complete_test(test, "failed", self._config, self.resource_usage_summary())
                             logging.info("Test FAILED!")
 
                             self.cleanup_temp_dir()
@@ -277,7 +350,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                         result = self.execute_command(expanded_pre_step, env, new_working_dir)
                         if result.status != CommandStatus.SUCCESS:
                             self.archive_and_upload_temp_dir(test)
-                            complete_test(test, "error", self._config)
+                            complete_test(test, "error", self._config, self.resource_usage_summary())
                             raise RuntimeError(f"Pre-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
 
                     expanded_test_command = expand_magic_variables(test_case.command)    
@@ -297,7 +370,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                     result = self.execute_command(expanded_test_command, env, new_working_dir)
                     if result.status != CommandStatus.SUCCESS:
                         self.archive_and_upload_temp_dir(test)
-                        complete_test(test, "error", self._config)
+                        complete_test(test, "error", self._config, self.resource_usage_summary())
                         raise RuntimeError(f"Test command failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
                         
                     for post_step in test_case.post_steps:
@@ -307,7 +380,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                         result = self.execute_command(expanded_post_step, env, new_working_dir)
                         if result.status != CommandStatus.SUCCESS:
                             self.archive_and_upload_temp_dir(test)
-                            complete_test(test, "error", self._config)
+                            complete_test(test, "error", self._config, self.resource_usage_summary())
                             raise RuntimeError(f"Post-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
 
                     upload_output(test, self._config, expand_magic_variables(test_case.output))
@@ -315,7 +388,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                     test_passed = True
 
                     for diff in test_case.diffs:
-                        diff_name = os.path.splitext(os.path.basename(diff.gold))[0]
+                        diff_name = os.path.splitext(os.path.basename(strip_compression_extension(diff.gold)))[0]
 
                         gold_file = f"{new_working_dir}/{diff.gold}"
                         if not os.path.exists(gold_file):
@@ -333,15 +406,55 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                             logging.info(f"New file {new_file} not found!")
                             continue
                         
-                        if abs(os.path.getsize(gold_file) - os.path.getsize(new_file)) > 10 * 1024 * 1024:
+                        # Cheap checks first: the byte compare stops at the first mismatch, the cache hashes read both files in full
+                        comparison = compare_files(gold_file, new_file)
+                        if comparison.identical:
+                            logging.info(f"No differences found in {diff.gold} vs {diff.new} (identical content)")
+                            upload_diff(test, diff_name, "passed", self._config)
+                            continue
+
+                        encoding = diff.encoding
+                        if encoding == AUTO_ENCODING:
+                            encoding = self._encoding_detector.detect(gold_file, revision=repository_revision)
+                            logging.info(f"Detected encoding {encoding} for {gold_file}")
+
+                        # Without normalization the raw files are the compared ones, too far apart in size they are not worth hashing
+                        oversized = not diff.normalize and self.diff_sizes_exceeded(gold_file, new_file)
+
+                        cache_key = None
+                        if self._diff_cache and not oversized:
+                            gold_hash = self._diff_cache.hash_file(gold_file)
+                            new_hash = self._diff_cache.hash_file(new_file)
+
+                            cache_key = DiffCache.make_key(gold_hash, new_hash, encoding, self.get_diff_options(diff))
+                            cached_diff = self._diff_cache.get(cache_key)
+
+                            if cached_diff:
+                                logging.info(f"Reusing cached diff result \"{cached_diff.status}\" for {diff.gold} vs {diff.new}")
+                                if cached_diff.status != "passed":
+                                    test_passed = False
+                                upload_diff(test, diff_name, cached_diff.status, self._config, cached_diff.report_file)
+                                continue
+
+                        compared_gold_file, compared_new_file, compared_encoding = gold_file, new_file, encoding
+                        if diff.normalize:
+                            normalized_dir = expand_magic_variables("$__TF_TEMP_DIR__/normalized")
+                            logging.info(f"Applying {len(diff.normalize)} normalization rule(s) to {diff.gold} and {diff.new}")
+
+                            compared_gold_file, compared_new_file = Normalizer(diff.normalize).normalize_files(gold_file, new_file, encoding, normalized_dir)
+                            compared_encoding = NORMALIZED_ENCODING
+                            oversized = self.diff_sizes_exceeded(compared_gold_file, compared_new_file)
+                            comparison = None
+
+                        if oversized:
                             test_passed = False
                             upload_diff(test, diff_name, "files differ in size more than 10MB", self._config)
 
-                            logging.info(f"Files {gold_file} and {new_file} differ in size more than 10MB!")
+                            logging.info(f"Files {compared_gold_file} and {compared_new_file} differ in size more than 10MB!")
                             continue
 
                         report_file = expand_magic_variables(f"$__TF_WORK_DIR__/{diff_name}.html")
-                        self.generate_html_diff(gold_file, new_file, report_file, diff.encoding)
+                        self.generate_html_diff(compared_gold_file, compared_new_file, report_file, compared_encoding, comparison)
 
                         # Check if the diff report is not empty
                         if os.path.getsize(report_file) > 0:
@@ -349,18 +462,23 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                             logging.info(f"HTML difference report generated: {report_file}")
                             test_passed = False
                             upload_diff(test, diff_name, "failed", self._config, report_file)
+                            diff_status = "failed"
                         else:
                             logging.info(f"No differences found in {diff.gold} vs {diff.new}")
                             upload_diff(test, diff_name, "passed", self._config)
+                            diff_status = "passed"
+
+                        if cache_key:
+                            self._diff_cache.put(cache_key, diff_status, report_file)
 
                     self.archive_and_upload_temp_dir(test)
 
                     if test_passed:
                         logging.info("Test PASSED! Publishing results...")
-                        complete_test(test, "passed", self._config)
+                        complete_test(test, "passed", self._config, self.resource_usage_summary())
                     else:
                         logging.info("Test FAILED! Publishing results...")
-                        complete_test(test, "failed", self._config)
+                        complete_test(test, "failed", self._config, self.resource_usage_summary())
 
                     logging.info("Test completed.")
 
@@ -372,6 +490,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                         continue
 
                     self.cleanup_temp_dir()
+                    self._step_resource_usage = []
 
                     logging.info(f"Received benchmark: {benchmark.benchmark.name} (ID: {benchmark.id})")
                     local_repository_dir = self.clone_repository(benchmark.repository)
@@ -386,12 +505,20 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
                     benchmark_case = BenchmarkCase.from_file(benchmark_description_file)
 
+                    # The API splits a run into shards when it is scheduled; the description may have changed since
+                    if benchmark_case.shards != benchmark.shard_count:
+                        logging.warning(f"Benchmark description asks for {benchmark_case.shards} shard(s), the run was scheduled with {benchmark.shard_count}; following the schedule")
+
+                    if benchmark.shard_count > 1:
+                        benchmark_case = self.shard_benchmark_case(benchmark_case, benchmark.shard_index, benchmark.shard_count)
+                        logging.info(f"Running shard {benchmark.shard_index + 1} of {benchmark.shard_count}: {benchmark_case.iterations} iteration(s)")
+
                     #TODO: Implement common current run ID or switch completelly to installed artifacts recognition.
                     if current_test_run_id != benchmark.benchmark_run.id:
                         update_host_status("Installing artifacts...", self._host, self._config)
                         logging.info(f"Installing artifacts for benchmark run: {benchmark.benchmark_run.name} (ID: {benchmark.benchmark_run.id})")
 
-                        if self.install_artifacts(benchmark.benchmark_run.artifacts) != 0:
+                        if self.install_benchmark_artifacts(benchmark.benchmark_run) != 0:
                             update_host_status("Failed to install artifacts", self._host, self._config)
                             logging.error(f"Artifact installation failed for benchmark run: {benchmark.benchmark_run.name} (ID: {benchmark.benchmark_run.id})")
 
@@ -410,8 +537,15 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
                     env = os.environ.copy()
                     env["PYTHONPATH"] = f"{local_repository_dir};{env.get('PYTHONPATH', '')}"
+                    env["TF_BENCH_SHARD_INDEX"] = str(benchmark.shard_index)
+                    env["TF_BENCH_SHARD_COUNT"] = str(benchmark.shard_count)
+                    # Scripts open the benchmark state directly instead of expanding magic variables
+                    env[STATE_FILE_ENV_VAR] = get_bench_state().path
                     logging.debug(f"env: {env}")
 
+                    reset_bench_iter()
+                    set_bench_phase("setup")
+
                     new_working_dir = os.path.dirname(benchmark_description_file)
                     logging.debug(f"cwd: {new_working_dir}")
 
@@ -423,35 +557,17 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                         if result.status != CommandStatus.SUCCESS:
                             raise RuntimeError(f"Pre-bench-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
 
-                    for iteration in range(benchmark_case.iterations):
-                        logging.info(f"Starting iteration {iteration + 1} of {benchmark_case.iterations}")
-
-                        for pre_iter_step in benchmark_case.pre_iter_steps:
-                            expanded_pre_iter_step = expand_magic_variables(pre_iter_step)
-                            logging.info(f"Executing pre-iter-step: {expanded_pre_iter_step}")
-
-                            result = self.execute_command(expanded_pre_iter_step, env, new_working_dir)
-                            if result.status != CommandStatus.SUCCESS:
-                                raise RuntimeError(f"Pre-iter-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
-
-                        expanded_benchmark_command = expand_magic_variables(benchmark_case.command)
-                        logging.info(f"Executing test command: {expanded_benchmark_command}")
-
-                        result = self.execute_command(expanded_benchmark_command, env, new_working_dir)
-                        if result.status != CommandStatus.SUCCESS:
-                            raise RuntimeError(f"Benchmark command failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
-
-                        for post_iter_step in benchmark_case.post_iter_steps:
-                            expanded_post_iter_step = expand_magic_variables(post_iter_step)
-                            logging.info(f"Executing post-iter-step: {expanded_post_iter_step}")
+                    expanded_results = expand_magic_variables(benchmark_case.results)
 
-                            result = self.execute_command(expanded_post_iter_step, env, new_working_dir)
-                            if result.status != CommandStatus.SUCCESS:
-                                raise RuntimeError(f"Post-iter-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
+                    if benchmark.benchmark_run.baseline_artifacts:
+                        session = self.run_ab_benchmark_iterations(benchmark_case, env, new_working_dir, expanded_results)
+                    else:
+                        session = self.run_benchmark_iterations(benchmark_case, env, new_working_dir, expanded_results)
 
-                        logging.info(f"Iteration {iteration + 1} of {benchmark_case.iterations} completed")
+                    if benchmark.shard_count > 1:
+                        session.sections["shard"] = self.shard_summary(benchmark, benchmark_case, session)
 
-                        incr_bench_iter()
+                    set_bench_phase("teardown")
 
                     for post_bench_step in benchmark_case.post_bench_steps:
                         expanded_post_step = expand_magic_variables(post_bench_step)
@@ -463,10 +579,15 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
                     logging.info("Benchmark finished! Publishing results...")
 
-                    complete_benchmark(benchmark, self._config)
+                    self.finalize_benchmark_results(expanded_results, session, benchmark_case.results_format)
+                    self.detect_benchmark_regressions(benchmark, benchmark_case, expanded_results, session)
 
-                    expanded_results = expand_magic_variables(benchmark_case.results)
-                    upload_benchmark_results(benchmark, self._config, expanded_results)
+                    complete_benchmark(benchmark, self._config, self.resource_usage_summary())
+
+                    analysis = {name: session.sections[name] for name in ("ab_comparison", "regression", "shard", "profiles") if name in session.sections}
+                    upload_file = self.prepare_benchmark_results_upload(benchmark, benchmark_case, expanded_results)
+                    upload_benchmark_results(benchmark, self._config, upload_file, analysis or None)
+                    self.upload_benchmark_profiles(benchmark, session)
 
                     # test_passed = True
 
@@ -553,6 +674,436 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
         logging.info("TestFarm service has stopped.")
 
+    def run_benchmark_iteration(self, benchmark_case: BenchmarkCase, env: dict, cwd: str, results_file: str, session: BenchmarkSession, profile_label: Optional[str] = None) -> CommandResult:
+        """Run one iteration, rerunning it while it is disturbed by background load; return the command result.
+
+        With a profile label the benchmark command runs under the session's profiler and the results file
+        entries of the iteration are recorded as profiled.
+        """
+        profiler = session.profiler if profile_label else None
+        # Entries before the iteration are known from the previous one, reruns truncate back to them
+        result_entries = session.result_entries
+
+        attempt = 0
+        while True:
+            command_result = self.run_benchmark_iteration_attempt(benchmark_case, env, cwd, session.environment, profiler, profile_label)
+
+            if command_result.status != CommandStatus.SUCCESS:
+                # Only failures under the profiler come back: perf or py-spy may be denied, not the benchmark broken
+                logging.warning(f"Benchmark command failed under the profiler (exit code {command_result.exit_code}), rerunning {profile_label} without profiling")
+                self.truncate_benchmark_results(results_file, result_entries)
+                profiler = None
+                continue
+
+            noisy = session.environment.end_iteration(command_result.resource_usage)
+            if noisy and session.environment.can_rerun(attempt):
+                # Drop the results the noisy attempt appended before running it again
+                background = session.environment.iterations[-1]['background_cpu_percent']
+                logging.warning(f"Iteration noisy (background CPU {background:.1f}%), rerunning it")
+                self.truncate_benchmark_results(results_file, result_entries)
+                session.environment.reruns += 1
+                attempt += 1
+                continue
+
+            if noisy:
+                background = session.environment.iterations[-1]['background_cpu_percent']
+                logging.warning(f"Iteration still noisy after {attempt} rerun(s) (background CPU {background:.1f}%), keeping it")
+            if result_entries is not None:
+                # The only parse of the growing results file per iteration, shared by the callers' bookkeeping
+                iterations = self.read_benchmark_results(results_file).get("iterations", [])
+                session.result_entries = len(iterations)
+                session.last_entry = iterations[-1] if iterations else None
+                if profiler:
+                    session.profiled_entries.append((result_entries, session.result_entries))
+            return command_result
+
+    def run_benchmark_iteration_attempt(self, benchmark_case: BenchmarkCase, env: dict, cwd: str, environment: BenchmarkEnvironmentManager,
+                                        profiler: Optional[BenchmarkProfiler] = None, profile_label: Optional[str] = None) -> CommandResult:
+        """Run pre-iteration steps, the benchmark command and post-iteration steps; return the command result.
+
+        A benchmark command that fails under the profiler returns its failed result instead of raising.
+        """
+        for pre_iter_step in benchmark_case.pre_iter_steps:
+            expanded_pre_iter_step = expand_magic_variables(pre_iter_step)
+            logging.info(f"Executing pre-iter-step: {expanded_pre_iter_step}")
+
+            result = self.execute_command(expanded_pre_iter_step, env, cwd)
+            if result.status != CommandStatus.SUCCESS:
+                raise RuntimeError(f"Pre-iter-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
+
+        environment.wait_for_quiescence()
+
+        if environment.cores:
+            env = dict(env, TF_BENCH_CORES=",".join(str(core) for core in environment.cores))
+
+        expanded_benchmark_command = expand_magic_variables(benchmark_case.command)
+        if profiler:
+            expanded_benchmark_command = profiler.wrap(expanded_benchmark_command, profile_label)
+        logging.info(f"Executing test command: {expanded_benchmark_command}")
+
+        environment.begin_iteration()
+        command_result = self.execute_command(expanded_benchmark_command, env, cwd, environment.cores, on_exit=environment.stop_iteration)
+        if command_result.status != CommandStatus.SUCCESS:
+            if profiler and profiler.wrapping:
+                profiler.abandon(f"exit code {command_result.exit_code}")
+                return command_result  # the caller reruns the iteration without the profiler
+            raise RuntimeError(f"Benchmark command failed! Exit code: {command_result.exit_code}\nstdout: {command_result.stdout}\nstderr: {command_result.stderr}")
+
+        if profiler:
+            profiler.finish()
+
+        for post_iter_step in benchmark_case.post_iter_steps:
+            expanded_post_iter_step = expand_magic_variables(post_iter_step)
+            logging.info(f"Executing post-iter-step: {expanded_post_iter_step}")
+
+            result = self.execute_command(expanded_post_iter_step, env, cwd)
+            if result.status != CommandStatus.SUCCESS:
+                raise RuntimeError(f"Post-iter-step failed! Exit code: {result.exit_code}\nstdout: {result.stdout}\nstderr: {result.stderr}")
+
+        return command_result
+
+    def benchmark_iteration_env(self, env: dict, warmup: bool, variant: Optional[str] = None) -> dict:
+        """Environment of one iteration; the phase is also published in the benchmark state for running processes."""
+        phase = "warmup" if warmup else "measure"
+        set_bench_phase(phase)
+
+        iteration_env = dict(env, TF_BENCH_WARMUP="1" if warmup else "0", TF_BENCH_PHASE=phase, TF_BENCH_ITERATION=str(get_bench_iter()))
+        if variant:
+            iteration_env["TF_BENCH_VARIANT"] = variant
+        return iteration_env
+
+    def read_benchmark_results(self, results_file: str) -> dict:
+        """Results in JSON or columnar format; samples of columnar results stay typed arrays."""
+        if not os.path.exists(results_file):
+            return {}
+
+        return load_results(results_file)
+
+    def count_benchmark_result_iterations(self, results_file: str) -> int:
+        return len(self.read_benchmark_results(results_file).get("iterations", []))
+
+    def truncate_benchmark_results(self, results_file: str, entries: int):
+        results = self.read_benchmark_results(results_file)
+        if len(results.get("iterations", [])) > entries:
+            results["iterations"] = results["iterations"][:entries]
+            self.write_benchmark_results(results_file, results)
+
+    def read_benchmark_metric(self, metric: str, command_result: CommandResult, session: BenchmarkSession, results_file: str) -> float:
+        """Value of the adaptive stopping metric for the iteration that has just finished."""
+        if metric == "wall_time":
+            if not command_result.resource_usage:
+                raise RuntimeError("Wall time of the benchmark command was not measured.")
+            return command_result.resource_usage.wall_time_seconds
+
+        if session.last_entry is None:
+            raise RuntimeError(f"Metric \"{metric}\" requires results of every iteration in {results_file}, but none were found.")
+
+        value = session.last_entry.get("metrics_summary", {})
+        for key in metric.split("."):
+            if not isinstance(value, dict) or key not in value:
+                raise RuntimeError(f"Metric \"{metric}\" not found in metrics_summary of the last iteration in {results_file}.")
+            value = value[key]
+
+        return float(value)
+
+    def run_benchmark_iterations(self, benchmark_case: BenchmarkCase, env: dict, cwd: str, results_file: str) -> BenchmarkSession:
+        """Run a fixed number of iterations, or with an adaptive config until the metric's confidence interval is narrow enough."""
+        adaptive = benchmark_case.adaptive
+        warmup_iterations = adaptive.warmup_iterations if adaptive else 0
+        measured_iterations = adaptive.max_iterations if adaptive else benchmark_case.iterations
+
+        session = BenchmarkSession(environment=BenchmarkEnvironmentManager(benchmark_case.environment), profiler=self.benchmark_profiler(benchmark_case))
+        metric_values = []
+        confidence_interval = None
+
+        # Parsing the growing results file is only worth it when entries may be dropped, tagged or measured
+        if warmup_iterations or session.profiler is not None or session.environment.can_rerun(0) or (adaptive and adaptive.metric != "wall_time"):
+            session.result_entries = self.count_benchmark_result_iterations(results_file)
+
+        for iteration in range(warmup_iterations + measured_iterations):
+            warmup = iteration < warmup_iterations
+            iteration_name = f"warm-up iteration {iteration + 1} of {warmup_iterations}" if warmup \
+                else f"iteration {iteration - warmup_iterations + 1} of {measured_iterations}"
+            logging.info(f"Starting {iteration_name}")
+
+            measured_iteration = iteration - warmup_iterations + 1
+            profiled = not warmup and session.profiler is not None and session.profiler.selects(measured_iteration)
+
+            # Benchmark scripts can tell warm-up iterations apart, e.g. to skip expensive reporting
+            iteration_env = self.benchmark_iteration_env(env, warmup)
+            result = self.run_benchmark_iteration(benchmark_case, iteration_env, cwd, results_file, session,
+                                                  f"iteration_{measured_iteration}" if profiled else None)
+
+            logging.info(f"Completed {iteration_name}")
+
+            incr_bench_iter()
+
+            if warmup:
+                session.warmup_entries = session.result_entries
+                continue
+
+            # The profiler's overhead would distort the stopping rule
+            if adaptive and not profiled:
+                metric_values.append(self.read_benchmark_metric(adaptive.metric, result, session, results_file))
+
+                if len(metric_values) >= adaptive.min_iterations:
+                    confidence_interval = mean_confidence_interval(metric_values, adaptive.confidence)
+                    logging.info(f"Metric {adaptive.metric}: mean {confidence_interval.mean}, {adaptive.confidence:.0%} confidence interval "
+                                 f"[{confidence_interval.low}, {confidence_interval.high}], relative width {confidence_interval.relative_width:.4f}")
+
+                    if confidence_interval.relative_width <= adaptive.target_ci_width:
+                        logging.info(f"Target confidence interval width {adaptive.target_ci_width} reached after {len(metric_values)} iteration(s)")
+                        break
+
+        if adaptive:
+            target_reached = confidence_interval is not None and confidence_interval.relative_width <= adaptive.target_ci_width
+            session.sections["adaptive"] = self.adaptive_summary(adaptive, metric_values, confidence_interval, target_reached)
+
+        session.sections["environment"] = session.environment.summary()
+        if session.profiler:
+            session.sections["profiles"] = session.profiler.summary()
+        return session
+
+    def run_ab_benchmark_iterations(self, benchmark_case: BenchmarkCase, env: dict, cwd: str, results_file: str) -> BenchmarkSession:
+        """Alternate the baseline (A) and candidate (B) builds in ABBA order and compare them pair by pair."""
+        adaptive = benchmark_case.adaptive
+        metric = adaptive.metric if adaptive else "wall_time"
+        confidence = adaptive.confidence if adaptive else 0.95
+        warmup_pairs = adaptive.warmup_iterations if adaptive else 0
+        measured_pairs = adaptive.max_iterations if adaptive else benchmark_case.iterations
+
+        session = BenchmarkSession(environment=BenchmarkEnvironmentManager(benchmark_case.environment), profiler=self.benchmark_profiler(benchmark_case))
+        baseline_values, candidate_values = [], []
+        differences_interval = None
+        target_reached = False
+        # Entries are tagged with their variant, so they are tracked through every iteration
+        session.result_entries = self.count_benchmark_result_iterations(results_file)
+
+        for pair in range(warmup_pairs + measured_pairs):
+            warmup = pair < warmup_pairs
+            # ABBA ordering cancels linear drift (thermal, caches, background load) within every two pairs
+            order = ("A", "B") if pair % 2 == 0 else ("B", "A")
+            values = {}
+
+            # Both variants of a profiled pair are profiled, so their profiles can be compared
+            measured_pair = pair - warmup_pairs + 1
+            profiled = not warmup and session.profiler is not None and session.profiler.selects(measured_pair)
+
+            for variant in order:
+                logging.info(f"Starting {'warm-up ' if warmup else ''}pair {pair + 1}, variant {variant}")
+
+                # Benchmark scripts run the build installed in the slot named by TF_BENCH_VARIANT
+                iteration_env = self.benchmark_iteration_env(env, warmup, variant)
+                result_entries = session.result_entries
+                result = self.run_benchmark_iteration(benchmark_case, iteration_env, cwd, results_file, session,
+                                                      f"pair_{measured_pair}_{variant}" if profiled else None)
+
+                incr_bench_iter()
+
+                if session.result_entries > result_entries:
+                    session.entry_variants.append((result_entries, session.result_entries, variant))
+
+                if not warmup:
+                    values[variant] = self.read_benchmark_metric(metric, result, session, results_file)
+
+            if warmup:
+                session.warmup_entries = session.result_entries
+                continue
+
+            if profiled:
+                logging.info(f"Pair {pair + 1} was profiled, it is left out of the comparison")
+                continue
+
+            baseline_values.append(values["A"])
+            candidate_values.append(values["B"])
+            logging.info(f"Pair {pair + 1}: {metric} A={values['A']} B={values['B']}")
+
+            if adaptive and len(baseline_values) >= adaptive.min_iterations:
+                differences = [b - a for a, b in zip(baseline_values, candidate_values)]
+                differences_interval = mean_confidence_interval(differences, confidence)
+                baseline_mean = statistics.fmean(baseline_values)
+                relative_width = differences_interval.width / abs(baseline_mean) if baseline_mean else math.inf
+
+                if relative_width <= adaptive.target_ci_width:
+                    logging.info(f"Target confidence interval width {adaptive.target_ci_width} of the difference reached after {len(baseline_values)} pair(s)")
+                    target_reached = True
+                    break
+
+        if len(baseline_values) < 2:
+            raise RuntimeError("A/B benchmark needs at least two measured pairs for a comparison.")
+
+        analysis = compare_paired(baseline_values, candidate_values, confidence)
+        analysis["metric"] = metric
+        analysis["baseline_values"] = baseline_values
+        analysis["candidate_values"] = candidate_values
+        session.sections["ab_comparison"] = analysis
+
+        logging.info(f"A/B comparison of {metric}: relative difference {analysis['relative_difference']}, "
+                     f"paired t-test p={analysis['t_test_p_value']:.4g}, Wilcoxon p={analysis['wilcoxon_p_value']:.4g}, significant: {analysis['significant']}")
+
+        if adaptive:
+            session.sections["adaptive"] = self.adaptive_summary(adaptive, [b - a for a, b in zip(baseline_values, candidate_values)], differences_interval, target_reached)
+
+        session.sections["environment"] = session.environment.summary()
+        if session.profiler:
+            session.sections["profiles"] = session.profiler.summary()
+        return session
+
+    def benchmark_profiler(self, benchmark_case: BenchmarkCase) -> Optional[BenchmarkProfiler]:
+        if benchmark_case.profile is None:
+            return None
+        return BenchmarkProfiler(benchmark_case.profile, expand_magic_variables("$__TF_WORK_DIR__/profiles"))
+
+    def upload_benchmark_profiles(self, benchmark, session: BenchmarkSession):
+        """Upload collapsed stacks and flame graphs next to the results; a failed upload only loses the profile."""
+        if session.profiler is None:
+            return
+
+        for profile in session.profiler.profiles:
+            for file_path in (profile['collapsed_file'], profile['flame_graph_file']):
+                try:
+                    upload_benchmark_profile(benchmark, self._config, file_path)
+                    logging.info(f"Uploaded profile {os.path.basename(file_path)}")
+                except Exception as e:
+                    logging.error(f"Failed to upload profile {file_path}: {e}")
+
+    def shard_benchmark_case(self, benchmark_case: BenchmarkCase, shard_index: int, shard_count: int) -> BenchmarkCase:
+        """The benchmark with only this shard's share of the iterations (of the adaptive maximum, if adaptive)."""
+        iterations = shard_iterations(benchmark_case.iterations, shard_index, shard_count)
+
+        adaptive = benchmark_case.adaptive
+        if adaptive:
+            share = shard_iterations(adaptive.max_iterations, shard_index, shard_count)
+            adaptive = replace(adaptive, max_iterations=max(share, adaptive.min_iterations))
+
+        return replace(benchmark_case, iterations=iterations, adaptive=adaptive)
+
+    def shard_summary(self, benchmark, benchmark_case: BenchmarkCase, session: BenchmarkSession) -> dict:
+        fingerprint = session.environment.fingerprint_start
+        return {
+            "index": benchmark.shard_index,
+            "count": benchmark.shard_count,
+            "host": self._host.hostname if self._host else fingerprint["hostname"],
+            # Shards are only comparable when measured on the same hardware
+            "hardware_class": f"{fingerprint['cpu_model']} ({fingerprint['cpu_count_logical']} logical CPUs, "
+                              f"{round(fingerprint['memory_total_bytes'] / (1024 ** 3))} GB)",
+            "iterations_planned": benchmark_case.iterations,
+            "benchmarks_run_id": benchmark.benchmarks_run_id,
+            "benchmark_id": benchmark.benchmark_id
+        }
+
+    def adaptive_summary(self, adaptive: AdaptiveIterations, metric_values: List[float], confidence_interval: Optional[ConfidenceInterval], target_reached: bool) -> dict:
+        return {
+            "metric": adaptive.metric,
+            "warmup_iterations": adaptive.warmup_iterations,
+            "measured_iterations": len(metric_values),
+            "min_iterations": adaptive.min_iterations,
+            "max_iterations": adaptive.max_iterations,
+            "confidence": adaptive.confidence,
+            "target_ci_width": adaptive.target_ci_width,
+            "target_reached": target_reached,
+            "values": metric_values,
+            "mean": confidence_interval.mean if confidence_interval else None,
+            "ci_low": confidence_interval.low if confidence_interval else None,
+            "ci_high": confidence_interval.high if confidence_interval else None
+        }
+
+    def finalize_benchmark_results(self, results_file: str, session: BenchmarkSession, format_name: str = "json"):
+        """Tag A/B variants and profiled iterations, drop warm-up iterations, add summary sections and convert the results file."""
+        format_version = RESULTS_FORMAT_COLUMNAR if format_name == "columnar" else RESULTS_FORMAT_JSON
+        converted = os.path.exists(results_file) and results_format(results_file) != format_version
+        if not session.warmup_entries and not session.entry_variants and not session.profiled_entries and not session.sections and not converted:
+            return
+
+        if not os.path.exists(results_file):
+            logging.warning(f"Benchmark results file {results_file} not found, iteration summary not written.")
+            return
+
+        results = self.read_benchmark_results(results_file)
+        iterations = results.get("iterations", [])
+
+        for first, end, variant in session.entry_variants:
+            for entry in iterations[first:end]:
+                entry["variant"] = variant
+
+        for first, end in session.profiled_entries:
+            for entry in iterations[first:end]:
+                entry["profiled"] = True
+
+        results["iterations"] = iterations[session.warmup_entries:]
+        results.update(session.sections)
+
+        self.write_benchmark_results(results_file, results, format_version)
+
+    def write_benchmark_results(self, results_file: str, results: dict, format_version: Optional[int] = None):
+        """Write the results, by default in the format the file already has."""
+        if format_version is None:
+            format_version = results_format(results_file) if os.path.exists(results_file) else RESULTS_FORMAT_JSON
+
+        save_results(results_file, results, format_version)
+
+    def prepare_benchmark_results_upload(self, benchmark, benchmark_case: BenchmarkCase, results_file: str) -> str:
+        """The results file to upload: a copy with downsampled metric series if configured, the finalized file otherwise.
+
+        The full-resolution file stays in the work dir and, with a results archive configured, is copied there first.
+        """
+        if benchmark_case.downsample is None or not os.path.exists(results_file):
+            return results_file
+
+        history_config = self._config.benchmark_history
+        if history_config is not None and history_config.results_archive_dir:
+            os.makedirs(history_config.results_archive_dir, exist_ok=True)
+            archive_file = os.path.join(history_config.results_archive_dir, f"benchmark_{benchmark.benchmark_id}_result_{benchmark.id}{os.path.splitext(results_file)[1]}")
+            shutil.copyfile(results_file, archive_file)
+            logging.info(f"Archived full-resolution results to {archive_file}")
+
+        downsample = benchmark_case.downsample
+        results = self.read_benchmark_results(results_file)
+        reduced = downsample_results(results, downsample.points, downsample.method)
+
+        root, extension = os.path.splitext(results_file)
+        upload_file = f"{root}.downsampled{extension}"
+        save_results(upload_file, reduced, results_format(results_file))
+
+        logging.info(f"Downsampled metric series to {downsample.points} points ({downsample.method}): "
+                     f"{os.path.getsize(results_file)} -> {os.path.getsize(upload_file)} bytes")
+        return upload_file
+
+    def detect_benchmark_regressions(self, benchmark, benchmark_case: BenchmarkCase, results_file: str, session: BenchmarkSession):
+        """Compare the finalized results with the benchmark's history, add the verdict to the results file and record this run."""
+        detection = benchmark_case.regression
+        if detection is None:
+            return
+
+        if benchmark.shard_count > 1:
+            logging.info("Regression detection skipped for a shard; it applies to the merged results of all shards.")
+            return
+
+        history_config = self._config.benchmark_history
+        if history_config is None:
+            logging.warning("Regression detection requested, but no BenchmarkHistory is configured.")
+            return
+
+        results = self.read_benchmark_results(results_file)
+        if not results.get("iterations"):
+            logging.warning(f"Benchmark results file {results_file} has no iterations, regression detection skipped.")
+            return
+
+        current = history_run_from_results(results, benchmark.id, datetime.now(timezone.utc))
+        history = load_history(history_config.history_dir, history_config.export_file, benchmark.benchmark_id, detection.history_runs)
+
+        verdict = detect_regressions(history, current, detection)
+        if session.profiler and session.profiler.profiles:
+            # Flame graphs of this run, uploaded next to the results, to look into a regression right away
+            verdict["profiles"] = [os.path.basename(profile['flame_graph_file']) for profile in session.profiler.profiles]
+        session.sections["regression"] = verdict
+        logging.info(f"Regression detection against {len(history)} historical run(s): {verdict['status']}")
+
+        results["regression"] = verdict
+        self.write_benchmark_results(results_file, results)
+
+        append_history_run(history_config.history_dir, benchmark.benchmark_id, current)
+
     def archive_and_upload_temp_dir(self, test):
         temp_dir = expand_magic_variables("$__TF_WORK_DIR__")
         archive_path = expand_magic_variables(f"$__TF_TEMP_DIR__/result_temp_archive.7z")
@@ -587,12 +1138,14 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
         except Exception as e:
             logging.error(f"Failed to create temp directory: {e}")
     
-    def execute_command(self, command: str, env: dict, cwd: str) -> CommandResult:
+    def execute_command(self, command: str, env: dict, cwd: str, cores: Optional[List[int]] = None, on_exit: Optional[Callable[[ResourceUsage], None]] = None) -> CommandResult:
         job = None
         process_handle = None
+        meter = None
         try:
             # Create a Windows Job Object to group the process and all its children
             job = win32job.CreateJobObject(None, "")
+            meter = ResourceMeter(job)
 
             # Start the process
             process = subprocess.Popen(
@@ -610,10 +1163,20 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
             except Exception as e:
                 logging.warning(f"Failed to assign process to job object: {e}")
 
+            if cores:
+                try:
+                    pin_process_tree(job, process.pid, cores)
+                except Exception as e:
+                    logging.warning(f"Failed to pin process to CPUs {cores}: {e}")
+
             # Wait for process to complete and collect output
             stdout, stderr = process.communicate()
             exit_code = process.returncode
 
+            if on_exit:
+                # Usage at the exit, before the grace period and the clean-up of leftover children
+                on_exit(meter.finish())
+
             stdout_str = stdout.decode('utf-8', errors='replace') if stdout else ""
             stderr_str = stderr.decode('utf-8', errors='replace') if stderr else ""
 
@@ -622,19 +1185,22 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
 
             # Terminate any leftover child processes still in the job
             leftover_pids = self._terminate_job_processes(job, exclude_pids={process.pid})
+            resource_usage = self.record_resource_usage(command, meter)
 
             if exit_code != 0:
-                return CommandResult(CommandStatus.ERROR, exit_code, "", f"Non-zero exit code! Code: {exit_code}", leftover_pids)
+                return CommandResult(CommandStatus.ERROR, exit_code, "", f"Non-zero exit code! Code: {exit_code}", leftover_pids, resource_usage)
             else:
-                return CommandResult(CommandStatus.SUCCESS, 0, "", "", leftover_pids)
+                return CommandResult(CommandStatus.SUCCESS, 0, "", "", leftover_pids, resource_usage)
             
         except FileNotFoundError:
             leftover_pids = self._terminate_job_processes(job)
-            return CommandResult(CommandStatus.ERROR, -1, "", "Command not found or could not be executed!", leftover_pids)
+            resource_usage = self.record_resource_usage(command, meter)
+            return CommandResult(CommandStatus.ERROR, -1, "", "Command not found or could not be executed!", leftover_pids, resource_usage)
         
         except Exception as e:
             leftover_pids = self._terminate_job_processes(job)
-            return CommandResult(CommandStatus.ERROR, -1, "", f"Command execution failed! Details: {e}", leftover_pids)
+            resource_usage = self.record_resource_usage(command, meter)
+            return CommandResult(CommandStatus.ERROR, -1, "", f"Command execution failed! Details: {e}", leftover_pids, resource_usage)
         
         finally:
             if job:
@@ -649,6 +1215,21 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                 except:
                     pass
 
+    def record_resource_usage(self, command: str, meter: Optional[ResourceMeter]) -> Optional[ResourceUsage]:
+        """Collect the resource usage of a finished command and add it to the current test or benchmark steps."""
+        if meter is None:
+            return None
+
+        usage = meter.finish()
+        self._step_resource_usage.append(StepResourceUsage(command, usage))
+
+        logging.info(f"Resource usage: wall {usage.wall_time_seconds:.2f}s, user {usage.cpu_user_seconds}s, system {usage.cpu_system_seconds}s, "
+                     f"peak memory {usage.peak_memory_bytes} B, read {usage.io_read_bytes} B, written {usage.io_write_bytes} B")
+        return usage
+
+    def resource_usage_summary(self) -> Optional[dict]:
+        return summarize_resource_usage(self._step_resource_usage)
+
     def _terminate_job_processes(self, job, exclude_pids: Set[int] = None) -> List[int]:
         """Query remaining processes in the job, terminate them individually, and return their PIDs."""
         leftover_pids = []
@@ -710,33 +1291,62 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
         else:
             return ""
 
-    def detect_encoding(self, file_path):
-        with open(file_path, 'rb') as f:
-            raw_data = f.read()
-            result = chardet.detect(raw_data)
-        return result['encoding'] if result['encoding'] else 'utf-8'  # Default to UTF-8 if unknown
+    def get_diff_options(self, diff: DiffPair) -> dict:
+        return {
+            **self._DIFF_OPTIONS,
+            'normalize': [asdict(rule) for rule in diff.normalize]
+        }
+
+    def detect_encoding(self, file_path, revision: Optional[str] = None):
+        return self._encoding_detector.detect(file_path, revision)
+
+    def diff_sizes_exceeded(self, gold_file: str, new_file: str) -> bool:
+        """Whether the files differ in size by more than 10MB, too much for a readable diff report."""
+        max_size_difference = 10 * 1024 * 1024
+        new_size = os.path.getsize(new_file)
+        if is_compressed(gold_file):
+            # Counted while streaming, never written out; stops as soon as the guard is exceeded, which also
+            # bounds what git later reads from stdin
+            gold_size = decompressed_size(gold_file, new_size + max_size_difference)
+        else:
+            gold_size = os.path.getsize(gold_file)
+
+        return gold_size is None or abs(gold_size - new_size) > max_size_difference
 
-    def generate_html_diff(self, gold_file: str, new_file: str, report_file: str, encoding: str):
-        # Quick check: if files are byte-identical, skip diffing entirely
-        if filecmp.cmp(gold_file, new_file, shallow=False):
+    def generate_html_diff(self, gold_file: str, new_file: str, report_file: str, encoding: str, comparison: Optional[FileComparison] = None):
+        # Quick check: if files are byte-identical, skip diffing entirely (the caller may have compared them already)
+        if comparison is None:
+            comparison = compare_files(gold_file, new_file)
+        if comparison.identical:
             open(report_file, 'w').close()
             return
 
+        logging.info(f"Files {gold_file} and {new_file} first differ at byte offset {comparison.first_mismatch_offset}")
+
         # Cap on diff OUTPUT lines (not input). We compare full files but stop
         # collecting differences once we have enough for the report.
-        max_diff_lines = 50000
+        max_diff_lines = self._DIFF_OPTIONS['max_diff_lines']
+        context_lines = self._DIFF_OPTIONS['context_lines']
         diff_lines = []
         truncated = False
 
         # Use git diff for efficient C-based comparison (handles 600K+ line files).
         # Stream output line-by-line and stop early once cap is reached.
+        # Compressed gold files are decompressed on the fly and fed to git through stdin.
+        gold_is_compressed = is_compressed(gold_file)
         try:
             process = subprocess.Popen(
-                ['git', 'diff', '--no-index', '--no-color', '--text', '--unified=10',
-                 '--', gold_file, new_file],
+                ['git', 'diff', '--no-index', '--no-color', '--text', f'--unified={context_lines}',
+                 '--', '-' if gold_is_compressed else gold_file, new_file],
+                stdin=subprocess.PIPE if gold_is_compressed else subprocess.DEVNULL,
                 stdout=subprocess.PIPE, stderr=subprocess.PIPE
             )
 
+            gold_feeder = None
+            if gold_is_compressed:
+                gold_feeder = threading.Thread(target=self.feed_decompressed, args=(gold_file, process.stdin), daemon=True)
+                gold_feeder.start()
+
             for raw_line in process.stdout:
                 line = raw_line.decode(encoding, errors='replace').rstrip('\n').rstrip('\r')
                 # Skip git diff metadata lines
@@ -754,19 +1364,22 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
             process.kill()
             process.wait()
 
+            if gold_feeder:
+                gold_feeder.join()
+
         except (FileNotFoundError, OSError):
             # git not available - fall back to Python difflib.
             # Use generator to cap output lines (SequenceMatcher still processes
             # all input internally, but at least we limit memory for results).
             logging.warning("git not available for diff, falling back to Python difflib (may be slow for large files)")
-            with open(gold_file, 'r', encoding=encoding, errors='replace') as f1, \
-                 open(new_file, 'r', encoding=encoding, errors='replace') as f2:
+            with io.TextIOWrapper(open_decompressed(gold_file), encoding=encoding, errors='replace') as f1, \
+                 io.TextIOWrapper(open_decompressed(new_file), encoding=encoding, errors='replace') as f2:
                 gold_content = f1.readlines()
                 new_content = f2.readlines()
 
             differ = difflib.unified_diff(gold_content, new_content,
                                           fromfile=gold_file, tofile=new_file,
-                                          lineterm='', n=10)
+                                          lineterm='', n=context_lines)
             for line in differ:
                 if line.startswith('---') or line.startswith('+++'):
                     continue
@@ -780,6 +1393,8 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
             open(report_file, 'w').close()
             return
 
+        mismatch_note = f'<p>First difference at byte offset {comparison.first_mismatch_offset:,}.</p>'
+
         truncation_note = ''
         if truncated:
             truncation_note = f'<p style="color: #856404; background-color: #fff3cd; padding: 10px; border: 1px solid #ffeeba; border-radius: 4px;">Note: Diff output exceeded {max_diff_lines:,} line limit. Only the first {max_diff_lines:,} differences are shown.</p>'
@@ -847,6 +1462,7 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
                 </head>
                 <body>
                     <h2>File Difference Report</h2>
+                    {mismatch_note}
                     {truncation_note}
                     <div class="view-buttons">
                         <button id="side-by-side-btn" class="active-view" onclick="switchView('side-by-side-view')">Side By Side View</button>
@@ -977,6 +1593,19 @@ class TestFarmWindowsService(win32serviceutil.ServiceFramework):
         with open(report_file, 'w', encoding='utf-8', errors='replace') as f:
             f.write(html_content)
     
+    def feed_decompressed(self, file_path: str, pipe):
+        """Stream decompressed file content into a pipe; stops quietly when the reader goes away."""
+        try:
+            with open_decompressed(file_path) as source:
+                shutil.copyfileobj(source, pipe, 1024 * 1024)
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
     def escape_html(self, text: str) -> str:
         """Escape HTML special characters."""
         return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
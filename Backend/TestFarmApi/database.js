@@ -388,6 +388,18 @@ const TestResult = sequelize.define('TestResult', {
   ExecutionOutput: {
     type: DataTypes.TEXT('long'),
     allowNull: true
+  },
+  // Wall time, CPU time and peak memory of the test's processes, reported by the executor on completion
+  ResourceUsage: {
+    type: DataTypes.TEXT,
+    allowNull: true,
+    get() {
+      const rawValue = this.getDataValue('ResourceUsage');
+      return rawValue ? JSON.parse(rawValue) : null;
+    },
+    set(value) {
+      this.setDataValue('ResourceUsage', value ? JSON.stringify(value) : null);
+    }
   }
 }, {
   tableName: 'TestsResults',
@@ -543,6 +555,18 @@ const BenchmarksRun = sequelize.define('BenchmarksRun', {
     set(value) {
       this.setDataValue('Artifacts', value ? JSON.stringify(value) : null);
     }
+  },
+  // A/B mode: artifacts of the baseline build, installed next to Artifacts and measured interleaved with it
+  BaselineArtifacts: {
+    type: DataTypes.TEXT,
+    allowNull: true,
+    get() {
+      const rawValue = this.getDataValue('BaselineArtifacts');
+      return rawValue ? JSON.parse(rawValue) : [];
+    },
+    set(value) {
+      this.setDataValue('BaselineArtifacts', value && value.length ? JSON.stringify(value) : null);
+    }
   }
 }, {
   tableName: 'BenchmarksRuns',
@@ -625,6 +649,41 @@ const BenchmarkResult = sequelize.define('BenchmarkResult', {
   Results: {
     type: DataTypes.TEXT('long'),
     allowNull: true
+  },
+  // Sharded benchmarks: one result per shard, each covering its share of the iterations on one host
+  ShardIndex: {
+    type: DataTypes.INTEGER,
+    allowNull: false,
+    defaultValue: 0
+  },
+  ShardCount: {
+    type: DataTypes.INTEGER,
+    allowNull: false,
+    defaultValue: 1
+  },
+  // Statistical analysis of the run (A/B comparison, regression verdict, shard and profile summaries)
+  Analysis: {
+    type: DataTypes.TEXT('long'),
+    allowNull: true,
+    get() {
+      const rawValue = this.getDataValue('Analysis');
+      return rawValue ? JSON.parse(rawValue) : null;
+    },
+    set(value) {
+      this.setDataValue('Analysis', value ? JSON.stringify(value) : null);
+    }
+  },
+  // Wall time, CPU time and peak memory of the benchmark's processes, reported by the executor on completion
+  ResourceUsage: {
+    type: DataTypes.TEXT,
+    allowNull: true,
+    get() {
+      const rawValue = this.getDataValue('ResourceUsage');
+      return rawValue ? JSON.parse(rawValue) : null;
+    },
+    set(value) {
+      this.setDataValue('ResourceUsage', value ? JSON.stringify(value) : null);
+    }
   }
 }, {
   tableName: 'BenchmarksResults',
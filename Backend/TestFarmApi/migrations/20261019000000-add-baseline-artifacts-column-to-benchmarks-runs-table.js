@@ -0,0 +1,17 @@
+'use strict';
+
+module.exports = {
+  up: async (queryInterface, Sequelize) => {
+    // Add BaselineArtifacts column to BenchmarksRuns table (A/B benchmark runs)
+    await queryInterface.addColumn('BenchmarksRuns', 'BaselineArtifacts', {
+      type: Sequelize.TEXT,
+      allowNull: true,
+      defaultValue: null
+    });
+  },
+
+  down: async (queryInterface, Sequelize) => {
+    // Remove BaselineArtifacts column from BenchmarksRuns table
+    await queryInterface.removeColumn('BenchmarksRuns', 'BaselineArtifacts');
+  }
+};
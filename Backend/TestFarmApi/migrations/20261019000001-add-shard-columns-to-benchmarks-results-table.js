@@ -0,0 +1,24 @@
+'use strict';
+
+module.exports = {
+  up: async (queryInterface, Sequelize) => {
+    // Add ShardIndex and ShardCount columns to BenchmarksResults table (sharded benchmarks)
+    await queryInterface.addColumn('BenchmarksResults', 'ShardIndex', {
+      type: Sequelize.INTEGER,
+      allowNull: false,
+      defaultValue: 0
+    });
+
+    await queryInterface.addColumn('BenchmarksResults', 'ShardCount', {
+      type: Sequelize.INTEGER,
+      allowNull: false,
+      defaultValue: 1
+    });
+  },
+
+  down: async (queryInterface, Sequelize) => {
+    // Remove ShardIndex and ShardCount columns from BenchmarksResults table
+    await queryInterface.removeColumn('BenchmarksResults', 'ShardIndex');
+    await queryInterface.removeColumn('BenchmarksResults', 'ShardCount');
+  }
+};
@@ -0,0 +1,22 @@
+'use strict';
+
+module.exports = {
+  up: async (queryInterface, Sequelize) => {
+    // Add ResourceUsage column to TestsResults and BenchmarksResults tables (JSON reported by the executor)
+    await queryInterface.addColumn('TestsResults', 'ResourceUsage', {
+      type: Sequelize.TEXT,
+      allowNull: true
+    });
+
+    await queryInterface.addColumn('BenchmarksResults', 'ResourceUsage', {
+      type: Sequelize.TEXT,
+      allowNull: true
+    });
+  },
+
+  down: async (queryInterface, Sequelize) => {
+    // Remove ResourceUsage column from TestsResults and BenchmarksResults tables
+    await queryInterface.removeColumn('TestsResults', 'ResourceUsage');
+    await queryInterface.removeColumn('BenchmarksResults', 'ResourceUsage');
+  }
+};
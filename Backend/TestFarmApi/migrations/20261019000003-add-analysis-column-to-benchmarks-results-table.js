@@ -0,0 +1,16 @@
+'use strict';
+
+module.exports = {
+  up: async (queryInterface, Sequelize) => {
+    // Add Analysis column to BenchmarksResults table (JSON statistical analysis uploaded with the results)
+    await queryInterface.addColumn('BenchmarksResults', 'Analysis', {
+      type: Sequelize.TEXT('long'),
+      allowNull: true
+    });
+  },
+
+  down: async (queryInterface, Sequelize) => {
+    // Remove Analysis column from BenchmarksResults table
+    await queryInterface.removeColumn('BenchmarksResults', 'Analysis');
+  }
+};
@@ -32,7 +32,7 @@ router.post('/schedule-benchmarks-run', async (req, res) => {
   console.log('Scheduling benchmarks run:', req.body);
 
   // TODO: Rename TestRunName to BenchmarksRunName
-  const { RepositoryName, SuiteName, GridName, TestRunName, Artifacts, TeamsNotificationUrl } = req.body;
+  const { RepositoryName, SuiteName, GridName, TestRunName, Artifacts, BaselineArtifacts, TeamsNotificationUrl } = req.body;
   const localRepositoryDir = `${appSettings.storage.repositories}/${RepositoryName}`;  
   
   try {
@@ -55,6 +55,7 @@ router.post('/schedule-benchmarks-run', async (req, res) => {
       Name: TestRunName,
       TeamsNotificationUrl: TeamsNotificationUrl,
       Artifacts: Artifacts,
+      BaselineArtifacts: BaselineArtifacts,
       OverallCreationTimestamp: new Date(),
       OverallStatus: 'queued'
     });
@@ -71,9 +72,14 @@ router.post('/schedule-benchmarks-run', async (req, res) => {
         let benchmark = await Benchmark.findOne({ where: {RepositoryName: RepositoryName, SuiteName: SuiteName, Path: benchmarkPath, Name: benchmarkConfig.name} })
                      ?? await Benchmark.create({ RepositoryName: RepositoryName, SuiteName: SuiteName, Path: benchmarkPath,  Name: benchmarkConfig.name, Owner: benchmarkConfig.owner, CreationTimestamp: new Date() });
 
-        let result = await BenchmarkResult.create({ BenchmarksRunId: benchmarksRun.Id, BenchmarkId: benchmark.Id, Status: 'queued', ExecutionStartTimestamp: null, ExecutionEndTimestamp: null, ExecutionOutput: null, Results: null });
+        // Sharded benchmarks get one result and one job per shard, so their iterations are spread over the grid's hosts
+        const shardCount = Number.isInteger(benchmarkConfig.shards) && benchmarkConfig.shards > 1 ? benchmarkConfig.shards : 1;
+
+        for (let shardIndex = 0; shardIndex < shardCount; shardIndex++) {
+          let result = await BenchmarkResult.create({ BenchmarksRunId: benchmarksRun.Id, BenchmarkId: benchmark.Id, Status: 'queued', ExecutionStartTimestamp: null, ExecutionEndTimestamp: null, ExecutionOutput: null, Results: null, ShardIndex: shardIndex, ShardCount: shardCount });
 
-        await MicroJobsQueue.create({ Type: 'bench', Status: 'queued', GridName: GridName, RunId: benchmarksRun.Id, ResultId: result.Id });
+          await MicroJobsQueue.create({ Type: 'bench', Status: 'queued', GridName: GridName, RunId: benchmarksRun.Id, ResultId: result.Id });
+        }
         queuedCount++;
       }
       catch (error) {
@@ -474,10 +480,19 @@ router.get('/get-scheduled-test', async (req, res) => {
   }
 });
 
+// Resource usage reported on completion: a plain object of wall time, CPU time and peak memory
+function isResourceUsage(value) {
+  return value !== null && typeof value === 'object' && !Array.isArray(value);
+}
+
 router.post('/complete-benchmark', async (req, res) => {
-  const { BenchmarkResultId } = req.body;
+  const { BenchmarkResultId, ResourceUsage } = req.body;
   
   try {
+    if (ResourceUsage !== undefined && !isResourceUsage(ResourceUsage)) {
+      return res.status(400).json({ message: 'ResourceUsage must be an object' });
+    }
+
     const benchmarkResult = await BenchmarkResult.findByPk(BenchmarkResultId);
     
     if (!benchmarkResult) {
@@ -486,6 +501,9 @@ router.post('/complete-benchmark', async (req, res) => {
     
     benchmarkResult.Status = 'completed';
     benchmarkResult.ExecutionEndTimestamp = new Date();
+    if (ResourceUsage !== undefined) {
+      benchmarkResult.ResourceUsage = ResourceUsage;
+    }
     await benchmarkResult.save();
     
     await MicroJobsQueue.destroy({
@@ -522,9 +540,13 @@ router.post('/complete-benchmark', async (req, res) => {
 });
 
 router.post('/complete-test', async (req, res) => {
-  const { TestResultId, Status } = req.body;
+  const { TestResultId, Status, ResourceUsage } = req.body;
 
   try {
+    if (ResourceUsage !== undefined && !isResourceUsage(ResourceUsage)) {
+      return res.status(400).json({ message: 'ResourceUsage must be an object' });
+    }
+
     const testResult = await TestResult.findByPk(TestResultId);
     
     if (!testResult) {
@@ -533,6 +555,9 @@ router.post('/complete-test', async (req, res) => {
     
     testResult.Status = Status;
     testResult.ExecutionEndTimestamp = new Date();
+    if (ResourceUsage !== undefined) {
+      testResult.ResourceUsage = ResourceUsage;
+    }
     await testResult.save();
 
     await MicroJobsQueue.destroy({
@@ -606,7 +631,7 @@ const uploadBenchmarkResults = multer({
 });
 
 router.post('/upload-benchmark-results', uploadBenchmarkResults.single('report'), async (req, res) => {
-  const { BenchmarkResultId } = req.body;
+  const { BenchmarkResultId, Analysis } = req.body;
   const reportFile = req.file;
 
   try {
@@ -620,12 +645,27 @@ router.post('/upload-benchmark-results', uploadBenchmarkResults.single('report')
       return res.status(400).json({ message: 'Report file is required' });
     }
 
+    // Multipart form fields are strings, the analysis comes JSON-encoded
+    let analysis = null;
+    if (Analysis) {
+      try {
+        analysis = JSON.parse(Analysis);
+      } catch (error) {
+        fs.unlinkSync(reportFile.path);
+        return res.status(400).json({ message: 'Analysis must be valid JSON' });
+      }
+    }
+
     const filePath = reportFile.path;
-    const fileContent = fs.readFileSync(filePath, 'utf8');
+    // Read as bytes: results are JSON or the binary columnar format, told apart by the reader
+    const fileContent = fs.readFileSync(filePath);
     const reportContent = zlib.gzipSync(fileContent).toString('base64');
     fs.unlinkSync(filePath);
 
     benchmarkResult.Results = reportContent;
+    if (analysis) {
+      benchmarkResult.Analysis = analysis;
+    }
     await benchmarkResult.save();
 
     res.status(201).json({ message: 'Benchmark results uploaded successfully' });
@@ -772,6 +812,83 @@ router.get('/download-temp-dir-archive/:TestResultId', async (req, res) => {
   }
 });
 
+const benchmarkProfileStorage = multer.diskStorage({
+  destination: (req, file, cb) => {
+    if (!req.body.BenchmarkResultId) {
+      return cb(new Error('BenchmarkResultId is required in the request body'));
+    }
+    // Profiles of a benchmark result (collapsed stacks, flame graphs) share one directory
+    const profileDir = path.join(appSettings.storage.benchmarkProfiles, String(parseInt(req.body.BenchmarkResultId, 10)));
+    fs.mkdirSync(profileDir, { recursive: true });
+    cb(null, profileDir);
+  },
+  filename: (req, file, cb) => {
+    cb(null, path.basename(file.originalname));
+  }
+});
+
+const uploadBenchmarkProfile = multer({
+  storage: benchmarkProfileStorage,
+  limits: { fileSize: 1024 * 1024 * 100 } // 100MB file size limit
+}).single('profile');
+
+router.post('/upload-benchmark-profile', uploadBenchmarkProfile, async (req, res) => {
+  const { BenchmarkResultId } = req.body;
+
+  try {
+    const benchmarkResult = await BenchmarkResult.findByPk(BenchmarkResultId);
+
+    if (!benchmarkResult) {
+      return res.status(404).json({ message: 'Benchmark result not found' });
+    }
+
+    if (!req.file) {
+      return res.status(400).json({ message: 'Profile file is required' });
+    }
+
+    res.status(201).json({ message: 'Benchmark profile uploaded successfully', Name: req.file.filename });
+  } catch (error) {
+    console.error('Error uploading benchmark profile:', error);
+    res.status(500).json({ error: 'Internal Server Error', details: error.message });
+  }
+});
+
+router.get('/benchmark-profiles/:BenchmarkResultId', async (req, res) => {
+  const { BenchmarkResultId } = req.params;
+
+  try {
+    const profileDir = path.join(appSettings.storage.benchmarkProfiles, String(parseInt(BenchmarkResultId, 10)));
+    const names = fs.existsSync(profileDir) ? fs.readdirSync(profileDir) : [];
+
+    res.status(200).json(names);
+  } catch (error) {
+    console.error('Error listing benchmark profiles:', error);
+    res.status(500).json({ error: 'Internal Server Error', details: error.message });
+  }
+});
+
+router.get('/download-benchmark-profile/:BenchmarkResultId/:Name', async (req, res) => {
+  const { BenchmarkResultId, Name } = req.params;
+
+  try {
+    const profilePath = path.join(appSettings.storage.benchmarkProfiles, String(parseInt(BenchmarkResultId, 10)), path.basename(Name));
+
+    if (!fs.existsSync(profilePath)) {
+      return res.status(404).json({ message: 'Profile file not found' });
+    }
+
+    // Flame graphs open in the browser, collapsed stacks download
+    if (profilePath.endsWith('.svg')) {
+      res.type('image/svg+xml').sendFile(path.resolve(profilePath));
+    } else {
+      res.download(profilePath);
+    }
+  } catch (error) {
+    console.error('Error downloading benchmark profile:', error);
+    res.status(500).json({ error: 'Internal Server Error', details: error.message });
+  }
+});
+
 router.get('/diff/:id', async (req, res) => {
   const { id } = req.params;
 
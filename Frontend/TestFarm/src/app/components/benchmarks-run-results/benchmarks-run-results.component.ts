@@ -11,6 +11,7 @@ import { BenchmarksRunDetailsDescription } from 'src/app/models/benchmarks-run-d
 import { Chart, ChartConfiguration, registerables } from 'chart.js';
 import { BenchmarkResultDetailsDescription } from 'src/app/models/benchmark-result-details-description';
 import { BenchmarkResultMeasurements, ProcessedIterationMetrics, ProcessedCombinedMetrics, calculateCombinedStepsMetrics, calculateCombinedStepsMetricsPerIteration } from 'src/app/models/benchmark-result-measurements';
+import { decodeColumnarResults, isColumnarResults } from 'src/app/models/columnar-results';
 import { Artifact } from 'src/app/models/artifact';
 
 Chart.register(...registerables);
@@ -1979,8 +1980,12 @@ export class BenchmarksRunResultsComponent implements OnInit, AfterViewInit, OnD
         bytes[i] = binaryString.charCodeAt(i);
       }
 
-      const decompressedMeasurements = pako.ungzip(bytes, { to: 'string' }) as string;
-      return JSON.parse(decompressedMeasurements);
+      // Results are uploaded as JSON or in the binary columnar format
+      const decompressedMeasurements = pako.ungzip(bytes);
+      if (isColumnarResults(decompressedMeasurements)) {
+        return decodeColumnarResults<BenchmarkResultMeasurements>(decompressedMeasurements);
+      }
+      return JSON.parse(new TextDecoder().decode(decompressedMeasurements));
     } catch (error) {
       console.error('Error processing benchmark measurements:', error);
       return null;
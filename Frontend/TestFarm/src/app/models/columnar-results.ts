@@ -0,0 +1,117 @@
+// Reader of the binary columnar results format (format_version 2) written by testfarm_columnar_utils.
+// Layout: 16-byte preamble (magic "TFCR", version, header length), JSON header, then one little-endian
+// array per sample leaf. Tables are rebuilt into the same sample objects the JSON results contain.
+
+const MAGIC = 'TFCR';
+const PREAMBLE_SIZE = 16;
+const SUPPORTED_VERSION = 2;
+
+interface ColumnSchema {
+  path: string[];
+  type: 'f64' | 'i64' | 'bool';
+  offset: number;
+  length: number;
+  integer?: boolean;
+}
+
+interface TableSchema {
+  rows: number;
+  columns: ColumnSchema[];
+  constants: { path: string[]; value: unknown }[];
+  strings: { path: string[]; values: unknown[] }[];
+  paths?: string[][];
+}
+
+interface Leaf {
+  path: string[];
+  values?: unknown[];
+  constant?: unknown;
+}
+
+export function isColumnarResults(bytes: Uint8Array): boolean {
+  return bytes.length >= PREAMBLE_SIZE && String.fromCharCode(bytes[0], bytes[1], bytes[2], bytes[3]) === MAGIC;
+}
+
+export function decodeColumnarResults<T>(bytes: Uint8Array): T {
+  const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+
+  const version = view.getUint16(4, true);
+  if (version > SUPPORTED_VERSION) {
+    throw new Error(`Unsupported columnar results version ${version}`);
+  }
+
+  const headerLength = view.getUint32(8, true);
+  const header = JSON.parse(new TextDecoder().decode(bytes.subarray(PREAMBLE_SIZE, PREAMBLE_SIZE + headerLength)));
+  const dataStart = PREAMBLE_SIZE + headerLength;
+
+  const tables = (header.tables as TableSchema[]).map(schema => decodeTable(view, dataStart, schema));
+  return insertTables(header.document, tables) as T;
+}
+
+function decodeTable(view: DataView, dataStart: number, schema: TableSchema): object[] {
+  const leaves = new Map<string, Leaf>();
+
+  for (const column of schema.columns) {
+    leaves.set(column.path.join('\u0000'), { path: column.path, values: readColumn(view, dataStart + column.offset, schema.rows, column) });
+  }
+  for (const leaf of schema.strings ?? []) {
+    leaves.set(leaf.path.join('\u0000'), { path: leaf.path, values: leaf.values });
+  }
+  for (const leaf of schema.constants ?? []) {
+    leaves.set(leaf.path.join('\u0000'), { path: leaf.path, constant: leaf.value });
+  }
+
+  // Leaves in the order they had in the original samples
+  const ordered = schema.paths ? schema.paths.map(path => leaves.get(path.join('\u0000'))!) : Array.from(leaves.values());
+
+  const records: object[] = [];
+  for (let row = 0; row < schema.rows; row++) {
+    const record: Record<string, unknown> = {};
+    for (const leaf of ordered) {
+      setLeaf(record, leaf.path, leaf.values ? leaf.values[row] : leaf.constant);
+    }
+    records.push(record);
+  }
+
+  return records;
+}
+
+function readColumn(view: DataView, start: number, rows: number, column: ColumnSchema): unknown[] {
+  const values = new Array<unknown>(rows);
+
+  for (let row = 0; row < rows; row++) {
+    if (column.type === 'f64') {
+      const value = view.getFloat64(start + row * 8, true);
+      values[row] = Number.isNaN(value) ? null : value;  // NaN stands for null
+    } else if (column.type === 'i64') {
+      // Low and high words, exact up to Number.MAX_SAFE_INTEGER
+      values[row] = view.getInt32(start + row * 8 + 4, true) * 4294967296 + view.getUint32(start + row * 8, true);
+    } else {
+      values[row] = view.getUint8(start + row) !== 0;
+    }
+  }
+
+  return values;
+}
+
+function setLeaf(record: Record<string, unknown>, path: string[], value: unknown): void {
+  let node = record;
+  for (const key of path.slice(0, -1)) {
+    node = (node[key] ??= {}) as Record<string, unknown>;
+  }
+  node[path[path.length - 1]] = value;
+}
+
+function insertTables(value: unknown, tables: object[][]): unknown {
+  if (Array.isArray(value)) {
+    return value.map(item => insertTables(item, tables));
+  }
+  if (value !== null && typeof value === 'object') {
+    const entries = Object.entries(value);
+    if (entries.length === 1 && entries[0][0] === '$table') {
+      return tables[entries[0][1] as number];
+    }
+    return Object.fromEntries(entries.map(([key, item]) => [key, insertTables(item, tables)]));
+  }
+  return value;
+}
@@ -1,3 +1,8 @@
 from .testfarm_agents_utils import *
 from .testfarm_benchmarks_utils import *
+from .testfarm_columnar_utils import *
+from .testfarm_markers_utils import *
+from .testfarm_metrics_utils import *
+from .testfarm_shards_utils import *
+from .testfarm_state_utils import *
 from .testfarm_unit_tests_utils import *
\ No newline at end of file
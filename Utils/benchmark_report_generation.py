@@ -0,0 +1,69 @@
+import sys
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+
+import testfarm_metrics_utils
+from testfarm_benchmarks_utils import ProcessMonitor
+
+# Measures ProcessMonitor.generate_report on synthetic samples, e.g. to check
+# that a report over a long run sampled every second stays cheap.
+#
+# usage: python benchmark_report_generation.py [--samples N] [--repeat N] [--no-numpy]
+
+def fill_monitor(monitor: ProcessMonitor, samples: int):
+    start = datetime.now()
+    memory_total = 16 * 1024 ** 3
+
+    for i in range(samples):
+        monitor.samples.append_record({
+            'timestamp': start.timestamp() + i,
+            'elapsed_time': float(i),
+            'sampling_overhead': random.uniform(0.0002, 0.002),
+            'process.cpu_percent': random.uniform(0, 100),
+            'process.cpu_times_user': i * 0.5,
+            'process.cpu_times_system': i * 0.1,
+            'process.cpu_times_total': i * 0.6,
+            'process.memory_rss': random.randint(100, 200) * 1024 ** 2,
+            'process.memory_percent': random.uniform(0.5, 1.5),
+            'process.num_threads': random.randint(1, 16),
+            'process.num_processes': 1,
+            'process.fd_handle_count': random.randint(10, 50),
+            'process.io_read_bytes': i * 4096,
+            'process.io_write_bytes': i * 1024,
+            'system.memory_total': memory_total,
+        })
+
+    monitor.start_time = start
+    monitor.end_time = start + timedelta(seconds=samples)
+    monitor.result = {'stdout': b'', 'stderr': b'', 'exit_code': 0}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ProcessMonitor report generation.")
+    parser.add_argument("--samples", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-numpy", action="store_true", help="Use the pure Python code path")
+    args = parser.parse_args()
+
+    if args.no_numpy:
+        testfarm_metrics_utils.np = None
+
+    monitor = ProcessMonitor(command=[], interval=1.0)
+
+    print(f"Generating {args.samples} samples...")
+    fill_monitor(monitor, args.samples)
+    print(f"Sample store size: {monitor.samples.memory_usage_bytes() / (1024 * 1024):.1f} MB")
+
+    timings = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        monitor.generate_report()
+        timings.append(time.perf_counter() - started)
+
+    backend = "numpy" if testfarm_metrics_utils.np is not None else "pure python"
+    print(f"generate_report ({backend}): best {min(timings):.3f} s, worst {max(timings):.3f} s over {args.repeat} runs")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,74 +1,631 @@
 import os
+import re
 import json
+import shlex
+import shutil
 import psutil
 import subprocess
 import time
 import sys
 import json
-from datetime import datetime
+import socket
+import tempfile
+from collections import deque
+from datetime import datetime, timedelta
 from threading import Thread, Event
-import statistics
+from typing import Optional
 import platform
+from bisect import bisect_left, bisect_right
 
-from testfarm_agents_utils import expand_magic_variables
+from testfarm_agents_utils import expand_magic_variables, get_magic_variable
+from testfarm_state_utils import BenchmarkState, STATE_FILE_ENV_VAR
+from testfarm_markers_utils import MARKERS_DIR_ENV_VAR, read_markers, pair_spans
+from testfarm_columnar_utils import RESULTS_FORMAT_JSON, ColumnTable, save_results
+from testfarm_metrics_utils import MetricsStore, MetricsStreamWriter, read_metrics_stream, distribution_stats, series_max, series_min, series_mean, series_sum, series_nonzero, series_finite, series_diff
 
 __all__ = [
+    "get_bench_state",
     "reset_bench_iter",
     "get_bench_iter",
     "incr_bench_iter",
+    "get_bench_phase",
+    "set_bench_phase",
     "remove_benchmark_process_file",
     "ProcessMonitor"
 ]
 
+# Open benchmark state files by path
+_bench_states = {}
+
+
+def get_bench_state() -> BenchmarkState:
+    """Shared state of the running benchmark, opened once per process and file."""
+    path = _bench_state_path()
+
+    state = _bench_states.get(path)
+    if state is None:
+        state = _bench_states[path] = BenchmarkState(path)
+    return state
+
+
+def _bench_state_path() -> str:
+    return os.environ.get(STATE_FILE_ENV_VAR) or expand_magic_variables(f"$__TF_TEMP_DIR__/benchmark_process.testfarm")
+
 
 def reset_bench_iter():
-    benchmark_process_file = expand_magic_variables(f"$__TF_TEMP_DIR__/benchmark_process.testfarm")
-    
-    data = {"current_iteration": 0}
-    with open(benchmark_process_file, 'w') as f:
-        json.dump(data, f, indent=2)
+    get_bench_state().reset({"current_iteration": 0})
 
 
 def get_bench_iter() -> int:
-    benchmark_process_file = expand_magic_variables(f"$__TF_TEMP_DIR__/benchmark_process.testfarm")
+    return get_bench_state().get("current_iteration", 0)
 
-    with open(benchmark_process_file, 'r') as f:
-        data = json.load(f)
 
-    return data.get("current_iteration", 0)
+def incr_bench_iter() -> int:
+    return get_bench_state().increment("current_iteration")
 
 
-def incr_bench_iter():
-    benchmark_process_file = expand_magic_variables(f"$__TF_TEMP_DIR__/benchmark_process.testfarm")
+def get_bench_phase() -> Optional[str]:
+    return get_bench_state().get("phase")
 
-    with open(benchmark_process_file, 'r') as f:
-        data = json.load(f)
 
-    data["current_iteration"] = data.get("current_iteration", 0) + 1
-
-    with open(benchmark_process_file, 'w') as f:
-        json.dump(data, f, indent=2)
+def set_bench_phase(phase: str):
+    get_bench_state().set("phase", phase)
 
 
 def remove_benchmark_process_file():
-    benchmark_process_file = expand_magic_variables(f"$__TF_TEMP_DIR__/benchmark_process.testfarm")
-    
-    if os.path.exists(benchmark_process_file):
-        os.remove(benchmark_process_file)
-    else:
-        raise FileNotFoundError(f"Benchmark process file {benchmark_process_file} does not exist.")
+    path = _bench_state_path()
+
+    # Checked before opening: get_bench_state() would create the file
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Benchmark process file {path} does not exist.")
+
+    state = _bench_states.pop(path, None)
+    if state is not None:
+        state.close()
+
+    os.remove(path)
+    try:
+        os.remove(f"{path}.lock")
+    except OSError:
+        pass  # still open in a benchmark process (Windows); it is reused by the next state file
+
+
+class ProcessTreeTracker:
+    """Tracks a process and its descendants as they appear and exit, aggregating their metrics"""
+
+    # Counters that only grow over a process lifetime; values of exited processes are carried over
+    CUMULATIVE_KEYS = ('io_read_count', 'io_write_count', 'io_read_bytes', 'io_write_bytes',
+                       'ctx_voluntary', 'ctx_involuntary')
+
+    # Gauges summed over the processes alive at sampling time
+    GAUGE_KEYS = ('cpu_percent', 'memory_rss', 'memory_vms', 'num_threads', 'network_connections')
+
+    def __init__(self, root_pid, include_children=True):
+        self.root = psutil.Process(root_pid)
+        self.include_children = include_children
+
+        # On POSIX a parent's children_user/children_system include all children it has reaped.
+        # Windows does not report them, so exited processes are accounted by their last-seen values.
+        self._reaped_children_times = include_children and platform.system().lower() != 'windows'
+
+        self._processes = {root_pid: self.root}
+        self._parents = {root_pid: None}
+        self._last_values = {}
+        self._absorbed = {}
+        self._exited_totals = {key: 0 for key in ProcessTreeTracker.CUMULATIVE_KEYS + ('cpu_user', 'cpu_system')}
+        self._cpu_user_floor = 0.0
+        self._cpu_system_floor = 0.0
+
+        self.max_concurrent_processes = 1
+        self.summaries = {root_pid: self._new_summary(self.root, is_root=True)}
+
+    @staticmethod
+    def _new_summary(proc, is_root=False):
+        try:
+            name = proc.name()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            name = ''
+        return {
+            'pid': proc.pid,
+            'name': name,
+            'is_root': is_root,
+            'first_seen': time.time(),
+            'exit_seen': None,
+            'cpu_times_user': 0,
+            'cpu_times_system': 0,
+            'peak_memory_rss': 0,
+            'peak_threads': 0,
+            'io_read_bytes': 0,
+            'io_write_bytes': 0,
+        }
+
+    def discover(self):
+        """Start tracking descendants that appeared since the previous call"""
+        if not self.include_children:
+            return
+
+        try:
+            descendants = self.root.children(recursive=True)
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            return
+
+        for child in descendants:
+            if child.pid in self._processes:
+                continue
+            try:
+                parent_pid = child.ppid()
+                child.cpu_percent()  # establish the CPU percent baseline
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                continue
+
+            self._processes[child.pid] = child
+            self._parents[child.pid] = parent_pid
+            self.summaries[child.pid] = self._new_summary(child)
+
+    def sample(self, read_process):
+        """Read every tracked process with read_process(proc) and return the aggregated values"""
+        self.discover()
+
+        totals = {key: 0 for key in ProcessTreeTracker.GAUGE_KEYS + ProcessTreeTracker.CUMULATIVE_KEYS}
+        live_cpu_user = 0.0
+        live_cpu_system = 0.0
+        fd_handle_count = None
+        alive = 0
+
+        # Known processes stay tracked even when reparented outside of the root's subtree
+        for pid, proc in list(self._processes.items()):
+            try:
+                values = read_process(proc)
+            except (psutil.NoSuchProcess, psutil.ZombieProcess):
+                if pid == self.root.pid:
+                    raise
+                self._mark_exited(pid)
+                continue
+            except psutil.AccessDenied:
+                if pid == self.root.pid:
+                    raise
+                continue
+
+            # A reparented process will not be reaped by its original (tracked) parent
+            if pid != self.root.pid and values['ppid'] != self._parents[pid]:
+                self._parents[pid] = None
+
+            alive += 1
+            self._last_values[pid] = values
+            self._update_summary(pid, values)
+
+            for key in totals:
+                totals[key] += values[key]
+
+            live_cpu_user += values['cpu_user']
+            live_cpu_system += values['cpu_system']
+            if self._reaped_children_times:
+                live_cpu_user += values['cpu_children_user']
+                live_cpu_system += values['cpu_children_system']
+
+            if values['fd_handle_count'] is not None:
+                fd_handle_count = (fd_handle_count or 0) + values['fd_handle_count']
+
+        for key in ProcessTreeTracker.CUMULATIVE_KEYS:
+            totals[key] += self._exited_totals[key]
+
+        # Keep CPU times monotonic; a reaped child may briefly be accounted neither live nor exited
+        self._cpu_user_floor = max(self._cpu_user_floor, live_cpu_user + self._exited_totals['cpu_user'])
+        self._cpu_system_floor = max(self._cpu_system_floor, live_cpu_system + self._exited_totals['cpu_system'])
+
+        self.max_concurrent_processes = max(self.max_concurrent_processes, alive)
+
+        totals['cpu_user'] = self._cpu_user_floor
+        totals['cpu_system'] = self._cpu_system_floor
+        totals['fd_handle_count'] = fd_handle_count
+        totals['num_processes'] = alive
+        return totals
+
+    def _update_summary(self, pid, values):
+        summary = self.summaries[pid]
+        summary['cpu_times_user'] = values['cpu_user']
+        summary['cpu_times_system'] = values['cpu_system']
+        summary['peak_memory_rss'] = max(summary['peak_memory_rss'], values['memory_rss'])
+        summary['peak_threads'] = max(summary['peak_threads'], values['num_threads'])
+        summary['io_read_bytes'] = values['io_read_bytes']
+        summary['io_write_bytes'] = values['io_write_bytes']
+
+    def _mark_exited(self, pid):
+        del self._processes[pid]
+        parent_pid = self._parents.pop(pid, None)
+        last_values = self._last_values.pop(pid, None)
+
+        self.summaries[pid]['exit_seen'] = time.time()
+
+        if last_values is None:
+            return
+
+        for key in ProcessTreeTracker.CUMULATIVE_KEYS:
+            self._exited_totals[key] += last_values[key]
+
+        # A tracked parent reaps the process and reports its full CPU time itself, either directly
+        # while still running, or as part of its own times once it is reaped in turn
+        absorbed = self._reaped_children_times and parent_pid is not None and \
+            (parent_pid in self._processes or self._absorbed.get(parent_pid, False))
+        self._absorbed[pid] = absorbed
+
+        if absorbed:
+            return
+
+        self._exited_totals['cpu_user'] += last_values['cpu_user'] + last_values['cpu_children_user']
+        self._exited_totals['cpu_system'] += last_values['cpu_system'] + last_values['cpu_children_system']
+
+    def process_summaries(self):
+        return list(self.summaries.values())
+
+    def live_pids(self):
+        return list(self._processes)
+
+
+class LinuxSocketAccounting:
+    """Per process tree TCP traffic: socket inodes from /proc/<pid>/fd matched with tcp_info counters from ss
+
+    ss lists every TCP socket of the host, which costs several milliseconds, so counters are refreshed at most
+    once per interval and samples in between repeat the last totals. Sockets opened and closed within one
+    interval are not seen.
+    """
+
+    _SOCKET_LINK = re.compile(r'^socket:\[(\d+)\]$')
+    _INODE = re.compile(r'\bino:(\d+)')
+    _COUNTER = re.compile(r'\b(bytes_sent|bytes_acked|bytes_received|segs_out|segs_in):(\d+)')
+
+    @staticmethod
+    def is_supported():
+        return platform.system().lower() == 'linux' and shutil.which('ss') is not None
+
+    def __init__(self, interval=1.0):
+        # Last counters of every socket ever owned by the tree; closed sockets keep their final values
+        self._sockets = {}
+        self.interval = interval
+        self._last_refresh = None
+        self._totals = {'bytes_sent': 0, 'bytes_recv': 0, 'packets_sent': 0, 'packets_recv': 0}
+
+    def sample(self, pids):
+        now = time.perf_counter()
+        if self._last_refresh is not None and now - self._last_refresh < self.interval:
+            return dict(self._totals)
+        self._last_refresh = now
+
+        inodes = set()
+        for pid in pids:
+            inodes.update(self.socket_inodes(pid))
+
+        if inodes:
+            for inode, counters in self.read_tcp_counters().items():
+                if inode in inodes:
+                    self._sockets[inode] = counters
+
+        totals = {'bytes_sent': 0, 'bytes_recv': 0, 'packets_sent': 0, 'packets_recv': 0}
+        for counters in self._sockets.values():
+            # bytes_sent (kernel 4.19+) includes retransmissions, older kernels only report bytes_acked
+            totals['bytes_sent'] += counters.get('bytes_sent', counters.get('bytes_acked', 0))
+            totals['bytes_recv'] += counters.get('bytes_received', 0)
+            totals['packets_sent'] += counters.get('segs_out', 0)
+            totals['packets_recv'] += counters.get('segs_in', 0)
+
+        self._totals = totals
+        return dict(totals)
+
+    @property
+    def sockets_seen(self):
+        return len(self._sockets)
+
+    @staticmethod
+    def socket_inodes(pid):
+        fd_dir = f"/proc/{pid}/fd"
+        inodes = []
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            return inodes
+
+        for fd in fds:
+            try:
+                match = LinuxSocketAccounting._SOCKET_LINK.match(os.readlink(os.path.join(fd_dir, fd)))
+            except OSError:
+                continue  # fd closed meanwhile
+            if match:
+                inodes.append(int(match.group(1)))
+
+        return inodes
+
+    @staticmethod
+    def read_tcp_counters():
+        """Map socket inode -> tcp_info byte and segment counters of all TCP sockets on the host"""
+        try:
+            output = subprocess.run(['ss', '-tinHe'], capture_output=True, text=True, timeout=5).stdout
+        except (OSError, subprocess.TimeoutExpired):
+            return {}
+
+        counters = {}
+        inode = None
+        for line in output.splitlines():
+            # Each socket is a summary line (with ino:) followed by an indented tcp_info line
+            if line and not line[0].isspace():
+                match = LinuxSocketAccounting._INODE.search(line)
+                inode = int(match.group(1)) if match and match.group(1) != '0' else None
+            elif inode is not None:
+                counters.setdefault(inode, {}).update((key, int(value)) for key, value in LinuxSocketAccounting._COUNTER.findall(line))
+
+        return counters
+
+
+class SamplingClock:
+    """Schedules samples on absolute perf_counter deadlines, so sampling cost does not stretch the interval"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.ticks = 0
+        self.missed_ticks = 0
+        self.max_lateness = 0.0
+        self.started_at = None
+        self._next_deadline = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._next_deadline = self.started_at
+
+    def wait_next(self, stop_event):
+        """Sleep until the next deadline; returns False if stop_event was set meanwhile"""
+        self.ticks += 1
+        self._next_deadline += self.interval
+        now = time.perf_counter()
+
+        if now > self._next_deadline:
+            # Sampling overran one or more ticks: skip them instead of bursting to catch up
+            lateness = now - self._next_deadline
+            self.max_lateness = max(self.max_lateness, lateness)
+            missed = int(lateness // self.interval) + 1 if self.interval > 0 else 0
+            self.missed_ticks += missed
+            self._next_deadline += missed * self.interval
+
+        return not stop_event.wait(max(0.0, self._next_deadline - now))
+
+
+class PerfCounters:
+    """Hardware performance counters of a process tree, collected by running the command under perf stat"""
+
+    EVENTS = ('instructions', 'cycles', 'cache-references', 'cache-misses', 'branches', 'branch-misses', 'page-faults')
+
+    # perf stat rejects shorter -I intervals
+    MIN_INTERVAL_MS = 100
+
+    def __init__(self, output_file, interval=None):
+        self.output_file = output_file
+        self.interval_ms = max(PerfCounters.MIN_INTERVAL_MS, int(interval * 1000)) if interval else None
+
+    @staticmethod
+    def check_available():
+        """Return (available, reason) after a short probe run of perf stat"""
+        if platform.system().lower() != 'linux':
+            return False, "hardware counters are only supported on Linux"
+        if shutil.which('perf') is None:
+            return False, "perf is not installed"
+
+        try:
+            probe = subprocess.run(['perf', 'stat', '-x,', '-e', 'instructions,cycles', '--', 'true'],
+                                   capture_output=True, text=True, timeout=10)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            return False, f"perf probe failed: {e}"
+
+        if probe.returncode != 0:
+            lines = probe.stderr.strip().splitlines()
+            # Usually perf_event_paranoid is too strict for the agent's user
+            return False, lines[-1] if lines else f"perf exited with code {probe.returncode}"
+        if '<not supported>' in probe.stderr:
+            return False, "hardware events are not supported on this host (virtual machine without PMU?)"
+
+        return True, None
+
+    def wrap(self, command):
+        """Command line running command under perf stat; counters are inherited by all its children"""
+        if isinstance(command, str):
+            command = shlex.split(command)
+
+        perf_command = ['perf', 'stat', '-x,', '-e', ','.join(PerfCounters.EVENTS), '-o', self.output_file]
+        if self.interval_ms:
+            perf_command += ['-I', str(self.interval_ms)]
+        return perf_command + ['--'] + list(command)
+
+    def parse(self):
+        """Totals, derived ratios and per-interval deltas from the perf stat CSV output"""
+        intervals = {}
+        not_counted = set()
+
+        try:
+            with open(self.output_file, 'r') as f:
+                lines = f.read().splitlines()
+        except OSError as e:
+            return {'available': False, 'reason': f"perf output not found: {e}"}
+
+        for line in lines:
+            if not line.strip() or line.startswith('#'):
+                continue
+
+            fields = line.split(',')
+            # Interval mode prefixes every line with the interval timestamp
+            timestamp = None
+            if self.interval_ms:
+                timestamp, fields = float(fields[0]), fields[1:]
+            if len(fields) < 3:
+                continue
+
+            value, event = fields[0], PerfCounters._event_name(fields[2])
+            if event not in PerfCounters.EVENTS:
+                continue
+
+            if value.startswith('<'):
+                not_counted.add(event)  # <not counted> / <not supported>
+                continue
+
+            # Hybrid CPUs report one line per core type, so values are summed
+            counters = intervals.setdefault(timestamp, {})
+            counters[event] = counters.get(event, 0) + int(float(value))
+
+        totals = {}
+        for counters in intervals.values():
+            for event, value in counters.items():
+                totals[event] = totals.get(event, 0) + value
+
+        report = {
+            'available': True,
+            'events': totals,
+            'not_counted': sorted(not_counted),
+            **PerfCounters._ratios(totals),
+        }
+
+        if self.interval_ms:
+            report['interval_ms'] = self.interval_ms
+            report['intervals'] = [{'time': timestamp, **counters, **PerfCounters._ratios(counters)}
+                                   for timestamp, counters in sorted(intervals.items())]
+
+        return report
+
+    @staticmethod
+    def _event_name(name):
+        # "instructions:u" -> "instructions", "cpu_core/instructions/" -> "instructions"
+        parts = name.split('/')
+        if len(parts) >= 3:
+            name = parts[1]
+        return name.split(':')[0]
+
+    @staticmethod
+    def _ratios(counters):
+        def ratio(numerator, denominator):
+            return counters[numerator] / counters[denominator] if counters.get(denominator) and numerator in counters else None
+
+        return {
+            'ipc': ratio('instructions', 'cycles'),
+            'cache_miss_rate': ratio('cache-misses', 'cache-references'),
+            'branch_miss_rate': ratio('branch-misses', 'branches'),
+        }
+
+
+class OutputDrain:
+    """Drains a child process pipe into a file on a background thread, keeping only the last lines in memory"""
+
+    # Upper bound of a single read, so a huge line without a newline is never held in memory as a whole
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, pipe, file_path, tail_lines=100):
+        self.file_path = file_path
+        self.bytes_written = 0
+        self.lines_written = 0
+        self._pipe = pipe
+        self._tail = deque(maxlen=tail_lines)
+        self._thread = Thread(target=self._drain, daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def join(self, timeout=None):
+        # A grandchild inheriting the pipe can keep it open after the main process exits
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    @property
+    def truncated(self):
+        """True if the in-memory tail does not hold the whole output"""
+        return self.lines_written > len(self._tail)
+
+    def tail(self):
+        return b''.join(self._tail).decode('utf-8', errors='replace')
+
+    def _drain(self):
+        with open(self.file_path, 'wb') as f:
+            for chunk in iter(lambda: self._pipe.readline(OutputDrain.READ_SIZE), b''):
+                f.write(chunk)
+                self.bytes_written += len(chunk)
+                self.lines_written += 1
+                self._tail.append(chunk)
+        self._pipe.close()
+
 
 class ProcessMonitor:
-    def __init__(self, command, timeout=900, interval=1.0):
+    # Metric groups that can be sampled; "connections" is by far the most expensive one
+    METRIC_GROUPS = ('cpu', 'memory', 'io', 'fds', 'network', 'connections', 'system')
+
+    # Flat schema of one sample in the columnar store: 'd' for floats, 'q' for integer counters
+    SAMPLE_COLUMNS = (
+        ('timestamp', 'd'),
+        ('elapsed_time', 'd'),
+        ('sampling_overhead', 'd'),
+        ('process.cpu_percent', 'd'),
+        ('process.cpu_percent_raw', 'd'),
+        ('process.cpu_times_user', 'd'),
+        ('process.cpu_times_system', 'd'),
+        ('process.cpu_times_total', 'd'),
+        ('process.memory_rss', 'q'),
+        ('process.memory_vms', 'q'),
+        ('process.memory_percent', 'd'),
+        ('process.num_threads', 'q'),
+        ('process.num_processes', 'q'),
+        ('process.fd_handle_count', 'd'),
+        ('process.io_read_count', 'q'),
+        ('process.io_write_count', 'q'),
+        ('process.io_read_bytes', 'q'),
+        ('process.io_write_bytes', 'q'),
+        ('process.network_bytes_sent', 'q'),
+        ('process.network_bytes_recv', 'q'),
+        ('process.network_packets_sent', 'q'),
+        ('process.network_packets_recv', 'q'),
+        ('process.network_connections', 'q'),
+        ('process.context_switches_voluntary', 'q'),
+        ('process.context_switches_involuntary', 'q'),
+        ('system.cpu_percent', 'd'),
+        ('system.memory_total', 'q'),
+        ('system.memory_available', 'q'),
+        ('system.memory_used', 'q'),
+        ('system.memory_percent', 'd'),
+    )
+
+    # Samples kept in memory by default when streaming to disk; the report re-reads the stream file
+    STREAM_MEMORY_SAMPLES = 3600
+
+    def __init__(self, command, timeout=900, interval=1.0, metric_groups=None, track_children=True, max_samples=None,
+                 stream_file=None, stream_flush_interval=5.0, output_dir=None, output_tail_lines=100, per_process_network=False,
+                 hardware_counters=False, markers=False, network_interval=1.0, cleanup_output=False):
         self.command = command
         self.timeout = timeout
         self.interval = interval
+        self.track_children = track_children
+        self.process_tree = None
+        self.metric_groups = set(metric_groups) if metric_groups is not None else set(ProcessMonitor.METRIC_GROUPS)
         self.stop_event = Event()
-        self.metrics = []
+        self.stream_file = stream_file
+        self.stream_flush_interval = stream_flush_interval
+        self._stream = None
+        self.partial = False
+        # Process output goes to files in output_dir; only the last output_tail_lines lines stay in memory.
+        # They stay for the agent's per-job clean-up; cleanup_output removes them after a successful run.
+        self.output_dir = output_dir or (os.path.dirname(os.path.abspath(stream_file)) if stream_file else ProcessMonitor.default_output_dir())
+        self.output_tail_lines = output_tail_lines
+        self.cleanup_output = cleanup_output
+        self._stdout_drain = None
+        self._stderr_drain = None
+        if stream_file and max_samples is None:
+            max_samples = ProcessMonitor.STREAM_MEMORY_SAMPLES
+        # With max_samples set, only the most recent samples are kept (ring buffer)
+        self.samples = MetricsStore(ProcessMonitor.SAMPLE_COLUMNS, capacity=max_samples)
         self.process = None
         self.start_time = None
         self.end_time = None
+        # perf_counter readings taken together with start_time/end_time, for sub-second precision
+        self._start_counter = None
+        self._end_counter = None
+        self.clock = SamplingClock(interval)
         self.result = None
+        # Events the benchmark process records with mark()/span(), read from markers_dir after the run.
+        # Opt-in, as it adds TF_BENCH_MARKERS_DIR to the command's environment.
+        self.markers = markers
+        self.markers_dir = None
+        self.events = []
+        self.events_dropped = 0
         
         # Detect operating system
         self.is_windows = platform.system().lower() == 'windows'
@@ -76,30 +633,73 @@ class ProcessMonitor:
         self.is_macos = platform.system().lower() == 'darwin'
         
         print(f"Detected OS: {platform.system()} ({platform.release()})")
+
+        unknown_groups = self.metric_groups - set(ProcessMonitor.METRIC_GROUPS)
+        if unknown_groups:
+            raise ValueError(f"Unknown metric groups: {sorted(unknown_groups)}. Available: {ProcessMonitor.METRIC_GROUPS}")
+        
+        # Static host properties, queried once instead of on every sample
+        self._cpu_count = psutil.cpu_count() or 1
+        self._memory_total = psutil.virtual_memory().total
+        
+        # Hardware counters wrap the command in perf stat, which then is the root of the monitored tree
+        self.hardware_counters = hardware_counters
+        self._perf = None
+        self._perf_unavailable_reason = None
+        if hardware_counters:
+            available, self._perf_unavailable_reason = PerfCounters.check_available()
+            if available:
+                os.makedirs(self.output_dir, exist_ok=True)
+                perf_file = tempfile.NamedTemporaryFile(dir=self.output_dir, prefix='benchmark_perf_', suffix='.csv', delete=False)
+                perf_file.close()
+                self._perf = PerfCounters(perf_file.name, interval=interval)
+                self.track_children = True
+            else:
+                print(f"Hardware counters not available, continuing without them: {self._perf_unavailable_reason}")
+
+        # Network traffic is the host's unless per-process accounting is requested and supported; it queries all
+        # sockets of the host, so its counters are refreshed only every network_interval seconds
+        self._socket_accounting = None
+        if per_process_network and 'network' in self.metric_groups and LinuxSocketAccounting.is_supported():
+            self._socket_accounting = LinuxSocketAccounting(max(network_interval, interval))
+        self.network_scope = 'process_tree' if self._socket_accounting else 'system'
+        if per_process_network and 'network' in self.metric_groups and self.network_scope == 'system':
+            print("Per-process network accounting not available, network metrics are system-wide")
         
         # Initialize network baseline
         self._last_net_io = None
         self._baseline_net_io = None
         
     def start_target_process(self):
+        command = self._perf.wrap(self.command) if self._perf else self.command
+
+        env = None
+        if self.markers:
+            os.makedirs(self.output_dir, exist_ok=True)
+            self.markers_dir = tempfile.mkdtemp(dir=self.output_dir, prefix='benchmark_markers_')
+            env = dict(os.environ, **{MARKERS_DIR_ENV_VAR: self.markers_dir})
+
         try:
             if self.is_windows:
                 # Windows-specific process creation
                 self.process = subprocess.Popen(
-                    self.command,
+                    command,
                     # shell=True,
                     stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                    stderr=subprocess.PIPE,
+                    env=env
                 )
             else:
                 # Unix-like process creation
                 self.process = subprocess.Popen(
-                    self.command,
+                    command,
                     # shell=True,
                     stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE
+                    stderr=subprocess.PIPE,
+                    env=env
                 )
             
+            self._start_counter = time.perf_counter()
             self.start_time = datetime.now()
             print(f"Started process (PID: {self.process.pid}): {self.command}")
             return True
@@ -112,109 +712,204 @@ class ProcessMonitor:
             return
             
         try:
-            # Get psutil process object
-            ps_process = psutil.Process(self.process.pid)
-
-            # CRITICAL FIX: Initialize CPU percent baseline
-            # First call always returns 0.0, but establishes baseline
-            ps_process.cpu_percent()
+            # Track the started process and, unless disabled, all of its descendants.
+            # CRITICAL FIX: the tracker initializes CPU percent baselines of every process,
+            # first call always returns 0.0, but establishes baseline
+            self.process_tree = ProcessTreeTracker(self.process.pid, include_children=self.track_children)
+            self.process_tree.root.cpu_percent()
+            if 'system' in self.metric_groups:
+                psutil.cpu_percent()
             
             # Small delay to ensure baseline is set
             time.sleep(0.1)
+
+            self.clock.start()
             
             while not self.stop_event.is_set() and self.process.poll() is None:
                 try:
-                    # Get current timestamp
-                    timestamp = time.time()
-                    
-                    # CPU usage (percent)
-                    cpu_percent = ps_process.cpu_percent()
-                    
-                    # CPU times (user and system time in seconds)
-                    cpu_times = ps_process.cpu_times()
-                    
-                    # Memory usage
-                    memory_info = ps_process.memory_info()
-                    memory_percent = ps_process.memory_percent()
-                    
-                    # I/O counters
-                    io_counters = ps_process.io_counters()
-                    
-                    # Network I/O counters (system-wide, filtered by connections)
-                    network_io = self.get_network_io_for_process(ps_process)
-                    
-                    # Number of threads
-                    num_threads = ps_process.num_threads()
-                    
-                    # File descriptors (Unix) or Handles (Windows)
-                    fd_handle_count = self.get_fd_handle_count(ps_process)
-                    
-                    # Network connections
-                    num_connections = self.get_connection_count(ps_process)
-                    
-                    # Context switches (if available)
-                    context_switches = self.get_context_switches(ps_process)
-                    
-                    # System-wide CPU and memory
-                    system_cpu = psutil.cpu_percent()
-                    system_memory = psutil.virtual_memory()
-                    
-                    # Normalize CPU percentage to 0-100% range
-                    cpu_count = psutil.cpu_count()
-                    normalized_cpu_percent = min(100.0, cpu_percent / cpu_count) if cpu_count > 0 else cpu_percent
-                    
-                    # Record metrics
-                    metric = {
-                        'timestamp': timestamp,
-                        'elapsed_time': timestamp - time.mktime(self.start_time.timetuple()),
-                        'process': {
-                            'cpu_percent': normalized_cpu_percent,
-                            'cpu_percent_raw': cpu_percent,  # Keep original value for reference
-                            'cpu_times_user': cpu_times.user,
-                            'cpu_times_system': cpu_times.system,
-                            'cpu_times_total': cpu_times.user + cpu_times.system,
-                            'memory_rss': memory_info.rss,  # Resident Set Size
-                            'memory_vms': memory_info.vms,  # Virtual Memory Size
-                            'memory_percent': memory_percent,
-                            'num_threads': num_threads,
-                            'fd_handle_count': fd_handle_count,
-                            'fd_handle_type': 'handles' if self.is_windows else 'file_descriptors',
-                            'io_read_count': io_counters.read_count,
-                            'io_write_count': io_counters.write_count,
-                            'io_read_bytes': io_counters.read_bytes,
-                            'io_write_bytes': io_counters.write_bytes,
-                            'network_bytes_sent': network_io['bytes_sent'],
-                            'network_bytes_recv': network_io['bytes_recv'],
-                            'network_packets_sent': network_io['packets_sent'],
-                            'network_packets_recv': network_io['packets_recv'],
-                            'network_connections': num_connections,
-                            'context_switches': context_switches,
-                        },
-                        'system': {
-                            'cpu_percent': system_cpu,
-                            'memory_total': system_memory.total,
-                            'memory_available': system_memory.available,
-                            'memory_used': system_memory.used,
-                            'memory_percent': system_memory.percent,
-                        }
-                    }
-                    
-                    self.metrics.append(metric)
-                    
+                    sample = self.sample_process()
+                    self.samples.append_record(sample)
+                    if self._stream:
+                        self._stream.write_record(sample)
                 except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
                     # Process might have ended or access denied
                     break
                 
-                time.sleep(self.interval)
+                if not self.clock.wait_next(self.stop_event):
+                    break
                 
         except Exception as e:
             print(f"Error during monitoring: {e}")
+
+    def read_process(self, ps_process):
+        """Read raw values of the enabled metric groups for a single process, batched under oneshot()"""
+        groups = self.metric_groups
+        values = {
+            'ppid': None,
+            'cpu_percent': 0,
+            'cpu_user': 0,
+            'cpu_system': 0,
+            'cpu_children_user': 0,
+            'cpu_children_system': 0,
+            'memory_rss': 0,
+            'memory_vms': 0,
+            'num_threads': 0,
+            'fd_handle_count': None,
+            'io_read_count': 0,
+            'io_write_count': 0,
+            'io_read_bytes': 0,
+            'io_write_bytes': 0,
+            'ctx_voluntary': 0,
+            'ctx_involuntary': 0,
+            'network_connections': 0,
+        }
+
+        with ps_process.oneshot():
+            values['ppid'] = ps_process.ppid()
+
+            if 'cpu' in groups:
+                cpu_times = ps_process.cpu_times()
+                values['cpu_percent'] = ps_process.cpu_percent()
+                values['cpu_user'] = cpu_times.user
+                values['cpu_system'] = cpu_times.system
+                values['cpu_children_user'] = getattr(cpu_times, 'children_user', 0)
+                values['cpu_children_system'] = getattr(cpu_times, 'children_system', 0)
+                values['num_threads'] = ps_process.num_threads()
+
+                context_switches = self.get_context_switches(ps_process)
+                values['ctx_voluntary'] = context_switches['voluntary']
+                values['ctx_involuntary'] = context_switches['involuntary']
+
+            if 'memory' in groups:
+                memory_info = ps_process.memory_info()
+                values['memory_rss'] = memory_info.rss  # Resident Set Size
+                values['memory_vms'] = memory_info.vms  # Virtual Memory Size
+
+            if 'io' in groups:
+                io_counters = ps_process.io_counters()
+                values['io_read_count'] = io_counters.read_count
+                values['io_write_count'] = io_counters.write_count
+                values['io_read_bytes'] = io_counters.read_bytes
+                values['io_write_bytes'] = io_counters.write_bytes
+
+            if 'fds' in groups:
+                # File descriptors (Unix) or Handles (Windows)
+                values['fd_handle_count'] = self.get_fd_handle_count(ps_process)
+
+        if 'connections' in groups:
+            values['network_connections'] = self.get_connection_count(ps_process)
+
+        return values
+
+    def sample_process(self):
+        """Collect one sample of the enabled metric groups, aggregated over the tracked process tree"""
+        sample_start = time.perf_counter()
+        elapsed_time = sample_start - self._start_counter
+        groups = self.metric_groups
+
+        tree = self.process_tree.sample(self.read_process)
+
+        sample = {
+            # Wall clock time derived from the monotonic clock, so both series agree
+            'timestamp': self.start_time.timestamp() + elapsed_time,
+            'elapsed_time': elapsed_time,
+            # Normalize CPU percentage to 0-100% range
+            'process.cpu_percent': min(100.0, tree['cpu_percent'] / self._cpu_count),
+            'process.cpu_percent_raw': tree['cpu_percent'],  # Keep original value for reference
+            'process.cpu_times_user': tree['cpu_user'],
+            'process.cpu_times_system': tree['cpu_system'],
+            'process.cpu_times_total': tree['cpu_user'] + tree['cpu_system'],
+            'process.memory_rss': tree['memory_rss'],
+            'process.memory_vms': tree['memory_vms'],
+            'process.memory_percent': tree['memory_rss'] / self._memory_total * 100 if self._memory_total else 0,
+            'process.num_threads': tree['num_threads'],
+            'process.num_processes': tree['num_processes'],
+            'process.fd_handle_count': tree['fd_handle_count'],
+            'process.io_read_count': tree['io_read_count'],
+            'process.io_write_count': tree['io_write_count'],
+            'process.io_read_bytes': tree['io_read_bytes'],
+            'process.io_write_bytes': tree['io_write_bytes'],
+            'process.network_connections': tree['network_connections'],
+            'process.context_switches_voluntary': tree['ctx_voluntary'],
+            'process.context_switches_involuntary': tree['ctx_involuntary'],
+            'system.memory_total': self._memory_total,
+        }
+
+        if 'network' in groups:
+            if self._socket_accounting:
+                network_io = self._socket_accounting.sample(self.process_tree.live_pids())
+            else:
+                network_io = self.get_network_io_for_process(self.process_tree.root)
+            sample['process.network_bytes_sent'] = network_io['bytes_sent']
+            sample['process.network_bytes_recv'] = network_io['bytes_recv']
+            sample['process.network_packets_sent'] = network_io['packets_sent']
+            sample['process.network_packets_recv'] = network_io['packets_recv']
+
+        if 'system' in groups:
+            system_memory = psutil.virtual_memory()
+            sample['system.cpu_percent'] = psutil.cpu_percent()
+            sample['system.memory_available'] = system_memory.available
+            sample['system.memory_used'] = system_memory.used
+            sample['system.memory_percent'] = system_memory.percent
+
+        sample['sampling_overhead'] = time.perf_counter() - sample_start
+        return sample
+
+    @property
+    def metrics(self):
+        """Samples rebuilt as the nested per-sample dicts, for JSON export"""
+        fd_handle_type = 'handles' if self.is_windows else 'file_descriptors'
+        samples = self.load_samples()
+        metrics = []
+
+        for row in samples.rows():
+            sample = {'timestamp': None, 'elapsed_time': None, 'process': {'fd_handle_type': fd_handle_type}, 'system': {}, 'sampling_overhead': None}
+
+            for name, value in zip(samples.column_names, row):
+                section, _, key = name.rpartition('.')
+                if section:
+                    sample[section][key] = value
+                else:
+                    sample[key] = value
+
+            process = sample['process']
+            process['context_switches'] = {
+                'voluntary': process.pop('context_switches_voluntary'),
+                'involuntary': process.pop('context_switches_involuntary')
+            }
+            if process['fd_handle_count'] is not None:
+                process['fd_handle_count'] = int(process['fd_handle_count'])
+
+            metrics.append(sample)
+
+        return metrics
+
+    def metrics_table(self):
+        """Samples as a column table for the columnar results format, straight from the sample store"""
+        samples = self.load_samples()
+        columns = []
+
+        for name in samples.column_names:
+            section, _, key = name.rpartition('.')
+            # Same layout as the sample dicts of metrics
+            if key.startswith('context_switches_'):
+                path = (section, 'context_switches', key[len('context_switches_'):])
+            else:
+                path = tuple(name.split('.'))
+
+            column_type = 'f64' if samples.typecodes[name] == 'd' else 'i64'
+            columns.append((path, column_type, samples.column(name), name == 'process.fd_handle_count'))
+
+        fd_handle_type = 'handles' if self.is_windows else 'file_descriptors'
+        paths = [path for path, _, _, _ in columns]
+        paths.insert(next((i for i, path in enumerate(paths) if path[0] == 'process'), len(paths)), ('process', 'fd_handle_type'))
+        return ColumnTable(len(samples), columns, constants=[(('process', 'fd_handle_type'), fd_handle_type)], paths=paths)
     
     def wait_for_process(self):
         if self.process:
             try:
                 self.process.wait(timeout=self.timeout)
-                self.end_time = datetime.now()
+                self.mark_process_end()
                 self.stop_event.set()
             except KeyboardInterrupt:
                 print("Keyboard interrupt: terminating process...")
@@ -231,16 +926,29 @@ class ProcessMonitor:
                         self.process.wait(timeout=5)
                     except subprocess.TimeoutExpired:
                         self.process.kill()
-                self.end_time = datetime.now()
+                self.mark_process_end()
                 self.stop_event.set()
                 raise
             except subprocess.TimeoutExpired:
                 print("Timeout expired: terminating process...")
                 self.process.kill()
+                self.process.wait()
+                self.mark_process_end()
+                self.stop_event.set()
+
+    def mark_process_end(self):
+        # End time is derived from the monotonic clock, so duration is immune to wall clock adjustments
+        self._end_counter = time.perf_counter()
+        self.end_time = self.start_time + timedelta(seconds=self._end_counter - self._start_counter)
 
     def run(self):
         if not self.start_target_process():
             return False
+
+        self.open_stream()
+
+        # Pipes are drained while the process runs, otherwise a chatty benchmark blocks on a full pipe buffer
+        self.start_output_drains()
         
         monitor_thread = Thread(target=self.monitor_process)
         monitor_thread.start()
@@ -250,16 +958,176 @@ class ProcessMonitor:
         monitor_thread.join()
         
         print(f"Process completed (exit code: {self.process.returncode})")
-        
-        stdout, stderr = self.process.communicate()
+
+        for drain in (self._stdout_drain, self._stderr_drain):
+            if not drain.join(timeout=5):
+                print(f"Output still open after process exit, {drain.file_path} may be incomplete")
 
         self.result = {
-            'stdout': stdout,
-            'stderr': stderr,
-            'exit_code': self.process.returncode
+            'stdout': self._stdout_drain.tail(),
+            'stderr': self._stderr_drain.tail(),
+            'exit_code': self.process.returncode,
+            'stdout_file': self._stdout_drain.file_path,
+            'stderr_file': self._stderr_drain.file_path,
+            'stdout_bytes': self._stdout_drain.bytes_written,
+            'stderr_bytes': self._stderr_drain.bytes_written,
+            'stdout_truncated': self._stdout_drain.truncated,
+            'stderr_truncated': self._stderr_drain.truncated,
         }
 
+        self.load_events()
+        self.close_stream()
+
+        self.remove_markers_dir()
+
+        # Output of a failed command is always kept, it is the only complete copy
+        if self.cleanup_output and self.process.returncode == 0:
+            self.remove_output_files()
+
         return self.result
+
+    @staticmethod
+    def default_output_dir():
+        """The agent's temp dir when running under TestFarm, the system temp dir otherwise"""
+        try:
+            return get_magic_variable('$__TF_TEMP_DIR__')
+        except ValueError:
+            return tempfile.gettempdir()
+
+    def remove_output_files(self):
+        for key, drain in (('stdout_file', self._stdout_drain), ('stderr_file', self._stderr_drain)):
+            if drain is None:
+                continue
+            try:
+                os.remove(drain.file_path)
+            except OSError:
+                continue  # still held by a grandchild's pipe, or already gone
+            if self.result:
+                self.result[key] = None
+
+    def remove_markers_dir(self):
+        # Events are in memory once loaded; a process still holding its buffer open leaves the dir behind
+        if self.markers_dir:
+            shutil.rmtree(self.markers_dir, ignore_errors=True)
+
+    def start_output_drains(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        self._stdout_drain = OutputDrain(self.process.stdout, os.path.join(self.output_dir, f"benchmark_{self.process.pid}_stdout.log"), self.output_tail_lines)
+        self._stderr_drain = OutputDrain(self.process.stderr, os.path.join(self.output_dir, f"benchmark_{self.process.pid}_stderr.log"), self.output_tail_lines)
+        self._stdout_drain.start()
+        self._stderr_drain.start()
+
+    def open_stream(self):
+        if not self.stream_file:
+            return
+
+        self._stream = MetricsStreamWriter(self.stream_file, ProcessMonitor.SAMPLE_COLUMNS, metadata={
+            'command': self.command,
+            'pid': self.process.pid,
+            'host': socket.gethostname(),
+            'start_time': self.start_time.isoformat(),
+            'monitoring_interval': self.interval,
+            'metric_groups': sorted(self.metric_groups),
+            'track_children': self.track_children,
+            'network_scope': self.network_scope,
+            'markers_dir': self.markers_dir,
+        }, flush_interval=self.stream_flush_interval)
+
+    def close_stream(self):
+        if not self._stream:
+            return
+
+        self._stream.close({
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'exit_code': self.result['exit_code'] if self.result else None,
+            'missed_ticks': self.clock.missed_ticks,
+        })
+        self._stream = None
+
+    @classmethod
+    def from_stream(cls, stream_file):
+        """Rebuild a monitor from a stream file, e.g. to report on a run whose agent died"""
+        data = read_metrics_stream(stream_file)
+        metadata = data.metadata
+
+        monitor = cls(metadata.get('command'), interval=metadata.get('monitoring_interval', 1.0),
+                      metric_groups=metadata.get('metric_groups'), track_children=metadata.get('track_children', True))
+        monitor.stream_file = stream_file
+        monitor.network_scope = metadata.get('network_scope', 'system')
+        monitor.samples = data.samples
+        monitor.partial = not data.complete
+        monitor.start_time = datetime.fromisoformat(metadata['start_time'])
+
+        if data.complete and data.trailer.get('end_time'):
+            monitor.end_time = datetime.fromisoformat(data.trailer['end_time'])
+        else:
+            elapsed = data.samples.column('elapsed_time')
+            monitor.end_time = monitor.start_time + timedelta(seconds=series_max(elapsed))
+
+        monitor.result = {
+            'stdout': None,
+            'stderr': None,
+            'exit_code': data.trailer.get('exit_code') if data.complete else None
+        }
+
+        monitor.markers_dir = metadata.get('markers_dir')
+        monitor.load_events()
+
+        return monitor
+
+    def load_events(self):
+        """Read the marker events of the monitored processes, with times relative to the process start"""
+        if not self.markers_dir:
+            return
+
+        markers = read_markers(self.markers_dir)
+        start = self.start_time.timestamp()
+
+        self.events = [dict(event, elapsed_time=event['timestamp'] - start) for event in markers['events']]
+        self.events_dropped = markers['dropped']
+
+    def phase_statistics(self, samples, duration):
+        """Resource usage of every span recorded by the benchmark, interpolated between samples"""
+        elapsed = samples.column('elapsed_time')
+        cpu_total = samples.column('process.cpu_times_total')
+        io_read = samples.column('process.io_read_bytes')
+        io_write = samples.column('process.io_write_bytes')
+        memory_rss = samples.column('process.memory_rss')
+        start = self.start_time.timestamp()
+
+        phases = []
+        for phase in pair_spans(self.events):
+            begin = phase['start'] - start
+            end = phase['end'] - start if phase['end'] is not None else duration
+            phase_duration = end - begin
+
+            first, last = bisect_left(elapsed, begin), bisect_right(elapsed, end)
+            cpu_seconds = _interpolate(elapsed, cpu_total, end) - _interpolate(elapsed, cpu_total, begin)
+
+            phases.append({
+                'name': phase['name'],
+                'pid': phase['pid'],
+                'start_elapsed': begin,
+                'end_elapsed': end,
+                'finished': phase['end'] is not None,
+                'duration_seconds': phase_duration,
+                # Deltas of cumulative counters are exact at sample times and linear in between
+                'samples': last - first,
+                'cpu_seconds': cpu_seconds,
+                'cpu_percent': cpu_seconds / phase_duration / self._cpu_count * 100 if phase_duration > 0 else 0,
+                'io_read_bytes': _interpolate(elapsed, io_read, end) - _interpolate(elapsed, io_read, begin),
+                'io_write_bytes': _interpolate(elapsed, io_write, end) - _interpolate(elapsed, io_write, begin),
+                'peak_rss_bytes': series_max(memory_rss[first:last]) if last > first else _interpolate(elapsed, memory_rss, begin),
+            })
+
+        return phases
+
+    def load_samples(self):
+        """All samples at full resolution: re-read from the stream file if the in-memory ring dropped some"""
+        if self.stream_file and self._stream is None and self.samples.total_appended > len(self.samples):
+            return read_metrics_stream(self.stream_file).samples
+        return self.samples
     
     def kill(self):
         if self.process and self.process.poll() is None:
@@ -267,23 +1135,46 @@ class ProcessMonitor:
             self.stop_event.set()
 
     def generate_report(self):
-        if not self.metrics:
+        samples = self.load_samples()
+        if len(samples) == 0:
             print("No metrics collected!")
             return
         
-        duration = (self.end_time - self.start_time).total_seconds()
-
-        # Extract metric series for analysis
-        cpu_values = [m['process']['cpu_percent'] for m in self.metrics if m['process']['cpu_percent']]
-        cpu_times_user = [m['process']['cpu_times_user'] for m in self.metrics]
-        cpu_times_system = [m['process']['cpu_times_system'] for m in self.metrics]
-        cpu_times_total = [m['process']['cpu_times_total'] for m in self.metrics]
-        memory_rss = [m['process']['memory_rss'] for m in self.metrics]
-        memory_percent = [m['process']['memory_percent'] for m in self.metrics]
-        io_read_bytes = [m['process']['io_read_bytes'] for m in self.metrics]
-        io_write_bytes = [m['process']['io_write_bytes'] for m in self.metrics]
-        network_bytes_sent = [m['process']['network_bytes_sent'] for m in self.metrics]
-        network_bytes_recv = [m['process']['network_bytes_recv'] for m in self.metrics]
+        if self._start_counter is not None and self._end_counter is not None:
+            duration = self._end_counter - self._start_counter
+        else:
+            duration = (self.end_time - self.start_time).total_seconds()
+
+        # Extract metric series for analysis (NumPy arrays when available, typed arrays otherwise)
+        column = samples.column
+        cpu_values = series_nonzero(column('process.cpu_percent'))
+        cpu_times_user = column('process.cpu_times_user')
+        cpu_times_system = column('process.cpu_times_system')
+        cpu_times_total = column('process.cpu_times_total')
+        memory_rss = column('process.memory_rss')
+        memory_percent = column('process.memory_percent')
+        io_read_bytes = column('process.io_read_bytes')
+        io_write_bytes = column('process.io_write_bytes')
+        network_bytes_sent = column('process.network_bytes_sent')
+        network_bytes_recv = column('process.network_bytes_recv')
+        network_connections = column('process.network_connections')
+        # Per-process counters start at zero with the process; system-wide ones only count traffic since the first sample
+        network_sent_total = series_max(network_bytes_sent) - (series_min(network_bytes_sent) if self.network_scope == 'system' else 0)
+        network_recv_total = series_max(network_bytes_recv) - (series_min(network_bytes_recv) if self.network_scope == 'system' else 0)
+        num_threads = column('process.num_threads')
+        fd_handles = series_finite(column('process.fd_handle_count'))
+        context_switches = series_sum(column('process.context_switches_voluntary')) + series_sum(column('process.context_switches_involuntary'))
+        sampling_overhead = column('sampling_overhead')
+        timestamps = column('timestamp')
+        sample_intervals = series_diff(column('elapsed_time'))
+
+        # Distributions of the main gauges, each computed in a single pass over its column
+        cpu_stats = distribution_stats(cpu_values)
+        memory_rss_stats = distribution_stats(memory_rss)
+        memory_percent_stats = distribution_stats(memory_percent)
+        threads_stats = distribution_stats(num_threads)
+        overhead_stats = distribution_stats(sampling_overhead)
+        interval_stats = distribution_stats(sample_intervals)
         
         # Calculate statistics
         report = {
@@ -291,12 +1182,23 @@ class ProcessMonitor:
                 'command': self.command,
                 'start_time': self.start_time.isoformat(),
                 'end_time': self.end_time.isoformat(),
+                # stdout/stderr hold only the output tails; the complete output is in the referenced files
                 'stdout': self.result['stdout'],
                 'stderr': self.result['stderr'],
+                'stdout_file': self.result.get('stdout_file'),
+                'stderr_file': self.result.get('stderr_file'),
+                'stdout_bytes': self.result.get('stdout_bytes'),
+                'stderr_bytes': self.result.get('stderr_bytes'),
+                'stdout_truncated': self.result.get('stdout_truncated', False),
+                'stderr_truncated': self.result.get('stderr_truncated', False),
                 'exit_code': self.result['exit_code'],
                 'duration_seconds': duration,
-                'samples_collected': len(self.metrics),
+                'samples_collected': samples.total_appended,
+                'samples_retained': len(samples),
+                'stream_file': self.stream_file,
+                'partial': self.partial,
                 'monitoring_interval': self.interval,
+                'metric_groups': sorted(self.metric_groups),
                 'operating_system': {
                     'system': platform.system(),
                     'release': platform.release(),
@@ -307,64 +1209,104 @@ class ProcessMonitor:
                     'cpu_count_physical': psutil.cpu_count(logical=False)
                 },
             },
+            'sampling': {
+                'avg_overhead_seconds': overhead_stats['mean'],
+                'max_overhead_seconds': overhead_stats['max'],
+                'overhead_percent_of_interval': overhead_stats['mean'] / self.interval * 100 if self.interval > 0 else 0,
+                'overhead_distribution': overhead_stats,
+                'first_sample_time': datetime.fromtimestamp(series_min(timestamps)).isoformat(),
+                'last_sample_time': datetime.fromtimestamp(series_max(timestamps)).isoformat(),
+                'scheduled_ticks': self.clock.ticks,
+                'missed_ticks': self.clock.missed_ticks,
+                'max_lateness_seconds': self.clock.max_lateness,
+                'interval_distribution': interval_stats,
+            },
             'cpu': {
-                'max_percent': max(cpu_values) if cpu_values else 0,
-                'avg_percent': statistics.mean(cpu_values) if cpu_values else 0,
-                'min_percent': min(cpu_values) if cpu_values else 0,
-                'total_user_time': max(cpu_times_user) if cpu_times_user else 0,
-                'total_system_time': max(cpu_times_system) if cpu_times_system else 0,
-                'total_cpu_time': max(cpu_times_total) if cpu_times_total else 0,
-                'cpu_efficiency': (max(cpu_times_total) / duration * 100) if duration > 0 and cpu_times_total else 0,
+                'max_percent': cpu_stats['max'],
+                'avg_percent': cpu_stats['mean'],
+                'min_percent': cpu_stats['min'],
+                'percent_distribution': cpu_stats,
+                'total_user_time': series_max(cpu_times_user),
+                'total_system_time': series_max(cpu_times_system),
+                'total_cpu_time': series_max(cpu_times_total),
+                'cpu_efficiency': series_max(cpu_times_total) / duration * 100 if duration > 0 else 0,
             },
             'memory': {
-                'max_rss_bytes': max(memory_rss),
-                'max_rss_mb': max(memory_rss) / (1024 * 1024),
-                'avg_rss_bytes': statistics.mean(memory_rss),
-                'avg_rss_mb': statistics.mean(memory_rss) / (1024 * 1024),
-                'max_percent': max(memory_percent),
-                'avg_percent': statistics.mean(memory_percent),
+                'max_rss_bytes': series_max(memory_rss),
+                'max_rss_mb': memory_rss_stats['max'] / (1024 * 1024),
+                'avg_rss_bytes': memory_rss_stats['mean'],
+                'avg_rss_mb': memory_rss_stats['mean'] / (1024 * 1024),
+                'max_percent': memory_percent_stats['max'],
+                'avg_percent': memory_percent_stats['mean'],
+                'rss_distribution': memory_rss_stats,
+                'percent_distribution': memory_percent_stats,
             },
             'io': {
-                'total_read_bytes': max(io_read_bytes) - min(io_read_bytes) if io_read_bytes else 0,
-                'total_write_bytes': max(io_write_bytes) - min(io_write_bytes) if io_write_bytes else 0,
-                'total_read_mb': (max(io_read_bytes) - min(io_read_bytes)) / (1024 * 1024) if io_read_bytes else 0,
-                'total_write_mb': (max(io_write_bytes) - min(io_write_bytes)) / (1024 * 1024) if io_write_bytes else 0,
+                'total_read_bytes': series_max(io_read_bytes) - series_min(io_read_bytes),
+                'total_write_bytes': series_max(io_write_bytes) - series_min(io_write_bytes),
+                'total_read_mb': (series_max(io_read_bytes) - series_min(io_read_bytes)) / (1024 * 1024),
+                'total_write_mb': (series_max(io_write_bytes) - series_min(io_write_bytes)) / (1024 * 1024),
             },
             'network': {
-                'total_bytes_sent': max(network_bytes_sent) - min(network_bytes_sent) if network_bytes_sent else 0,
-                'total_bytes_recv': max(network_bytes_recv) - min(network_bytes_recv) if network_bytes_recv else 0,
-                'total_sent_mb': (max(network_bytes_sent) - min(network_bytes_sent)) / (1024 * 1024) if network_bytes_sent else 0,
-                'total_recv_mb': (max(network_bytes_recv) - min(network_bytes_recv)) / (1024 * 1024) if network_bytes_recv else 0,
-                'max_connections': max([m['process']['network_connections'] for m in self.metrics]) if self.metrics else 0,
-                'avg_connections': statistics.mean([m['process']['network_connections'] for m in self.metrics]) if self.metrics else 0,
+                'scope': self.network_scope,
+                'tcp_sockets_seen': self._socket_accounting.sockets_seen if self._socket_accounting else None,
+                'total_bytes_sent': network_sent_total,
+                'total_bytes_recv': network_recv_total,
+                'total_sent_mb': network_sent_total / (1024 * 1024),
+                'total_recv_mb': network_recv_total / (1024 * 1024),
+                'max_connections': series_max(network_connections),
+                'avg_connections': series_mean(network_connections),
             },
             'process_info': {
-                'max_threads': max([m['process']['num_threads'] for m in self.metrics]),
-                'avg_threads': statistics.mean([m['process']['num_threads'] for m in self.metrics]),
-                'max_fd_handles': max([m['process']['fd_handle_count'] for m in self.metrics if m['process']['fd_handle_count'] is not None]) if any(m['process']['fd_handle_count'] is not None for m in self.metrics) else 0,
-                'avg_fd_handles': statistics.mean([m['process']['fd_handle_count'] for m in self.metrics if m['process']['fd_handle_count'] is not None]) if any(m['process']['fd_handle_count'] is not None for m in self.metrics) else 0,
+                'max_threads': series_max(num_threads),
+                'avg_threads': threads_stats['mean'],
+                'threads_distribution': threads_stats,
+                'max_fd_handles': int(series_max(fd_handles)),
+                'avg_fd_handles': series_mean(fd_handles),
                 'fd_handle_type': 'handles' if self.is_windows else 'file_descriptors',
-                'max_connections': max([m['process']['network_connections'] for m in self.metrics]) if self.metrics else 0,
-                'avg_connections': statistics.mean([m['process']['network_connections'] for m in self.metrics]) if self.metrics else 0,
-                'total_context_switches': sum([m['process']['context_switches']['voluntary'] + m['process']['context_switches']['involuntary'] for m in self.metrics]) if self.metrics else 0,
+                'max_connections': series_max(network_connections),
+                'avg_connections': series_mean(network_connections),
+                'total_context_switches': context_switches,
+                'samples_memory_bytes': samples.memory_usage_bytes(),
+            },
+            'process_tree': {
+                'children_tracked': self.track_children,
+                'max_concurrent_processes': self.process_tree.max_concurrent_processes if self.process_tree else 1,
+                'processes': self.process_tree.process_summaries() if self.process_tree else [],
             }
         }
+
+        if self.markers_dir:
+            report['events'] = {
+                'count': len(self.events),
+                'dropped': self.events_dropped,
+                'marks': [{'name': event['name'], 'pid': event['pid'], 'elapsed_time': event['elapsed_time']}
+                          for event in self.events if event['kind'] == 'mark'],
+                'phases': self.phase_statistics(samples, duration),
+            }
+
+        if self.hardware_counters:
+            report['hardware_counters'] = self._perf.parse() if self._perf else {
+                'available': False,
+                'reason': self._perf_unavailable_reason
+            }
         
         return report
     
-    def save_detailed_data(self, filename):
+    def save_detailed_data(self, filename, format_version=RESULTS_FORMAT_JSON):
+        """Save the report, all samples and events; RESULTS_FORMAT_COLUMNAR writes samples as typed arrays"""
         data = {
             'summary': self.generate_report(),
-            'metrics': self.metrics
+            'metrics': self.metrics if format_version == RESULTS_FORMAT_JSON else self.metrics_table(),
+            'events': self.events
         }
-        
-        with open(filename, 'w') as f:
-            json.dump(data, f, indent=2, default=str)
+
+        save_results(filename, data, format_version)
         
         print(f"Detailed data saved to: {filename}")
     
     def get_network_io_for_process(self, ps_process):
-        """Get network I/O statistics for the process"""
+        """Get network I/O statistics, system-wide (used where per-process accounting is unavailable)"""
         try:
             # Get current system-wide network I/O
             current_net_io = psutil.net_io_counters()
@@ -445,4 +1387,17 @@ class ProcessMonitor:
             return {
                 'voluntary': 0,
                 'involuntary': 0
-            }
\ No newline at end of file
+            }
+
+
+def _interpolate(xs, ys, x):
+    # Linear interpolation in a sorted series, clamped to its first and last value
+    index = bisect_left(xs, x)
+    if index == 0:
+        return ys[0]
+    if index == len(xs):
+        return ys[-1]
+
+    x0, x1 = xs[index - 1], xs[index]
+    y0, y1 = ys[index - 1], ys[index]
+    return y0 + (y1 - y0) * (x - x0) / (x1 - x0) if x1 > x0 else y1
@@ -0,0 +1,392 @@
+import sys
+import json
+import math
+import struct
+from array import array
+
+from testfarm_metrics_utils import downsample_indices
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+__all__ = [
+    "RESULTS_FORMAT_JSON",
+    "RESULTS_FORMAT_COLUMNAR",
+    "ColumnTable",
+    "encode_columnar_results",
+    "decode_columnar_results",
+    "write_columnar_results",
+    "read_columnar_results",
+    "is_columnar_results",
+    "results_format",
+    "load_results",
+    "save_results",
+    "downsample_results"
+]
+
+# Version of a results document: the JSON files benchmarks always wrote, or the binary columnar format below
+RESULTS_FORMAT_JSON = 1
+RESULTS_FORMAT_COLUMNAR = 2
+
+# Lists of samples stored under these keys, anywhere in a results document, become column tables
+TABLE_KEYS = ("metrics_detailed", "metrics")
+
+# File layout: preamble (magic, version, header length), JSON header, then the columns' raw little-endian
+# arrays. The header and every column start at a multiple of 8 bytes, so readers can map them in place.
+_MAGIC = b"TFCR"
+_PREAMBLE = struct.Struct("<4sHxxI")
+_PREAMBLE_SIZE = 16
+_ALIGNMENT = 8
+
+# Column types with their array typecode and NumPy dtype
+_TYPES = {
+    'f64': ('d', '<f8'),
+    'i64': ('q', '<i8'),
+    'bool': ('B', 'u1')
+}
+
+
+class ColumnTable:
+    """Samples of a results file as one typed array per leaf of the sample dicts.
+
+    Leaves are addressed by their path in the sample, e.g. ("process", "cpu_percent"), or by the dotted name
+    "process.cpu_percent". Leaves with the same value in every sample (e.g. "fd_handle_type") are stored once.
+    """
+
+    def __init__(self, rows, columns, constants=None, strings=None, paths=None):
+        self.rows = rows
+        self.columns = columns  # [(path, type, array, integer)]; integer marks f64 columns of ints with nulls
+        self.constants = constants or []  # [(path, value)]
+        self.strings = strings or []  # [(path, values)] of leaves that are neither numbers nor constant
+        # Leaf paths in the order they first appeared in the samples, so rebuilt samples serialize like the originals
+        self.paths = paths or [path for path, _, _, _ in self.columns] + [path for path, _ in self.strings] + [path for path, _ in self.constants]
+
+        self._index = {".".join(path): i for i, (path, _, _, _) in enumerate(self.columns)}
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def column_names(self):
+        return list(self._index)
+
+    def column(self, name):
+        """One column as a NumPy array when available, as a typed array otherwise; nulls are NaN."""
+        return self.columns[self._index[name]][2]
+
+    def take(self, indices):
+        """New table of the given rows, in the given order."""
+        indices = list(indices)
+        columns = []
+        for path, column_type, values, integer in self.columns:
+            if np is not None and isinstance(values, np.ndarray):
+                taken = values[np.asarray(indices, dtype=np.intp)]
+            else:
+                taken = array(values.typecode, (values[i] for i in indices))
+            columns.append((path, column_type, taken, integer))
+
+        strings = [(path, [values[i] for i in indices]) for path, values in self.strings]
+        return ColumnTable(len(indices), columns, list(self.constants), strings, list(self.paths))
+
+    @classmethod
+    def from_records(cls, records):
+        paths = []
+        values = {}
+        for row, record in enumerate(records):
+            for path, value in _leaves(record):
+                column = values.get(path)
+                if column is None:
+                    paths.append(path)
+                    column = values[path] = [None] * row  # absent in earlier samples
+                column.append(value)
+
+            for path in paths:
+                if len(values[path]) == row:
+                    values[path].append(None)
+
+        columns, constants, strings = [], [], []
+        for path in paths:
+            column_values = values[path]
+            column_type = _column_type(column_values)
+
+            if column_type is None:
+                if all(value == column_values[0] for value in column_values):
+                    constants.append((path, column_values[0]))
+                else:
+                    strings.append((path, column_values))
+                continue
+
+            typecode = _TYPES[column_type[0]][0]
+            # NaN stands for null in every f64 column: samples without the leaf or with a None value
+            coerced = [math.nan if value is None else value for value in column_values] if column_type[0] == 'f64' else column_values
+            columns.append((path, column_type[0], _to_array(array(typecode, coerced)), column_type[1]))
+
+        return cls(len(records), columns, constants, strings, paths)
+
+    def records(self):
+        """The samples rebuilt as dicts, as they were before encoding; nulls come back as None."""
+        leaves = {path: ([_restore(value, column_type, integer) for value in column.tolist()], False)
+                  for path, column_type, column, integer in self.columns}
+        leaves.update((path, (values, False)) for path, values in self.strings)
+        leaves.update((path, (value, True)) for path, value in self.constants)
+        ordered = [(path,) + leaves[path] for path in self.paths]
+
+        records = []
+        for row in range(self.rows):
+            record = {}
+            for path, values, constant in ordered:
+                _set_leaf(record, path, values if constant else values[row])
+            records.append(record)
+
+        return records
+
+
+def encode_columnar_results(results: dict) -> bytes:
+    """Encode a results document, turning its sample lists into column tables."""
+    tables = []
+    document = _extract_tables(results, tables)
+
+    chunks = []
+    offset = 0
+    table_schemas = []
+    for table in tables:
+        columns = []
+        for path, column_type, values, integer in table.columns:
+            data = _little_endian_bytes(values, column_type)
+            columns.append({'path': list(path), 'type': column_type, 'offset': offset, 'length': len(data), 'integer': integer})
+            chunks.append(data)
+            padding = -len(data) % _ALIGNMENT
+            chunks.append(b"\0" * padding)
+            offset += len(data) + padding
+
+        table_schemas.append({
+            'rows': table.rows,
+            'columns': columns,
+            'constants': [{'path': list(path), 'value': value} for path, value in table.constants],
+            'strings': [{'path': list(path), 'values': values} for path, values in table.strings],
+            'paths': [list(path) for path in table.paths]
+        })
+
+    header = json.dumps({
+        'format_version': RESULTS_FORMAT_COLUMNAR,
+        'document': document,
+        'tables': table_schemas
+    }, separators=(',', ':'), default=str).encode('utf-8')
+    header += b" " * (-len(header) % _ALIGNMENT)
+
+    return b"".join([_PREAMBLE.pack(_MAGIC, RESULTS_FORMAT_COLUMNAR, len(header)), b"\0" * (_PREAMBLE_SIZE - _PREAMBLE.size), header] + chunks)
+
+
+def decode_columnar_results(data, as_records: bool = False) -> dict:
+    """Decode a columnar results document; tables are ColumnTables viewing data, or sample dicts with as_records."""
+    magic, version, header_length = _PREAMBLE.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError("Not a columnar results document.")
+    if version > RESULTS_FORMAT_COLUMNAR:
+        raise ValueError(f"Unsupported columnar results version {version}.")
+
+    header = json.loads(bytes(data[_PREAMBLE_SIZE:_PREAMBLE_SIZE + header_length]))
+    data_start = _PREAMBLE_SIZE + header_length
+
+    tables = []
+    for schema in header['tables']:
+        columns = []
+        for column in schema['columns']:
+            start = data_start + column['offset']
+            values = _from_little_endian_bytes(data, start, column['length'], column['type'])
+            columns.append((tuple(column['path']), column['type'], values, column.get('integer', False)))
+
+        table = ColumnTable(
+            schema['rows'],
+            columns,
+            [(tuple(constant['path']), constant['value']) for constant in schema.get('constants', [])],
+            [(tuple(leaf['path']), leaf['values']) for leaf in schema.get('strings', [])],
+            [tuple(path) for path in schema['paths']] if 'paths' in schema else None
+        )
+        tables.append(table.records() if as_records else table)
+
+    return _insert_tables(header['document'], tables)
+
+
+def write_columnar_results(path: str, results: dict):
+    with open(path, 'wb') as f:
+        f.write(encode_columnar_results(results))
+
+
+def read_columnar_results(path: str, as_records: bool = False) -> dict:
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Columns are views of the file contents, only converted when rebuilding sample dicts
+    return decode_columnar_results(data, as_records)
+
+
+def is_columnar_results(data) -> bool:
+    return bytes(data[:len(_MAGIC)]) == _MAGIC
+
+
+def results_format(path: str) -> int:
+    with open(path, 'rb') as f:
+        return RESULTS_FORMAT_COLUMNAR if is_columnar_results(f.read(len(_MAGIC))) else RESULTS_FORMAT_JSON
+
+
+def load_results(path: str, as_records: bool = False) -> dict:
+    """Read a results file in either format."""
+    if results_format(path) == RESULTS_FORMAT_COLUMNAR:
+        return read_columnar_results(path, as_records)
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(path: str, results: dict, format_version: int = RESULTS_FORMAT_JSON):
+    if format_version == RESULTS_FORMAT_COLUMNAR:
+        write_columnar_results(path, results)
+        return
+    if format_version != RESULTS_FORMAT_JSON:
+        raise ValueError(f"Unknown results format version {format_version}.")
+
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(_insert_records(results), f, indent=2, default=str)
+
+
+def downsample_results(results: dict, budget: int, method: str = "lttb", x: str = "elapsed_time") -> dict:
+    """Copy of a results document with every sample table longer than budget reduced to budget rows.
+
+    Rows are chosen by downsample_indices over the numeric columns, drawn over the x column, so peaks of every
+    metric survive. Sample lists stay lists and ColumnTables stay tables; the dict holding a reduced table gets
+    a "downsampling" entry with the method, the budget and the row counts before and after.
+    """
+    if isinstance(results, dict):
+        reduced = {}
+        downsampling = {}
+        for key, value in results.items():
+            if isinstance(value, ColumnTable) or (key in TABLE_KEYS and isinstance(value, list) and value and all(isinstance(item, dict) for item in value)):
+                table = value if isinstance(value, ColumnTable) else ColumnTable.from_records(value)
+                if len(table) > budget:
+                    table = _downsample_table(table, budget, method, x)
+                    downsampling[key] = {'method': method, 'budget': budget, 'rows': len(value), 'kept': len(table)}
+                    value = table if isinstance(value, ColumnTable) else table.records()
+                reduced[key] = value
+            else:
+                reduced[key] = downsample_results(value, budget, method, x)
+
+        if downsampling:
+            reduced['downsampling'] = downsampling
+        return reduced
+
+    if isinstance(results, list):
+        return [downsample_results(item, budget, method, x) for item in results]
+    return results
+
+
+def _downsample_table(table: ColumnTable, budget: int, method: str, x: str) -> ColumnTable:
+    names = table.column_names
+    x_values = table.column(x) if x in names else list(range(len(table)))
+    # Timestamps only repeat the x axis; every other numeric leaf is a series worth keeping the shape of
+    columns = {name: table.column(name) for name in names if name not in (x, 'timestamp')}
+    return table.take(downsample_indices(x_values, columns, budget, method))
+
+
+def _extract_tables(value, tables, key=None):
+    # Copy of the document with sample lists (or already decoded tables) replaced by {"$table": index}
+    if isinstance(value, ColumnTable) or (key in TABLE_KEYS and isinstance(value, list) and value and all(isinstance(item, dict) for item in value)):
+        tables.append(value if isinstance(value, ColumnTable) else ColumnTable.from_records(value))
+        return {'$table': len(tables) - 1}
+    if isinstance(value, dict):
+        return {item_key: _extract_tables(item, tables, item_key) for item_key, item in value.items()}
+    if isinstance(value, list):
+        return [_extract_tables(item, tables) for item in value]
+    return value
+
+
+def _insert_tables(value, tables):
+    if isinstance(value, dict):
+        if len(value) == 1 and '$table' in value:
+            return tables[value['$table']]
+        return {key: _insert_tables(item, tables) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_insert_tables(item, tables) for item in value]
+    return value
+
+
+def _insert_records(value):
+    # Tables of a document read from a columnar file, back as sample dicts for JSON
+    if isinstance(value, ColumnTable):
+        return value.records()
+    if isinstance(value, dict):
+        return {key: _insert_records(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_insert_records(item) for item in value]
+    return value
+
+
+def _leaves(record, prefix=()):
+    for key, value in record.items():
+        if isinstance(value, dict):
+            yield from _leaves(value, prefix + (key,))
+        else:
+            yield prefix + (key,), value
+
+
+def _set_leaf(record, path, value):
+    for key in path[:-1]:
+        record = record.setdefault(key, {})
+    record[path[-1]] = value
+
+
+def _column_type(values):
+    """(type, integer) of a leaf's values, or None if they do not fit a numeric column."""
+    present = [value for value in values if value is not None]
+    if not present:
+        return None
+
+    if all(isinstance(value, bool) for value in present):
+        return ('bool', False) if len(present) == len(values) else None
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) for value in present):
+        return None
+
+    if all(isinstance(value, int) for value in present):
+        if len(present) == len(values) and all(-2 ** 63 <= value < 2 ** 63 for value in present):
+            return ('i64', False)
+        return ('f64', True)  # NaN stands for null, integers are restored when reading
+
+    return ('f64', False)
+
+
+def _to_array(values: array):
+    if np is not None:
+        return np.frombuffer(values, dtype={'d': np.float64, 'q': np.int64, 'B': np.uint8}[values.typecode])
+    return values
+
+
+def _restore(value, column_type: str, integer: bool):
+    if column_type == 'f64':
+        if value != value:
+            return None  # NaN
+        return int(value) if integer else value
+    return bool(value) if column_type == 'bool' else value
+
+
+def _little_endian_bytes(values, column_type: str) -> bytes:
+    if np is not None and isinstance(values, np.ndarray):
+        return values.astype(_TYPES[column_type][1], copy=False).tobytes()
+
+    if sys.byteorder != 'little' and column_type != 'bool':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little_endian_bytes(data, start: int, length: int, column_type: str):
+    typecode, dtype = _TYPES[column_type]
+    if np is not None:
+        return np.frombuffer(data, dtype=dtype, count=length // np.dtype(dtype).itemsize, offset=start)
+
+    values = array(typecode)
+    values.frombytes(data[start:start + length])
+    if sys.byteorder != 'little' and column_type != 'bool':
+        values.byteswap()
+    return values
@@ -0,0 +1,217 @@
+import os
+import mmap
+import time
+import struct
+import itertools
+import threading
+from time import perf_counter_ns
+
+
+__all__ = [
+    "MARKERS_DIR_ENV_VAR",
+    "mark",
+    "span",
+    "MarkerWriter",
+    "read_markers",
+    "pair_spans"
+]
+
+# Directory the monitoring side gives to the benchmark process; markers are disabled without it
+MARKERS_DIR_ENV_VAR = "TF_BENCH_MARKERS_DIR"
+
+_MAGIC = b"TFMK"
+_VERSION = 1
+_DEFAULT_CAPACITY = 65536
+_NAMES_SIZE = 64 * 1024
+
+# magic, version, pid, capacity, names region size, names bytes used, perf_counter_ns and time_ns taken together
+_HEADER = struct.Struct("<4sHxxIIIIqq")
+_HEADER_SIZE = 64
+_NAMES_USED_OFFSET = 20
+_RECORD = struct.Struct("<QqII")  # sequence (from 1), perf_counter_ns, name id, kind
+
+KIND_MARK = 0
+KIND_BEGIN = 1
+KIND_END = 2
+_KIND_NAMES = {KIND_MARK: "mark", KIND_BEGIN: "begin", KIND_END: "end"}
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class MarkerWriter:
+    """Per-process ring buffer of named events in a memory-mapped file.
+
+    Recording an event is one struct pack into shared memory; the oldest events are overwritten once
+    capacity events were recorded. Event names are stored once in a names region of the same file.
+    """
+
+    def __init__(self, directory: str, capacity: int = _DEFAULT_CAPACITY):
+        self.pid = os.getpid()
+        # PIDs get reused (quickly on Windows), so the creation time keeps an earlier process's file intact
+        self.path = os.path.join(directory, f"markers_{self.pid}_{time.time_ns()}.bin")
+        self._ids = {}
+        self._names_used = 0
+        self._names_lock = threading.Lock()
+
+        ring_offset = _HEADER_SIZE + _NAMES_SIZE
+        size = ring_offset + capacity * _RECORD.size
+        with open(self.path, 'xb') as f:
+            f.truncate(size)
+
+        self._file = open(self.path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), size)
+        _HEADER.pack_into(self._map, 0, _MAGIC, _VERSION, self.pid, capacity, _NAMES_SIZE, 0, perf_counter_ns(), time.time_ns())
+
+        # (sequence, record offset) pairs precomputed as iterators; next() on them is atomic under the GIL
+        self._slots = zip(itertools.count(1), itertools.cycle(range(ring_offset, size, _RECORD.size)))
+        self._pack_into = _RECORD.pack_into
+
+    def write(self, name: str, kind: int = KIND_MARK):
+        name_id = self._ids.get(name)
+        if name_id is None:
+            name_id = self._register(name)
+
+        sequence, offset = next(self._slots)
+        self._pack_into(self._map, offset, sequence, perf_counter_ns(), name_id, kind)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _register(self, name: str) -> int:
+        with self._names_lock:
+            if name in self._ids:
+                return self._ids[name]
+
+            encoded = name.replace("\n", " ").encode('utf-8') + b"\n"
+            if self._names_used + len(encoded) > _NAMES_SIZE:
+                raise ValueError(f"Too many distinct marker names, no room for \"{name}\".")
+
+            start = _HEADER_SIZE + self._names_used
+            self._map[start:start + len(encoded)] = encoded
+            self._names_used += len(encoded)
+            # The name is in place before its length is published and before any record refers to it
+            struct.pack_into("<I", self._map, _NAMES_USED_OFFSET, self._names_used)
+
+            self._ids[name] = len(self._ids)
+            return self._ids[name]
+
+
+def mark(name: str):
+    """Record a named point in time, e.g. mark("load_done"); does nothing unless run under a monitor."""
+    writer = _writer if _writer is not None else _open_writer()
+    if writer:
+        writer.write(name, KIND_MARK)
+
+
+class span:
+    """Context manager recording the begin and end of a named phase: with span("warmup"): ..."""
+    __slots__ = ("name", "_writer")
+
+    def __init__(self, name: str):
+        self.name = name
+        self._writer = _writer if _writer is not None else _open_writer()
+
+    def __enter__(self):
+        if self._writer:
+            self._writer.write(self.name, KIND_BEGIN)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._writer:
+            self._writer.write(self.name, KIND_END)
+
+
+def read_markers(directory: str) -> dict:
+    """Events of all processes that wrote markers into directory, ordered by time.
+
+    Timestamps are wall clock seconds. Read after the processes finished: records written while
+    reading may be torn. "dropped" counts events overwritten because a ring buffer was full.
+    """
+    events = []
+    dropped = 0
+
+    if directory and os.path.isdir(directory):
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.startswith("markers_") and file_name.endswith(".bin"):
+                file_events, file_dropped = _read_marker_file(os.path.join(directory, file_name))
+                events.extend(file_events)
+                dropped += file_dropped
+
+    events.sort(key=lambda event: event['timestamp'])
+    return {'events': events, 'dropped': dropped}
+
+
+def pair_spans(events: list) -> list:
+    """Match begin and end events of the same name and process; unfinished spans have end None."""
+    open_spans = {}
+    spans = []
+
+    for event in events:
+        key = (event['pid'], event['name'])
+        if event['kind'] == "begin":
+            open_spans.setdefault(key, []).append(event)
+        elif event['kind'] == "end" and open_spans.get(key):
+            begin = open_spans[key].pop()
+            spans.append({'name': event['name'], 'pid': event['pid'], 'start': begin['timestamp'], 'end': event['timestamp']})
+
+    for begins in open_spans.values():
+        spans.extend({'name': begin['name'], 'pid': begin['pid'], 'start': begin['timestamp'], 'end': None} for begin in begins)
+
+    spans.sort(key=lambda item: item['start'])
+    return spans
+
+
+def _open_writer():
+    global _writer
+
+    directory = os.environ.get(MARKERS_DIR_ENV_VAR)
+    if not directory:
+        _writer = False
+        return _writer
+
+    with _writer_lock:
+        if not _writer:
+            _writer = MarkerWriter(directory)
+    return _writer
+
+
+def _reset_writer_after_fork():
+    # A forked child must not share its parent's ring buffer
+    global _writer
+    _writer = None
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_writer_after_fork)
+
+
+def _read_marker_file(path: str) -> tuple:
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    if len(data) < _HEADER_SIZE:
+        return [], 0
+
+    magic, version, pid, capacity, names_size, names_used, perf_ns, wall_ns = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION:
+        return [], 0
+
+    names = data[_HEADER_SIZE:_HEADER_SIZE + names_used].decode('utf-8', errors='replace').split("\n")[:-1]
+    ring = data[_HEADER_SIZE + names_size:_HEADER_SIZE + names_size + capacity * _RECORD.size]
+
+    records = [record for record in _RECORD.iter_unpack(ring) if record[0] > 0]
+
+    events = []
+    for sequence, counter_ns, name_id, kind in records:
+        if name_id < len(names) and kind in _KIND_NAMES:
+            events.append({
+                'name': names[name_id],
+                'kind': _KIND_NAMES[kind],
+                'timestamp': (wall_ns + counter_ns - perf_ns) / 1e9,
+                'pid': pid
+            })
+
+    highest = max((record[0] for record in records), default=0)
+    return events, highest - len(records)
@@ -0,0 +1,500 @@
+import json
+import math
+import time
+from array import array
+from bisect import bisect_left
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+__all__ = [
+    "MetricsStore",
+    "series_max",
+    "series_min",
+    "series_mean",
+    "series_sum",
+    "series_nonzero",
+    "series_finite",
+    "series_diff",
+    "DEFAULT_PERCENTILES",
+    "distribution_stats",
+    "DOWNSAMPLING_METHODS",
+    "lttb_indices",
+    "minmax_indices",
+    "downsample_indices",
+    "MetricsStreamWriter",
+    "MetricsStreamData",
+    "read_metrics_stream"
+]
+
+DEFAULT_PERCENTILES = (50, 90, 95, 99)
+
+
+class MetricsStore:
+    """Columnar sample store: one typed array per metric, optionally a fixed-capacity ring buffer"""
+
+    # 'd' columns hold floats (None is stored as NaN), 'q' columns hold 64-bit integers (None is stored as 0)
+    SUPPORTED_TYPECODES = ('d', 'q')
+
+    def __init__(self, columns, capacity=None):
+        for name, typecode in columns:
+            if typecode not in MetricsStore.SUPPORTED_TYPECODES:
+                raise ValueError(f"Unsupported typecode {typecode} for column {name}.")
+
+        if capacity is not None and capacity <= 0:
+            raise ValueError("Metrics store capacity must be positive.")
+
+        self.column_names = [name for name, _ in columns]
+        self.typecodes = dict(columns)
+        self._column_typecodes = [typecode for _, typecode in columns]
+        self.capacity = capacity
+
+        self._index = {name: i for i, name in enumerate(self.column_names)}
+        self._appended = 0
+
+        if capacity is None:
+            self._arrays = [array(typecode) for _, typecode in columns]
+        else:
+            # Ring mode: storage is preallocated and the oldest samples get overwritten
+            self._arrays = [array(typecode, bytes(array(typecode).itemsize * capacity)) for _, typecode in columns]
+
+    def __len__(self):
+        return self._appended if self.capacity is None else min(self._appended, self.capacity)
+
+    @property
+    def total_appended(self):
+        """Number of samples ever appended, including ones overwritten in ring mode"""
+        return self._appended
+
+    def append(self, values):
+        """Append one sample given as a sequence of values in column order"""
+        if self.capacity is None:
+            for column, typecode, value in zip(self._arrays, self._column_typecodes, values):
+                column.append(self._coerce(typecode, value))
+        else:
+            position = self._appended % self.capacity
+            for column, typecode, value in zip(self._arrays, self._column_typecodes, values):
+                column[position] = self._coerce(typecode, value)
+
+        self._appended += 1
+
+    def append_record(self, record):
+        """Append one sample given as a dict keyed by column name; missing columns are stored as None"""
+        self.append([record.get(name) for name in self.column_names])
+
+    def column(self, name):
+        """Samples of one column in chronological order, as a NumPy array when available"""
+        values = self._ordered(self._arrays[self._index[name]])
+        if np is not None:
+            return np.frombuffer(values, dtype=np.float64 if self.typecodes[name] == 'd' else np.int64)
+        return values
+
+    def rows(self):
+        """Iterate over samples in chronological order as tuples of Python values"""
+        ordered = [self._ordered(column) for column in self._arrays]
+        for i in range(len(self)):
+            yield tuple(self._uncoerce(typecode, column[i]) for typecode, column in zip(self._column_typecodes, ordered))
+
+    def to_dict_of_lists(self):
+        result = {}
+        for name, column in zip(self.column_names, self._arrays):
+            typecode = self.typecodes[name]
+            result[name] = [self._uncoerce(typecode, value) for value in self._ordered(column)]
+        return result
+
+    def memory_usage_bytes(self):
+        return sum(column.itemsize * len(column) for column in self._arrays)
+
+    def _ordered(self, column):
+        if self.capacity is None:
+            return column
+        if self._appended <= self.capacity:
+            return column[:self._appended]
+
+        start = self._appended % self.capacity
+        return column[start:] + column[:start]
+
+    @staticmethod
+    def _coerce(typecode, value):
+        if value is None:
+            return math.nan if typecode == 'd' else 0
+        return float(value) if typecode == 'd' else int(value)
+
+    @staticmethod
+    def _uncoerce(typecode, value):
+        if typecode == 'd' and math.isnan(value):
+            return None
+        return value
+
+
+def series_max(values, default=0):
+    if len(values) == 0:
+        return default
+    return np.max(values).item() if np is not None and isinstance(values, np.ndarray) else max(values)
+
+
+def series_min(values, default=0):
+    if len(values) == 0:
+        return default
+    return np.min(values).item() if np is not None and isinstance(values, np.ndarray) else min(values)
+
+
+def series_sum(values):
+    if np is not None and isinstance(values, np.ndarray):
+        return np.sum(values).item()
+    if getattr(values, 'typecode', 'd') == 'q':
+        return sum(values)
+    return math.fsum(values)
+
+
+def series_mean(values, default=0):
+    if len(values) == 0:
+        return default
+    return series_sum(values) / len(values)
+
+
+def series_nonzero(values):
+    if np is not None and isinstance(values, np.ndarray):
+        return values[values != 0]
+    return [value for value in values if value]
+
+
+def series_finite(values):
+    """Drop missing (NaN) values"""
+    if np is not None and isinstance(values, np.ndarray):
+        return values[~np.isnan(values)]
+    return [value for value in values if not math.isnan(value)]
+
+
+def series_diff(values):
+    """Differences between consecutive values"""
+    if np is not None and isinstance(values, np.ndarray):
+        return np.diff(values)
+    return [b - a for a, b in zip(values[:-1], values[1:])]
+
+
+def distribution_stats(values, percentiles=DEFAULT_PERCENTILES, histogram_bins=10):
+    """Count, min/max, mean, standard deviation, coefficient of variation, percentiles and histogram of a series"""
+    count = len(values)
+    if count == 0:
+        stats = {'count': 0, 'min': 0, 'max': 0, 'mean': 0, 'std': 0, 'cv': 0}
+        stats.update({f'p{p}': 0 for p in percentiles})
+        stats['histogram'] = {'edges': [], 'counts': []}
+        return stats
+
+    # Everything below is derived from a single sort: extremes, percentiles and histogram bin counts
+    if np is not None:
+        ordered = np.sort(np.asarray(values, dtype=np.float64))
+        minimum, maximum = ordered[0].item(), ordered[-1].item()
+        mean = ordered.mean().item()
+        std = ordered.std(ddof=1).item() if count > 1 else 0.0
+    else:
+        ordered = sorted(values)
+        minimum, maximum = float(ordered[0]), float(ordered[-1])
+        mean = math.fsum(ordered) / count
+        std = math.sqrt(math.fsum((value - mean) ** 2 for value in ordered) / (count - 1)) if count > 1 else 0.0
+
+    stats = {
+        'count': count,
+        'min': minimum,
+        'max': maximum,
+        'mean': mean,
+        'std': std,
+        'cv': std / mean if mean else 0,
+    }
+
+    for p in percentiles:
+        stats[f'p{p}'] = _sorted_percentile(ordered, p)
+
+    stats['histogram'] = _sorted_histogram(ordered, minimum, maximum, histogram_bins)
+    return stats
+
+
+def _sorted_percentile(ordered, percentile):
+    # Linear interpolation between closest ranks (same as NumPy's default method)
+    rank = (len(ordered) - 1) * percentile / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    fraction = rank - lower
+    return float(ordered[lower]) + (float(ordered[upper]) - float(ordered[lower])) * fraction
+
+
+def _sorted_histogram(ordered, minimum, maximum, bins):
+    # Equal-width bins over [min, max]; the last bin is closed, as in numpy.histogram
+    if maximum == minimum:
+        return {'edges': [minimum, maximum], 'counts': [len(ordered)]}
+
+    width = (maximum - minimum) / bins
+    edges = [minimum + width * i for i in range(bins)] + [maximum]
+
+    if np is not None:
+        positions = np.searchsorted(ordered, edges[1:-1], side='left').tolist()
+    else:
+        positions = [bisect_left(ordered, edge) for edge in edges[1:-1]]
+
+    bounds = [0] + positions + [len(ordered)]
+    return {'edges': edges, 'counts': [bounds[i + 1] - bounds[i] for i in range(bins)]}
+
+
+DOWNSAMPLING_METHODS = ("lttb", "minmax")
+
+
+def lttb_indices(x, y, budget):
+    """Indices of the budget points largest-triangle-three-buckets keeps of a series of finite values.
+
+    The first and last points are always kept; from each bucket in between, the point spanning the largest
+    triangle with the point kept before it and the average of the next bucket, which keeps peaks and shape.
+    """
+    count = len(y)
+    if budget >= count:
+        return list(range(count))
+    if budget < 3:
+        raise ValueError("LTTB needs a budget of at least 3 points.")
+
+    # Bucket i covers points [edges[i], edges[i + 1]); the first and last point have buckets of their own
+    every = (count - 2) / (budget - 2)
+    edges = [int(i * every) + 1 for i in range(budget - 1)] + [count - 1]
+
+    selected = [0]
+    previous = 0
+
+    if np is not None:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        for bucket in range(budget - 2):
+            start, end = edges[bucket], edges[bucket + 1]
+            next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+            average_x = x[end:next_end].mean() if next_end > end else x[-1]
+            average_y = y[end:next_end].mean() if next_end > end else y[-1]
+
+            # Twice the triangle areas; the constant factor does not change the largest one
+            areas = np.abs((x[previous] - average_x) * (y[start:end] - y[previous]) - (x[previous] - x[start:end]) * (average_y - y[previous]))
+            previous = start + int(np.argmax(areas))
+            selected.append(previous)
+    else:
+        for bucket in range(budget - 2):
+            start, end = edges[bucket], edges[bucket + 1]
+            next_end = edges[bucket + 2] if bucket + 2 < len(edges) else count
+            next_points = range(end, next_end) if next_end > end else [count - 1]
+            average_x = math.fsum(x[i] for i in next_points) / len(next_points)
+            average_y = math.fsum(y[i] for i in next_points) / len(next_points)
+
+            previous_x, previous_y = x[previous], y[previous]
+            previous = max(range(start, end), key=lambda i: abs((previous_x - average_x) * (y[i] - previous_y) - (previous_x - x[i]) * (average_y - previous_y)))
+            selected.append(previous)
+
+    selected.append(count - 1)
+    return selected
+
+
+def minmax_indices(y, budget):
+    """Indices of the minimum and maximum of each of (budget - 2) / 2 equal buckets, plus the first and last point"""
+    count = len(y)
+    if budget >= count:
+        return list(range(count))
+    if budget < 4:
+        raise ValueError("Min/max downsampling needs a budget of at least 4 points.")
+
+    buckets = (budget - 2) // 2
+    every = (count - 2) / buckets
+    edges = [int(i * every) + 1 for i in range(buckets)] + [count - 1]
+
+    selected = {0, count - 1}
+    if np is not None:
+        y = np.asarray(y, dtype=np.float64)
+        starts = np.asarray(edges[:-1])
+        # reduceat gives each bucket's extreme; the first position holding it is its index
+        minimums = np.minimum.reduceat(y[:count - 1], starts)
+        maximums = np.maximum.reduceat(y[:count - 1], starts)
+        bucket_of = np.repeat(np.arange(buckets), np.diff(edges))
+        interior = y[1:count - 1]
+        for extremes in (minimums, maximums):
+            hits = np.flatnonzero(interior == extremes[bucket_of]) + 1
+            first_hits = hits[np.unique(bucket_of[hits - 1], return_index=True)[1]]
+            selected.update(first_hits.tolist())
+    else:
+        for start, end in zip(edges[:-1], edges[1:]):
+            selected.add(min(range(start, end), key=lambda i: y[i]))
+            selected.add(max(range(start, end), key=lambda i: y[i]))
+
+    return sorted(selected)
+
+
+def downsample_indices(x, columns, budget, method="lttb"):
+    """Rows to keep so that every column, drawn over x from at most budget rows, keeps its shape and peaks.
+
+    Each column picks its own points with the method; the per-column budget is the largest one whose union over
+    all columns still fits into budget rows. The minimum and maximum of every column are always kept, so the
+    result only exceeds budget when budget is smaller than twice the number of columns.
+    """
+    if method not in DOWNSAMPLING_METHODS:
+        raise ValueError(f"Unknown downsampling method {method}, expected one of {DOWNSAMPLING_METHODS}.")
+
+    count = len(x)
+    if budget >= count:
+        return list(range(count))
+
+    series = []
+    required = {0, count - 1}
+    for values in columns.values():
+        values = _selection_values(values)
+        if values is None:
+            continue  # constant or empty, any row shows it
+        series.append(values)
+        required.add(min(range(count), key=values.__getitem__) if np is None else int(np.argmin(values)))
+        required.add(max(range(count), key=values.__getitem__) if np is None else int(np.argmax(values)))
+
+    def rows_for(column_budget):
+        rows = set(required)
+        for values in series:
+            rows.update(lttb_indices(x, values, column_budget) if method == "lttb" else minmax_indices(values, column_budget))
+        return rows
+
+    # The union grows with the per-column budget, so a binary search finds the largest one that fits
+    low, high = (3 if method == "lttb" else 4), budget
+    best = required
+    while low <= high:
+        middle = (low + high) // 2
+        rows = rows_for(middle)
+        if len(rows) <= budget:
+            best, low = rows, middle + 1
+        else:
+            high = middle - 1
+
+    return sorted(best)
+
+
+def _selection_values(values):
+    # Series used to choose rows: missing values take the mean so they neither win nor hide peaks
+    if np is not None:
+        values = np.asarray(values, dtype=np.float64)
+        finite = np.isfinite(values)
+        if not finite.any() or values[finite].min() == values[finite].max():
+            return None
+        return np.where(finite, values, values[finite].mean())
+
+    present = [value for value in values if value is not None and math.isfinite(value)]
+    if not present or min(present) == max(present):
+        return None
+    mean = math.fsum(present) / len(present)
+    return [value if value is not None and math.isfinite(value) else mean for value in values]
+
+
+class MetricsStreamWriter:
+    """Appends samples to an NDJSON file as they are collected, so a crashed run leaves its data behind"""
+
+    FORMAT = "testfarm-metrics-ndjson"
+    VERSION = 1
+
+    # Line layout: a header object (schema and metadata), one JSON array per sample in column order,
+    # and a trailer object written on close. A file without a trailer comes from an interrupted run.
+    def __init__(self, path, columns, metadata=None, flush_interval=5.0):
+        self.path = path
+        self.column_names = [name for name, _ in columns]
+        self.flush_interval = flush_interval
+        self.samples_written = 0
+
+        self._file = open(path, 'w', encoding='utf-8')
+        self._write_line({
+            'type': 'header',
+            'format': MetricsStreamWriter.FORMAT,
+            'version': MetricsStreamWriter.VERSION,
+            'columns': [[name, typecode] for name, typecode in columns],
+            'metadata': metadata or {},
+        })
+        self.flush()
+
+    def write(self, values):
+        """Append one sample given as a sequence of values in column order"""
+        self._write_line(list(values))
+        self.samples_written += 1
+
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def write_record(self, record):
+        """Append one sample given as a dict keyed by column name"""
+        self.write([record.get(name) for name in self.column_names])
+
+    def flush(self):
+        self._file.flush()
+        self._last_flush = time.monotonic()
+
+    def close(self, trailer=None):
+        """Write the trailer (marking the run complete) and close the file"""
+        if self._file.closed:
+            return
+
+        self._write_line({'type': 'trailer', 'samples': self.samples_written, **(trailer or {})})
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # An exception leaves the stream without a trailer, i.e. marked as partial
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def _write_line(self, data):
+        self._file.write(json.dumps(data, separators=(',', ':'), default=str))
+        self._file.write('\n')
+
+
+class MetricsStreamData:
+    """Contents of a metrics stream file: header, samples loaded into a MetricsStore and trailer"""
+
+    def __init__(self, header, samples, trailer):
+        self.header = header
+        self.samples = samples
+        self.trailer = trailer
+
+    @property
+    def metadata(self):
+        return self.header.get('metadata', {})
+
+    @property
+    def complete(self):
+        """False when the writing process died before closing the stream"""
+        return self.trailer is not None
+
+
+def read_metrics_stream(path, capacity=None):
+    """Load a metrics stream file in one pass, tolerating a truncated last line left by a crash"""
+    with open(path, 'r', encoding='utf-8') as f:
+        header_line = f.readline()
+        try:
+            header = json.loads(header_line)
+        except ValueError:
+            raise ValueError(f"Metrics stream {path} has no valid header.")
+
+        if header.get('format') != MetricsStreamWriter.FORMAT:
+            raise ValueError(f"File {path} is not a metrics stream.")
+        if header.get('version', 0) > MetricsStreamWriter.VERSION:
+            raise ValueError(f"Unsupported metrics stream version {header.get('version')} in {path}.")
+
+        samples = MetricsStore([tuple(column) for column in header['columns']], capacity=capacity)
+        trailer = None
+
+        for line in f:
+            if not line.endswith('\n'):
+                break  # Last line cut off mid-write
+
+            try:
+                data = json.loads(line)
+            except ValueError:
+                break
+
+            if isinstance(data, list):
+                samples.append(data)
+            elif data.get('type') == 'trailer':
+                trailer = data
+                break
+
+    return MetricsStreamData(header, samples, trailer)
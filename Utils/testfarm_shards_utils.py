@@ -0,0 +1,139 @@
+import os
+import statistics
+from typing import List, Optional, Sequence
+
+from testfarm_columnar_utils import load_results, save_results, results_format
+
+
+__all__ = [
+    "get_bench_shard",
+    "shard_iterations",
+    "merge_shard_results",
+    "merge_shard_result_files"
+]
+
+
+def get_bench_shard() -> tuple:
+    """(index, count) of the shard the current benchmark process belongs to; (0, 1) when not sharded."""
+    return int(os.environ.get("TF_BENCH_SHARD_INDEX", "0")), int(os.environ.get("TF_BENCH_SHARD_COUNT", "1"))
+
+
+def shard_iterations(total: int, index: int, count: int) -> int:
+    """Number of iterations shard index of count runs, spreading the remainder over the first shards."""
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {index} of {count}.")
+    return total // count + (1 if index < total % count else 0)
+
+
+def merge_shard_results(shard_results: Sequence[dict], metrics: Optional[List[str]] = None) -> dict:
+    """Combine the results files of a benchmark's shards, reporting the spread between hosts separately.
+
+    Each shard's results carry a "shard" section (index, count, host, hardware_class) written by the executor.
+    Iterations are concatenated in shard order and renumbered; metrics are dotted paths in metrics_summary.
+    Like the benchmark history, the host variance leaves out profiled iterations and the baseline (A) side
+    of A/B runs; those entries stay in the merged iterations with their tags.
+    """
+    if not shard_results:
+        raise ValueError("No shard results to merge.")
+
+    metrics = metrics or ["summary.duration_seconds"]
+    shard_results = sorted(shard_results, key=lambda results: results["shard"]["index"])
+
+    count = shard_results[0]["shard"]["count"]
+    indexes = [results["shard"]["index"] for results in shard_results]
+    if len(set(indexes)) != len(indexes):
+        raise ValueError(f"Duplicate shards in merge: {indexes}.")
+    if any(results["shard"]["count"] != count for results in shard_results):
+        raise ValueError("Shard results come from runs with different shard counts.")
+
+    iterations = []
+    shards = []
+    for results in shard_results:
+        shard = results["shard"]
+        for entry in results.get("iterations", []):
+            iterations.append(dict(entry, id=len(iterations), shard=shard["index"], host=shard["host"]))
+
+        # Everything but the iterations stays per shard, e.g. its environment fingerprint
+        shards.append(dict(shard, sections={key: value for key, value in results.items() if key not in ("iterations", "shard")}))
+
+    hardware_classes = sorted({shard.get("hardware_class") or "unknown" for shard in shards})
+
+    return {
+        "iterations": iterations,
+        "shards": shards,
+        "shard_count": count,
+        "missing_shards": sorted(set(range(count)) - set(indexes)),
+        "complete": len(indexes) == count,
+        "hardware_classes": hardware_classes,
+        "hardware_mismatch": len(hardware_classes) > 1,
+        "host_variance": {metric: _host_variance(iterations, metric) for metric in metrics}
+    }
+
+
+def merge_shard_result_files(input_files: Sequence[str], output_file: str, metrics: Optional[List[str]] = None) -> dict:
+    """Merge results files of shards, JSON or columnar; the merged file has the format of the first one."""
+    if not input_files:
+        raise ValueError("No shard results to merge.")
+
+    shard_results = [load_results(input_file) for input_file in input_files]
+    merged = merge_shard_results(shard_results, metrics)
+
+    save_results(output_file, merged, results_format(input_files[0]))
+    return merged
+
+
+def _host_variance(iterations: List[dict], metric: str) -> dict:
+    by_host = {}
+    for entry in iterations:
+        # Profiler overhead and the baseline build would blur the comparison of hosts
+        if entry.get("profiled") or entry.get("variant") == "A":
+            continue
+
+        value = _metric_value(entry.get("metrics_summary", {}), metric)
+        if value is not None:
+            by_host.setdefault(entry["host"], []).append(value)
+
+    values = [value for host_values in by_host.values() for value in host_values]
+    hosts = {
+        host: {
+            "iterations": len(host_values),
+            "mean": statistics.fmean(host_values),
+            "median": statistics.median(host_values),
+            "stdev": statistics.stdev(host_values) if len(host_values) > 1 else None
+        }
+        for host, host_values in by_host.items()
+    }
+
+    summary = {
+        "iterations": len(values),
+        "mean": statistics.fmean(values) if values else None,
+        "stdev": statistics.stdev(values) if len(values) > 1 else None,
+        "hosts": hosts
+    }
+
+    # One-way ANOVA split of the spread into differences between hosts and noise within them
+    if len(by_host) > 1 and len(values) > len(by_host):
+        grand_mean = summary["mean"]
+        between = sum(len(host_values) * (statistics.fmean(host_values) - grand_mean) ** 2 for host_values in by_host.values())
+        within = sum((value - statistics.fmean(host_values)) ** 2 for host_values in by_host.values() for value in host_values)
+
+        between_mean_square = between / (len(by_host) - 1)
+        within_mean_square = within / (len(values) - len(by_host))
+
+        summary["between_host_variance"] = between_mean_square
+        summary["within_host_variance"] = within_mean_square
+        # None rather than infinity for hosts without any noise, JSON has no infinity
+        summary["f_statistic"] = between_mean_square / within_mean_square if within_mean_square > 0 else None
+        summary["between_host_share"] = between / (between + within) if between + within > 0 else 0.0
+
+    return summary
+
+
+def _metric_value(summary: dict, metric: str) -> Optional[float]:
+    value = summary
+    for key in metric.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
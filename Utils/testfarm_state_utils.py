@@ -0,0 +1,205 @@
+import os
+import json
+import mmap
+import time
+import zlib
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+__all__ = [
+    "BenchmarkState",
+    "STATE_FILE_ENV_VAR"
+]
+
+# Benchmark processes started by the executor find the state file through this variable
+STATE_FILE_ENV_VAR = "TF_BENCH_STATE_FILE"
+
+_MAGIC = b"TFST"
+_VERSION = 1
+_DEFAULT_SIZE = 64 * 1024
+
+# File header: magic, version, active slot, slot size; then two slots of header and JSON payload
+_FILE_HEADER = struct.Struct("<4sHHI")
+_SLOT_HEADER = struct.Struct("<QII")  # sequence, payload length, payload CRC-32
+_FILE_HEADER_SIZE = 16
+
+_READ_ATTEMPTS = 100
+
+
+class BenchmarkState:
+    """Small key/value state shared by the executor and benchmark scripts through a memory-mapped file.
+
+    Writers serialize on a lock file, write the new state into the inactive of two slots and then flip the
+    active slot index, so a crash in the middle of a write never leaves a corrupt state behind. Readers do
+    not lock; they verify the slot checksum and retry if a writer flipped slots under them.
+    """
+
+    def __init__(self, path: str, size: int = _DEFAULT_SIZE):
+        if size < _FILE_HEADER_SIZE + 2 * (_SLOT_HEADER.size + 2):
+            raise ValueError(f"Benchmark state file size {size} is too small.")
+
+        self.path = path
+        self._lock_file = open(f"{path}.lock", 'a+b')
+        self._thread_lock = threading.Lock()
+
+        with self._locked():
+            if not self._is_valid(path, size):
+                self._initialize(path, size)
+
+            self._file = open(path, 'r+b')
+            self._map = mmap.mmap(self._file.fileno(), 0)
+
+        _, _, _, self._slot_size = _FILE_HEADER.unpack_from(self._map, 0)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._lock_file.close()
+            self._map = None
+
+    def snapshot(self) -> dict:
+        for _ in range(_READ_ATTEMPTS):
+            state = self._read_active()
+            if state is not None:
+                return state
+
+        # Writers keep flipping slots under us; wait for one to finish instead
+        with self._locked():
+            state = self._read_active()
+            if state is None:
+                raise RuntimeError(f"Benchmark state file {self.path} is corrupt.")
+            return state
+
+    def get(self, key: str, default=None):
+        return self.snapshot().get(key, default)
+
+    def set(self, key: str, value):
+        self.update(**{key: value})
+
+    def update(self, **values):
+        with self._locked():
+            state = self._read_active() or {}
+            state.update(values)
+            self._write(state)
+
+    def increment(self, key: str, amount: int = 1) -> int:
+        with self._locked():
+            state = self._read_active() or {}
+            state[key] = state.get(key, 0) + amount
+            self._write(state)
+            return state[key]
+
+    def reset(self, initial: dict = None):
+        with self._locked():
+            self._write(dict(initial or {}))
+
+    def _read_active(self):
+        _, _, active, _ = _FILE_HEADER.unpack_from(self._map, 0)
+        offset = self._slot_offset(active)
+
+        sequence, length, checksum = _SLOT_HEADER.unpack_from(self._map, offset)
+        if length > self._slot_size - _SLOT_HEADER.size:
+            return None
+
+        start = offset + _SLOT_HEADER.size
+        payload = self._map[start:start + length]
+        if zlib.crc32(payload) != checksum or _SLOT_HEADER.unpack_from(self._map, offset)[0] != sequence:
+            return None
+
+        return json.loads(payload)
+
+    def _write(self, state: dict):
+        payload = json.dumps(state, separators=(',', ':')).encode('utf-8')
+        if len(payload) > self._slot_size - _SLOT_HEADER.size:
+            raise ValueError(f"Benchmark state of {len(payload)} bytes does not fit into {self.path}.")
+
+        magic, version, active, slot_size = _FILE_HEADER.unpack_from(self._map, 0)
+        sequence = _SLOT_HEADER.unpack_from(self._map, self._slot_offset(active))[0]
+
+        inactive = 1 - active
+        offset = self._slot_offset(inactive)
+        start = offset + _SLOT_HEADER.size
+        self._map[start:start + len(payload)] = payload
+        _SLOT_HEADER.pack_into(self._map, offset, sequence + 1, len(payload), zlib.crc32(payload))
+
+        # The flip is a single aligned store: readers see either the old or the new slot
+        _FILE_HEADER.pack_into(self._map, 0, magic, version, inactive, slot_size)
+
+    def _slot_offset(self, slot: int) -> int:
+        return _FILE_HEADER_SIZE + slot * self._slot_size
+
+    def _locked(self):
+        return _FileLock(self._lock_file, self._thread_lock)
+
+    @staticmethod
+    def _is_valid(path: str, size: int) -> bool:
+        if not os.path.exists(path) or os.path.getsize(path) < _FILE_HEADER_SIZE:
+            return False
+
+        with open(path, 'rb') as f:
+            magic, version, active, slot_size = _FILE_HEADER.unpack(f.read(_FILE_HEADER.size))
+
+        return magic == _MAGIC and version == _VERSION and active in (0, 1) and os.path.getsize(path) == _FILE_HEADER_SIZE + 2 * slot_size
+
+    @staticmethod
+    def _initialize(path: str, size: int):
+        slot_size = (size - _FILE_HEADER_SIZE) // 2
+        payload = b"{}"
+
+        data = bytearray(_FILE_HEADER_SIZE + 2 * slot_size)
+        _FILE_HEADER.pack_into(data, 0, _MAGIC, _VERSION, 0, slot_size)
+        _SLOT_HEADER.pack_into(data, _FILE_HEADER_SIZE, 0, len(payload), zlib.crc32(payload))
+        data[_FILE_HEADER_SIZE + _SLOT_HEADER.size:_FILE_HEADER_SIZE + _SLOT_HEADER.size + len(payload)] = payload
+
+        # Replace any old or damaged file at once, readers never see a half-written one
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+
+class _FileLock:
+    # Record locks are owned by the process (unlike flock, also across fork); threads take the thread lock first
+    def __init__(self, lock_file, thread_lock):
+        self._fd = lock_file.fileno()
+        self._thread_lock = thread_lock
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.01)  # LK_LOCK gives up after about 10 seconds
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        self._thread_lock.release()
@@ -0,0 +1,43 @@
+import math
+
+from testfarm_columnar_utils import ColumnTable, encode_columnar_results, decode_columnar_results, downsample_results
+
+
+def round_trip(samples):
+    return decode_columnar_results(encode_columnar_results({'iterations': [{'id': 1, 'metrics_detailed': samples}]}), as_records=True)['iterations'][0]['metrics_detailed']
+
+
+def test_nullable_float_leaf():
+    samples = [{'cpu': 1.5}, {'cpu': None}, {'cpu': 2.0}]
+    assert round_trip(samples) == samples
+
+
+def test_nullable_integer_leaf():
+    samples = [{'rss': 100}, {'rss': None}]
+    restored = round_trip(samples)
+    assert restored == samples
+    assert isinstance(restored[0]['rss'], int)
+
+
+def test_sparse_leaves_come_back_as_none():
+    samples = [{'cpu': 1.5, 'process': {'rss': 10}}, {'process': {'rss': 11, 'threads': 3}}]
+    assert round_trip(samples) == [
+        {'cpu': 1.5, 'process': {'rss': 10, 'threads': None}},
+        {'cpu': None, 'process': {'rss': 11, 'threads': 3}}
+    ]
+
+
+def test_downsample_nullable_leaf():
+    samples = [{'elapsed_time': i * 0.1, 'cpu': None if i % 7 == 0 else float(i % 13)} for i in range(200)]
+    samples[77]['cpu'] = 100.0
+
+    reduced = downsample_results({'metrics_detailed': samples}, 20)
+
+    assert len(reduced['metrics_detailed']) <= 20
+    assert max(sample['cpu'] for sample in reduced['metrics_detailed'] if sample['cpu'] is not None) == 100.0
+    assert reduced['downsampling']['metrics_detailed']['rows'] == 200
+
+
+def test_table_column_holds_nan_for_nulls():
+    table = ColumnTable.from_records([{'cpu': 1.5}, {'cpu': None}])
+    assert math.isnan(table.column('cpu')[1])